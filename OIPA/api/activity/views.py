@@ -42,8 +42,9 @@ from api.country.serializers import CountrySerializer
 from api.generics.filters import DistanceFilter, SearchFilter
 from api.generics.views import (
     DynamicDetailCRUDView, DynamicDetailView, DynamicListCRUDView,
-    DynamicListView, SaveAllSerializer
+    DynamicListView, SaveAllSerializer, StreamingListMixin
 )
+from api.pagination import CustomCursorPagination
 from api.publisher.permissions import PublisherPermissions
 from api.region.serializers import RegionSerializer
 from api.sector.serializers import SectorSerializer
@@ -259,7 +260,7 @@ class ActivityAggregations(AggregationView):
     )
 
 
-class ActivityList(DynamicListView):
+class ActivityList(StreamingListMixin, DynamicListView):
 
     """
     Returns a list of IATI Activities stored in OIPA.
@@ -347,6 +348,11 @@ class ActivityList(DynamicListView):
 
     The user may also specify reverse orderings by prefixing the field name with '-', like so: `-title`
 
+    ## Cursor pagination
+
+    When walking through all pages, add an empty `cursor` parameter (`?cursor=`) and follow the `next` links.
+    Later pages are as fast as the first one, the count is skipped unless `count=exact` or `count=estimate` is given.
+
     ## Aggregations
 
     At the moment there's no direct aggregations on this endpoint.
@@ -371,6 +377,7 @@ class ActivityList(DynamicListView):
     )
     filter_class = ActivityFilter
     serializer_class = ActivitySerializer
+    pagination_class = CustomCursorPagination
 
     # make sure we can always have info about selectable fields,
     # stored into dict. This dict is populated in the DynamicView class using
@@ -398,17 +405,20 @@ class ActivityList(DynamicListView):
                    'recipient_country.country.code': {'header': 'country'},
                    'recipient_region.region.code': {'header': 'region'},
         }
-    # Get all transaction type
-    transaction_types = []
     # Activity break down column
     break_down_by = 'sector'
     # selectable fields which required different render logic.
     # Instead merging values using the delimiter, this fields will generate
     # additional columns for the different values, based on defined criteria.
-    exceptional_fields = [{'transaction_types': transaction_types}]  # NOQA: E501
+    # The transaction types are set per request, see __init__.
+    exceptional_fields = [{'transaction_types': []}]  # NOQA: E501
+    # all transaction type codes, loaded once (see get_transaction_types):
+    _transaction_types = ()
 
     always_ordering = 'id'
 
+    streaming_formats = ('xml', 'csv', 'xls')
+
     ordering_fields = (
         'title',
         'recipient_country',
@@ -427,8 +437,19 @@ class ActivityList(DynamicListView):
     def __init__(self, *args, **kwargs):
         super(ActivityList, self).__init__(*args, **kwargs)
 
-        for transaction_type in list(TransactionType.objects.all()):
-            self.transaction_types.append(transaction_type.code)
+        # a list of this request, the CSV and XLS renderers change it:
+        self.exceptional_fields = [
+            {'transaction_types': list(self.get_transaction_types())}
+        ]
+
+    @classmethod
+    def get_transaction_types(cls):
+        # not kept while the codelist hasn't been imported yet
+        if not cls._transaction_types:
+            cls._transaction_types = tuple(
+                TransactionType.objects.values_list('code', flat=True))
+
+        return cls._transaction_types
 
     @method_decorator(
         cache_page(settings.CACHES.get('default').get('TIMEOUT'))
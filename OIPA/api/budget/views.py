@@ -12,8 +12,9 @@ from api.budget.filters import RelatedOrderingFilter
 from api.budget.serializers import BudgetSerializer
 from api.country.serializers import CountrySerializer
 from api.generics.filters import SearchFilter
-from api.generics.views import DynamicListView
+from api.generics.views import DynamicListView, StreamingListMixin
 from api.organisation.serializers import OrganisationSerializer
+from api.pagination import CustomCursorPagination
 from api.region.serializers import RegionSerializer
 from api.sector.serializers import SectorSerializer
 from geodata.models import Country, Region
@@ -349,7 +350,7 @@ class BudgetAggregations(AggregationView):
         return super(BudgetAggregations, self).dispatch(*args, **kwargs)
 
 
-class BudgetList(DynamicListView):
+class BudgetList(StreamingListMixin, DynamicListView):
     """
     Returns a list of IATI Budget stored in OIPA.
 
@@ -366,6 +367,8 @@ class BudgetList(DynamicListView):
     )
     filter_class = filters.BudgetFilter
     serializer_class = BudgetSerializer
+    pagination_class = CustomCursorPagination
+    streaming_formats = ('csv', 'xls')
 
     # make sure we can always have info about selectable fields,
     # stored into dict. This dict is populated in the DynamicView class using
@@ -10,6 +10,7 @@ from api.activity import filters
 from api.export import serializers as export_serializers
 from api.generics.filters import SearchFilter
 from api.generics.utils import get_serializer_fields
+from api.generics.views import StreamingListMixin
 from api.pagination import IatiXMLPagination
 from api.publisher.permissions import PublisherPermissions
 from api.renderers import XMLRenderer
@@ -19,7 +20,7 @@ from iati_synchroniser.models import Dataset
 from task_queue.tasks import export_publisher_activities
 
 
-class IATIActivityList(ListAPIView):
+class IATIActivityList(StreamingListMixin, ListAPIView):
 
     """IATI representation for activities"""
 
@@ -127,10 +128,16 @@ class IATIActivityNextExportListResult(APIView):
         elif job.is_queued:
             ret = {'status': 'in-queue'}
         elif job.is_started:
-            ret = {'status': 'waiting'}
+            ret = {'status': 'waiting', 'progress': job.meta.get('progress')}
         elif job.is_failed:
             ret = {'status': 'failed',
                    'message': "job failed for unknown reasons"}
             print(job.to_dict())
 
+            # a new export continues where this one stopped, unless the
+            # activities changed since (see PublisherActivityExport)
+            Dataset.objects.filter(
+                publisher_id=publisher_id, filetype=1, added_manually=True
+            ).update(export_in_progress=False)
+
         return Response(ret)
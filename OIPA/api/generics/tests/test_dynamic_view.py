@@ -0,0 +1,54 @@
+from django.test import TestCase
+
+from api.activity.views import ActivityList
+from api.generics.views import DynamicView
+from iati.models import Activity
+from iati_codelists.factory.codelist_factory import TransactionTypeFactory
+
+
+class DynamicViewTestCase(TestCase):
+
+    def setUp(self):
+        DynamicView._field_metadata.clear()
+
+    def test_field_metadata_is_computed_once(self):
+        first = ActivityList()
+        second = ActivityList()
+
+        self.assertEqual(len(DynamicView._field_metadata), 1)
+        self.assertIs(first.serializer_fields, second.serializer_fields)
+        self.assertIn('iati_identifier', first.serializer_fields)
+        self.assertIn('publisher', first.select_related_fields)
+
+    def test_prefetch_plan(self):
+        view = ActivityList()
+        queryset_class = Activity.objects.all().__class__
+
+        select_related_fields, prefetches = view.get_prefetch_plan(
+            queryset_class, ('iati_identifier', 'publisher', 'title'))
+
+        self.assertEqual(select_related_fields, ['publisher'])
+        self.assertEqual(prefetches, ['prefetch_title'])
+        self.assertIs(
+            view.get_prefetch_plan(
+                queryset_class, ('iati_identifier', 'publisher', 'title')),
+            view.get_prefetch_plan(
+                queryset_class, ('iati_identifier', 'publisher', 'title')))
+
+
+class ActivityListTransactionTypesTestCase(TestCase):
+
+    def setUp(self):
+        ActivityList._transaction_types = ()
+        TransactionTypeFactory.create(code='1')
+        TransactionTypeFactory.create(code='2', name='Commitment')
+
+    def test_transaction_types_do_not_grow(self):
+        ActivityList()
+        view = ActivityList()
+
+        self.assertEqual(
+            view.exceptional_fields,
+            [{'transaction_types': ['1', '2']}])
+        self.assertEqual(
+            ActivityList.exceptional_fields, [{'transaction_types': []}])
@@ -1,6 +1,8 @@
 import copy
+from functools import lru_cache
 
 from django.db.models.fields.related import ForeignKey, OneToOneField
+from django.http import StreamingHttpResponse
 from rest_framework import mixins
 from rest_framework.generics import (
     GenericAPIView, ListAPIView, ListCreateAPIView, RetrieveAPIView,
@@ -10,6 +12,8 @@ from rest_framework.generics import (
 from api.generics.serializers import (
     DynamicFieldsModelSerializer, DynamicFieldsSerializer
 )
+from api.middleware import set_export_file_name
+from common.util import iterate_in_slices
 
 
 class DynamicView(GenericAPIView):
@@ -21,17 +25,15 @@ class DynamicView(GenericAPIView):
     fields = ()
     selectable_fields = ()
 
+    # (view class, serializer class) -> field metadata, see
+    # get_field_metadata:
+    _field_metadata = {}
+
     def __init__(self, *args, **kwargs):
         """
         Extract prefetches and default fields from Meta
         """
-        # TODO: move this to a meta class, to evaluate once when defining the
-        # class
-        # TODO: This is not efficient - 2016-01-20
-
         serializer_class = self.get_serializer_class()
-        serializer = serializer_class()  # need an instance to extract fields
-        model = serializer_class.Meta.model
 
         assert issubclass(
             serializer_class, DynamicFieldsModelSerializer
@@ -40,20 +42,57 @@ class DynamicView(GenericAPIView):
              DynamicFieldsModelSerializer " "instead got %s"
         ) % (serializer_class.__name__,)
 
-        self.serializer_fields = serializer.fields.keys()
+        (
+            self.serializer_fields,
+            self.select_related_fields,
+            self.field_source_mapping,
+        ) = self.get_field_metadata(serializer_class)
+
+    @classmethod
+    def get_field_metadata(cls, serializer_class):
+        """
+        The serializer fields, select_related() fields and field source
+        mapping of a view. Building a serializer with all of its (nested)
+        fields is expensive, so it's done once per view class instead of on
+        every request.
+        """
+        key = (cls, serializer_class)
+
+        if key not in cls._field_metadata:
+            # need an instance to extract fields:
+            serializer = serializer_class()
+            model = serializer_class.Meta.model
 
-        self.select_related_fields = [
-            field.name for field in model._meta.fields
-            if isinstance(field, (ForeignKey, OneToOneField))
-        ]
+            serializer_fields = tuple(serializer.fields.keys())
 
-        self.field_source_mapping = {
-            field.field_name: field.source
-            for field in serializer.fields.values()
-            if isinstance(
-                field, (ForeignKey, OneToOneField)
+            select_related_fields = tuple(
+                field.name for field in model._meta.fields
+                if isinstance(field, (ForeignKey, OneToOneField))
             )
-        }
+
+            field_source_mapping = {
+                field.field_name: field.source
+                for field in serializer.fields.values()
+                if isinstance(
+                    field, (ForeignKey, OneToOneField)
+                )
+            }
+
+            cls._field_metadata[key] = (
+                serializer_fields,
+                select_related_fields,
+                field_source_mapping,
+            )
+
+        return cls._field_metadata[key]
+
+    def get_prefetch_plan(self, queryset_class, fields):
+        """
+        The select_related() fields and prefetch_<field> queryset methods
+        for a combination of requested fields
+        """
+        return _get_prefetch_plan(
+            tuple(self.select_related_fields), queryset_class, tuple(fields))
 
     def _get_query_fields(self):
         if not self.request:
@@ -132,17 +171,15 @@ class DynamicView(GenericAPIView):
         if not fields:
             fields = self.serializer_fields
 
-        select_related_fields = list(set(
-            self.select_related_fields
-        ) & set(fields))
+        select_related_fields, prefetches = self.get_prefetch_plan(
+            queryset.__class__, fields)
 
         if select_related_fields:
             queryset = queryset.select_related(*select_related_fields)
 
-        for field in fields:
+        for prefetch in prefetches:
             # TODO: Hook this up in the view - 2016-01-15
-            if hasattr(queryset, 'prefetch_%s' % field):
-                queryset = getattr(queryset, 'prefetch_%s' % field)()
+            queryset = getattr(queryset, prefetch)()
 
         queryset = super(DynamicView, self).filter_queryset(
             queryset, *args, **kwargs
@@ -161,6 +198,66 @@ class DynamicView(GenericAPIView):
         )
 
 
+@lru_cache(maxsize=1024)
+def _get_prefetch_plan(select_related_fields, queryset_class, fields):
+    select_related_fields = list(set(select_related_fields) & set(fields))
+
+    prefetches = [
+        'prefetch_%s' % field for field in fields
+        if hasattr(queryset_class, 'prefetch_%s' % field)
+    ]
+
+    return select_related_fields, prefetches
+
+
+class StreamingListMixin(object):
+    """
+    Streams the list when the accepted renderer can write the items one at a
+    time (see api.renderers.StreamingXMLRendererMixin,
+    api.renderers.PaginatedCSVRenderer.stream and
+    api.renderers.XlsRenderer.stream) and its format is one of
+    streaming_formats. Each item is serialized only when the renderer asks
+    for it.
+    """
+    stream_slice_size = 100
+    streaming_formats = ('xml',)
+
+    def list(self, request, *args, **kwargs):
+        renderer = getattr(request, 'accepted_renderer', None)
+        if not hasattr(renderer, 'stream') or \
+                renderer.format not in self.streaming_formats:
+            return super(StreamingListMixin, self).list(
+                request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            objects = page
+        else:
+            # prefetched per slice:
+            objects = iterate_in_slices(queryset, self.stream_slice_size)
+
+        serializer = self.get_serializer([], many=True).child
+        items = (serializer.to_representation(obj) for obj in objects)
+
+        response = StreamingHttpResponse(
+            renderer.stream(
+                items, renderer_context=self.get_renderer_context()),
+            content_type='{0}; charset={1}'.format(
+                renderer.media_type, renderer.charset)
+        )
+        set_export_file_name(request, response)
+
+        if page is not None:
+            # f.e. the Link header of IatiXMLPagination:
+            link = self.get_paginated_response([]).get('Link')
+            if link:
+                response['Link'] = link
+
+        return response
+
+
 class DynamicListView(DynamicView, ListAPIView):
     """
     List view with dynamic properties
@@ -17,22 +17,29 @@ class FileExportMiddleware:
 
     @staticmethod
     def process_template_response(request, response):
-        # So here we check if the view that we're dealing with
-        # is actually an api view
-        if request.resolver_match.app_name == 'api':
-            if 'format' in request.GET:
-                formatz = request.GET['format']
-
-                if formatz in ['csv', 'xls', 'xml']:
-                    current_url = resolve(request.path_info).url_name
-
-                    if 'export_name' in request.GET:
-                        file_name = request.GET['export_name']
-                    else:
-                        file_name = current_url \
-                            if current_url is not None else 'export'
+        set_export_file_name(request, response)
+        return response
 
-                    response['Content-Disposition'] = \
-                        "attachment; filename={}.{}".format(file_name, formatz)
 
-        return response
+def set_export_file_name(request, response):
+    """
+    Set the 'Content-Disposition' of an exported file, also used for the
+    streamed exports which don't pass process_template_response
+    """
+    # So here we check if the view that we're dealing with
+    # is actually an api view
+    if request.resolver_match.app_name == 'api':
+        if 'format' in request.GET:
+            formatz = request.GET['format']
+
+            if formatz in ['csv', 'xls', 'xml']:
+                current_url = resolve(request.path_info).url_name
+
+                if 'export_name' in request.GET:
+                    file_name = request.GET['export_name']
+                else:
+                    file_name = current_url \
+                        if current_url is not None else 'export'
+
+                response['Content-Disposition'] = \
+                    "attachment; filename={}.{}".format(file_name, formatz)
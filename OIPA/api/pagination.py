@@ -1,6 +1,15 @@
 
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 # TODO: Include 'last' link, see
 # https://developer.github.com/guides/traversing-with-pagination/ -
@@ -44,3 +53,205 @@ class IatiXMLPagination(pagination.PageNumberPagination):
 class IatiXMLUnlimitedPagination(IatiXMLPagination):
     page_size = 0
     max_page_size = 0
+
+
+def estimate_count(queryset):
+    """
+    The number of rows Postgres expects the query of a queryset to return,
+    from its EXPLAIN output. This doesn't run the query, but it can be far
+    off for complicated filters.
+    """
+    sql, params = queryset.query.sql_with_params()
+
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return plan[0]['Plan']['Plan Rows']
+
+
+class CursorPaginationMixin(object):
+    """
+    Adds a keyset (cursor) mode to a page number pagination, used when the
+    request has a `cursor` parameter (empty for the first page).
+
+    A page doesn't use OFFSET, it continues after the values of the ordering
+    columns (with the primary key as the last one) of the last row of the
+    previous page, which the `next` link carries in its cursor. Walking all
+    pages therefore takes the same time for every page.
+
+    The count is skipped in this mode, unless it's asked for with
+    `count=exact` or `count=estimate` (see estimate_count). There is no
+    `previous` link.
+
+    The ordering columns should be columns of the model or of a single
+    valued relation, rows which are repeated by a join on a multi-valued
+    relation may be skipped.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = (
+            self.cursor_query_param in request.query_params and
+            self.get_cursor_ordering(queryset) is not None)
+
+        if not self.cursor_mode:
+            return super(CursorPaginationMixin, self).paginate_queryset(
+                queryset, request, view)
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_cursor_ordering(queryset)
+
+        queryset = queryset.order_by(*self.ordering)
+
+        self.count = self.get_cursor_count(queryset, request)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.get_seek_filter(position))
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        self.next_position = None
+        if self.has_next:
+            self.next_position = queryset.filter(
+                pk=results[-1].pk
+            ).values_list(*self.get_ordering_fields())[0]
+
+        return results
+
+    def get_cursor_ordering(self, queryset):
+        """
+        The ordering of the queryset, ending with the primary key. None when
+        it can't be used for seeking (f.e. an ordering by expression)
+        """
+        ordering = list(
+            queryset.query.order_by or queryset.model._meta.ordering)
+
+        if not all(isinstance(field, str) for field in ordering):
+            return None
+        if any(field == '?' for field in ordering):
+            return None
+
+        fields = [field.lstrip('-') for field in ordering]
+        pk_name = queryset.model._meta.pk.name
+
+        if 'pk' not in fields and pk_name not in fields:
+            ordering.append(pk_name)
+
+        return ordering
+
+    def get_ordering_fields(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def get_seek_filter(self, position):
+        """
+        The rows after position, in the order of self.ordering:
+
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ...
+
+        NULLs are sorted as Postgres does, last in ascending and first in
+        descending order
+        """
+        seek_filter = Q(pk__in=[])
+        equal = Q()
+
+        for field, value in zip(self.ordering, position):
+            descending = field.startswith('-')
+            field = field.lstrip('-')
+
+            if value is None:
+                after = Q(**{field + '__isnull': False}) \
+                    if descending else None
+                same = Q(**{field + '__isnull': True})
+            else:
+                after = Q(**{
+                    field + ('__lt' if descending else '__gt'): value})
+                if not descending:
+                    after |= Q(**{field + '__isnull': True})
+                same = Q(**{field: value})
+
+            if after is not None:
+                seek_filter |= equal & after
+            equal &= same
+
+        return seek_filter
+
+    def get_cursor_count(self, queryset, request):
+        count = request.query_params.get(self.count_query_param)
+
+        if count == 'exact':
+            return queryset.count()
+        if count == 'estimate':
+            return estimate_count(queryset)
+        return None
+
+    def encode_cursor(self, position):
+        cursor = json.dumps(
+            {'o': self.ordering, 'p': list(position)},
+            cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode()
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+
+        try:
+            cursor = json.loads(
+                base64.urlsafe_b64decode(cursor.encode('ascii')).decode())
+        except (TypeError, ValueError):
+            raise NotFound('Invalid cursor')
+
+        # the ordering changed since the cursor was made:
+        if not isinstance(cursor, dict) or cursor.get('o') != self.ordering \
+                or len(cursor.get('p', ())) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+
+        return cursor['p']
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super(CursorPaginationMixin, self).get_next_link()
+        if not self.has_next:
+            return None
+
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(
+            url,
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position))
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super(CursorPaginationMixin, self).get_previous_link()
+        return None
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super(CursorPaginationMixin, self).get_paginated_response(
+                data)
+
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data)
+        ]))
+
+
+class CustomCursorPagination(CursorPaginationMixin, CustomPagination):
+    pass
+
+
+class CustomTransactionCursorPagination(CursorPaginationMixin,
+                                        CustomTransactionPagination):
+    pass
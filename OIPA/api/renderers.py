@@ -5,6 +5,7 @@ from __future__ import unicode_literals
 
 import ast
 import io
+import tempfile
 from collections import OrderedDict
 
 import unicodecsv as csv
@@ -13,6 +14,7 @@ from django.conf import settings
 from django.utils import six
 from lxml import etree
 from lxml.builder import E
+from rest_framework import serializers
 from rest_framework.renderers import BaseRenderer
 from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
 from rest_framework_csv.renderers import CSVRenderer
@@ -42,7 +44,48 @@ from api.iati.references import (
 # TODO: Make this more generic - 2016-01-21
 
 
-class XMLRenderer(BaseRenderer):
+class StreamingXMLRendererMixin(object):
+    """
+    Writes the items of a list one at a time with etree.xmlfile, so memory
+    use doesn't grow with the number of items (see stream)
+    """
+
+    def render_item(self, item):
+        """
+        The element of a single item of the list
+        """
+        raise NotImplementedError
+
+    def stream(self, items, renderer_context=None):
+        """
+        Yields the XML document of all items in chunks, each item is
+        serialized and written as soon as it's taken from items
+        """
+        output = BytesIO()
+
+        with etree.xmlfile(output, encoding=self.charset) as xf:
+            xf.write_declaration()
+
+            with xf.element(self.root_tag_name, version=self.version):
+                xf.write('\n')
+
+                if hasattr(settings, 'EXPORT_COMMENT'):
+                    xf.write(
+                        etree.Comment(getattr(settings, 'EXPORT_COMMENT')),
+                        pretty_print=True)
+
+                for item in items:
+                    xf.write(self.render_item(item), pretty_print=True)
+                    xf.flush()
+
+                    yield output.getvalue()
+                    output.seek(0)
+                    output.truncate()
+
+        yield output.getvalue()
+
+
+class XMLRenderer(StreamingXMLRendererMixin, BaseRenderer):
     """
     Renderer which serializes to XML.
     """
@@ -75,6 +118,11 @@ class XMLRenderer(BaseRenderer):
 
         return etree.tostring(xml, encoding=self.charset, pretty_print=True)
 
+    def render_item(self, item):
+        element = etree.Element(self.item_tag_name)
+        self._to_xml(element, item)
+        return element
+
     def _to_xml(self, xml, data, parent_name=None):
         if isinstance(data, (list, tuple)):
             for item in data:
@@ -258,6 +306,38 @@ class PaginatedCSVRenderer(CSVRenderer):
         # this is old render call.
         # return super(PaginatedCSVRenderer, self).render(rows, renderer_context={'header':['aaaa','sssss','ddddd','fffff','gggggg']}, **kwargs) # NOQA: E501
 
+    def stream(self, items, renderer_context=None):
+        """
+        Yields the CSV of a list in chunks, with the rows of each item
+        written as soon as it's taken from items (see UtilRenderer.stream_rows)
+        """
+        output = io.BytesIO()
+        writer = csv.writer(output, delimiter=';', encoding=settings.DEFAULT_CHARSET)  # NOQA: E501
+
+        for rows in UtilRenderer().stream_rows(renderer_context['view'], items):  # NOQA: E501
+            writer.writerows(rows)
+
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+
+def get_field_paths(field, path):
+    """
+    The json paths (see UtilRenderer._go_deeper) of the values a serializer
+    field can have
+    """
+    if isinstance(field, serializers.ListSerializer):
+        return get_field_paths(field.child, path)
+
+    if isinstance(field, serializers.Serializer):
+        paths = []
+        for name, child in field.fields.items():
+            paths += get_field_paths(child, path + '.' + name)
+        return paths
+
+    return [path]
+
 
 class OrganisationXMLRenderer(XMLRenderer):
     root_tag_name = 'iati-organisations'
@@ -276,6 +356,62 @@ class UtilRenderer(object):
         self.selectable_fields = ()
         self.default_fields = ()
 
+    def stream_rows(self, view, items):
+        """
+        Yields the header row and then the rows of every item of a list
+        view, as soon as the item is taken from items.
+
+        Unlike create_rows_headers, the headers are known before the first
+        item: they are derived from the view's csv_headers and the fields of
+        its serializer (see get_stream_headers). Every item gets its own rows
+        (more than one when broken down by view.break_down_by), so
+        transactions, budgets and results are not grouped per activity.
+        """
+        self.exceptional_fields = view.exceptional_fields
+        self.break_down_by = view.break_down_by
+        self.selectable_fields = view.selectable_fields
+        self.headers = self.get_stream_headers(view)
+
+        yield [list(self.headers.keys())]
+
+        for item in items:
+            if 'transaction_types' in item:
+                for transaction in item.pop('transaction_types'):
+                    item['transaction_types_' + str(transaction['transaction_type'])] = transaction['dsum']  # NOQA: E501
+
+            self.rows = []
+            self.paths = self._go_deeper(item, '', {})
+            self._render(len(item.get(self.break_down_by) or []) or 1)
+
+            yield self.rows
+
+    def get_stream_headers(self, view):
+        """
+        The headers (and the json paths of their values) of the view's
+        fields, with the paths of the selectable fields taken from the
+        serializer instead of from the data
+        """
+        if view.fields == ():
+            fields = tuple(view.serializer_fields)
+        else:
+            fields = view.fields
+
+        serializer_fields = view.get_serializer([], many=True).child.fields
+
+        available_headers = OrderedDict(
+            (path, options['header'])
+            for path, options in view.csv_headers.items()
+        )
+        for field_name in view.selectable_fields:
+            if field_name not in serializer_fields:
+                continue
+
+            for path in get_field_paths(
+                    serializer_fields[field_name], field_name):
+                available_headers.setdefault(path, path.split('.')[0])
+
+        return self._get_headers(available_headers, fields, False)
+
     def create_rows_headers(self, data, csv_headers, selectable_headers, fields, add_index):  # NOQA: E501
 
         available_headers = list(csv_headers.keys()) + list(
@@ -673,6 +809,49 @@ class XlsRenderer(BaseRenderer):
 
         return output
 
+    def stream(self, items, renderer_context=None, block_size=65536):
+        """
+        Writes the rows of a list (see UtilRenderer.stream_rows) one at a
+        time to a constant memory workbook and yields the finished file in
+        blocks.
+
+        In constant_memory mode xlsxwriter flushes every row to a temp file
+        once the next one is started and the workbook is assembled in a temp
+        file as well, so the memory used doesn't grow with the number of
+        rows
+        """
+        output = tempfile.TemporaryFile()
+
+        self.wb = xlsxwriter.Workbook(output, {'constant_memory': True})
+        self.ws = self.wb.add_worksheet('Data Sheet')
+        bold = self.wb.add_format({'bold': 1})
+
+        row_index = 0
+        column_width = {}
+
+        for rows in UtilRenderer().stream_rows(renderer_context['view'], items):  # NOQA: E501
+            for row in rows:
+                for column_index, value in enumerate(row):
+                    if row_index == 0:
+                        self.ws.write(row_index, column_index, value, bold)
+                    else:
+                        self.ws.write(row_index, column_index, value)
+
+                    column_width[column_index] = max(
+                        column_width.get(column_index, 0), len(value))
+                row_index += 1
+
+        for index, width in column_width.items():
+            # Adjust the column width.
+            self.ws.set_column(index, index, width)
+
+        self.wb.close()
+
+        output.seek(0)
+        with output:
+            for block in iter(lambda: output.read(block_size), b''):
+                yield block
+
     def _write_to_excel(self, data):
         if type(data) is ReturnList or type(data) is list \
                 or type(data) is OrderedDict:
@@ -815,7 +994,7 @@ class XlsRenderer(BaseRenderer):
                     pass
 
 
-class IATIXMLRenderer(BaseRenderer):
+class IATIXMLRenderer(StreamingXMLRendererMixin, BaseRenderer):
     """
     Renderer which serializes to XML.
     """
@@ -889,14 +1068,6 @@ class IATIXMLRenderer(BaseRenderer):
 
             self._to_xml(self.xml, data)
 
-            # the element with namespace must be the last element in the xml.
-            for element in self.xml.iter():
-                if element.tag.find("https://www.zimmermanzimmerman.n") != -1:
-                    print(element.tag)
-                    parent = element.getparent()
-                    parent.remove(element)
-                    parent.append(element)
-
             return etree.tostring(
                 self.xml,
                 encoding=self.charset,
@@ -961,6 +1132,42 @@ class IATIXMLRenderer(BaseRenderer):
             return etree.tostring(self.xml, encoding=self.charset,
                                   pretty_print=True)
 
+    def stream(self, items, renderer_context=None):
+        def check_sectors(items):
+            for i, item in enumerate(items):
+                if i == 0 and item.get("sectors"):
+                    ElementReference.activity_sector = True
+                yield item
+
+        return super(IATIXMLRenderer, self).stream(
+            check_sectors(items), renderer_context)
+
+    def render_item(self, item):
+        """
+        The iati-activity (or iati-organisation) element of an item, built
+        on its own so finding it doesn't depend on the number of items
+        rendered before
+        """
+        parent = etree.Element(self.root_tag_name)
+
+        if self.item_tag_name == 'iati-activity':
+            element = ActivityReference(parent_element=parent, data=item)
+        else:
+            element = OrganisationReference(parent_element=parent, data=item)
+        element.create()
+
+        xml = parent.find(self.item_tag_name)
+        self._to_xml(xml, item)
+
+        # the element with namespace must be the last element in the xml.
+        for element in list(xml.iter()):
+            if element.tag.find("https://www.zimmermanzimmerman.n") != -1:
+                parent = element.getparent()
+                parent.remove(element)
+                parent.append(element)
+
+        return xml
+
     def _to_xml(self, xml, data, parent_name=None):
         if isinstance(data, (list, tuple)):
             for item in data:
@@ -975,23 +1182,7 @@ class IATIXMLRenderer(BaseRenderer):
                     self._to_xml(etree.SubElement(
                         xml, parent_name.replace('_', '-')), item)
                 else:
-                    if self.item_tag_name == 'iati-activity':
-                        element = ActivityReference(
-                            parent_element=self.xml,
-                            data=item
-                        )
-                        element.create()
-                    else:
-                        element = OrganisationReference(
-                            parent_element=self.xml,
-                            data=item
-                        )
-                        element.create()
-
-                    self._to_xml(
-                        self.xml.findall(self.item_tag_name)[-1],
-                        item
-                    )
+                    xml.append(self.render_item(item))
 
         elif isinstance(data, dict):
             attributes = []
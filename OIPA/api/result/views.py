@@ -4,7 +4,8 @@ from django_filters.rest_framework import DjangoFilterBackend
 from api.activity.serializers import ResultSerializer
 from api.aggregation.views import Aggregation, AggregationView, GroupBy
 from api.generics.filters import SearchFilter
-from api.generics.views import DynamicListView
+from api.generics.views import DynamicListView, StreamingListMixin
+from api.pagination import CustomCursorPagination
 from api.result.filters import RelatedOrderingFilter, ResultFilter
 from iati.models import Result
 
@@ -98,7 +99,7 @@ class ResultAggregations(AggregationView):
     )
 
 
-class ResultList(DynamicListView):
+class ResultList(StreamingListMixin, DynamicListView):
     queryset = Result.objects.all()
     filter_backends = (
         SearchFilter,
@@ -107,6 +108,8 @@ class ResultList(DynamicListView):
     )
     filter_class = ResultFilter
     serializer_class = ResultSerializer
+    pagination_class = CustomCursorPagination
+    streaming_formats = ('csv', 'xls')
 
     # make sure we can always have info about selectable fields,
     # stored into dict. This dict is populated in the DynamicView class using
@@ -0,0 +1,69 @@
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from iati.factory import iati_factory
+
+
+class CursorPaginationTestCase(APITestCase):
+
+    def setUp(self):
+        for i in range(5):
+            iati_factory.ActivityFactory.create(
+                iati_identifier='IATI-{}'.format(i),
+                normalized_iati_identifier='IATI-{}'.format(i))
+
+    def get_all_pages(self, url):
+        identifiers = []
+        responses = []
+
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+            responses.append(response.data)
+            identifiers += [
+                activity['iati_identifier']
+                for activity in response.data['results']
+            ]
+            url = response.data['next']
+
+        return identifiers, responses
+
+    def test_walk_pages(self):
+        url = reverse('activities:activity-list')
+
+        identifiers, responses = self.get_all_pages(
+            url + '?format=json&cursor=&page_size=2')
+
+        self.assertEqual(
+            identifiers, ['IATI-{}'.format(i) for i in range(5)])
+        self.assertEqual(len(responses), 3)
+        self.assertIsNone(responses[0]['count'])
+        self.assertIsNone(responses[0]['previous'])
+        self.assertNotIn('page=', responses[0]['next'])
+
+    def test_descending_ordering(self):
+        url = reverse('activities:activity-list')
+
+        identifiers, responses = self.get_all_pages(
+            url + '?format=json&cursor=&page_size=2&count=exact'
+            '&ordering=-planned_start_date')
+
+        self.assertEqual(
+            sorted(identifiers), ['IATI-{}'.format(i) for i in range(5)])
+        self.assertEqual(responses[0]['count'], 5)
+
+    def test_invalid_cursor(self):
+        url = reverse('activities:activity-list')
+
+        response = self.client.get(url + '?format=json&cursor=invalid')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_number_pagination_without_cursor(self):
+        url = reverse('activities:activity-list')
+
+        response = self.client.get(url + '?format=json&page_size=2')
+
+        self.assertEqual(response.data['count'], 5)
+        self.assertIn('page=2', response.data['next'])
@@ -0,0 +1,99 @@
+import io
+import zipfile
+
+from django.test import SimpleTestCase
+from django.urls import reverse
+from lxml import etree
+from rest_framework.test import APIClient, APITestCase
+
+from api.renderers import XMLRenderer
+from iati.factory import iati_factory
+
+
+class StreamingXMLRendererTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.data = [
+            {'iati_identifier': 'IATI-1', 'title': {'text': 'First'}},
+            {'iati_identifier': 'IATI-2', 'title': {'text': 'Second'}},
+        ]
+
+    def test_stream_is_rendered_list(self):
+        renderer = XMLRenderer()
+        parser = etree.XMLParser(remove_blank_text=True)
+
+        rendered = etree.fromstring(renderer.render(self.data), parser)
+        streamed = etree.fromstring(
+            b''.join(renderer.stream(self.data)), parser)
+
+        self.assertEqual(etree.tostring(streamed), etree.tostring(rendered))
+
+    def test_stream_yields_per_item(self):
+        items = iter(self.data)
+        chunks = XMLRenderer().stream(items)
+
+        self.assertIn(b'IATI-1', next(chunks))
+        # the second item wasn't taken yet:
+        self.assertEqual(next(items)['iati_identifier'], 'IATI-2')
+
+
+class StreamingActivityListTestCase(APITestCase):
+    c = APIClient()
+
+    def setUp(self):
+        for iati_identifier in ('IATI-1', 'IATI-2'):
+            iati_factory.ActivityFactory.create(
+                iati_identifier=iati_identifier)
+
+    def test_activity_list_xml_is_streamed(self):
+        response = self.c.get(
+            reverse('activities:activity-list'), {'format': 'xml'})
+
+        self.assertTrue(response.streaming)
+        xml = etree.fromstring(b''.join(response.streaming_content))
+
+        self.assertEqual(xml.tag, 'iati-activities')
+        self.assertEqual(
+            [activity.findtext('iati-identifier') for activity in xml],
+            ['IATI-1', 'IATI-2'])
+
+    def test_activity_list_json_is_not_streamed(self):
+        response = self.c.get(
+            reverse('activities:activity-list'), {'format': 'json'})
+
+        self.assertFalse(response.streaming)
+
+    def test_activity_list_csv_is_streamed(self):
+        response = self.c.get(
+            reverse('activities:activity-list'), {'format': 'csv'})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename=activity-list.csv')
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        headers = lines[0].split(';')
+
+        self.assertIn('activity_id', headers)
+        self.assertEqual(len(lines), 3)
+        self.assertIn('IATI-1', lines[1])
+        self.assertIn('IATI-2', lines[2])
+
+    def test_activity_list_xls_is_streamed(self):
+        response = self.c.get(
+            reverse('activities:activity-list'), {'format': 'xls'})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename=activity-list.xls')
+
+        workbook = zipfile.ZipFile(
+            io.BytesIO(b''.join(response.streaming_content)))
+        # constant memory workbooks use inline strings:
+        sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+
+        self.assertIn('activity_id', sheet)
+        self.assertIn('IATI-1', sheet)
+        self.assertIn('IATI-2', sheet)
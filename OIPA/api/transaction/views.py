@@ -13,9 +13,11 @@ from api.activity.serializers import CodelistSerializer
 from api.aggregation.views import Aggregation, AggregationView, GroupBy
 from api.country.serializers import CountrySerializer
 from api.generics.filters import SearchFilter
-from api.generics.views import DynamicDetailView, DynamicListView
+from api.generics.views import (
+    DynamicDetailView, DynamicListView, StreamingListMixin
+)
 from api.organisation.serializers import OrganisationAggregationSerializer
-from api.pagination import CustomTransactionPagination
+from api.pagination import CustomTransactionCursorPagination
 from api.region.serializers import RegionSerializer
 from api.sector.serializers import SectorSerializer
 from api.transaction.filters import (
@@ -35,7 +37,7 @@ from iati.transaction.models import (
 )
 
 
-class TransactionList(DynamicListView):
+class TransactionList(StreamingListMixin, DynamicListView):
     """
     Returns a list of IATI Transactions stored in OIPA.
 
@@ -73,7 +75,8 @@ class TransactionList(DynamicListView):
         RelatedOrderingFilter
     )
     filter_class = TransactionFilter
-    pagination_class = CustomTransactionPagination
+    pagination_class = CustomTransactionCursorPagination
+    streaming_formats = ('csv', 'xls')
     ordering_fields = '__all__'
     ordering = ('id', 'activity__iati_identifier',)
 
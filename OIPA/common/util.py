@@ -76,3 +76,21 @@ def normalise_unicode_string(any_str):
         if isinstance(any_str, str):
             any_str = smart_text(any_str, 'utf-8')
     return any_str
+
+
+def iterate_in_slices(queryset, slice_size=100):
+    """
+    Iterate over a (ordered) queryset one slice at a time, so prefetches
+    still apply to every slice (which they don't with .iterator()) while only
+    one slice is in memory
+    """
+    offset = 0
+
+    while True:
+        objects = list(queryset[offset:offset + slice_size])
+        for obj in objects:
+            yield obj
+
+        if len(objects) < slice_size:
+            return
+        offset += slice_size
@@ -1,5 +1,6 @@
 from django.core.exceptions import ObjectDoesNotExist
 
+from currency_convert import rate_table
 from currency_convert.models import MonthlyAverage
 
 
@@ -65,3 +66,14 @@ def from_xdr(currency_iso, value_date, value):
         return value / exchange_rate_from_xdr
     else:
         return 0
+
+
+def convert_values(currency_iso, value_date, value):
+    """
+    The value in all currencies stored on Transactions, Budgets and
+    PlannedDisbursements, with the IMF url and USD exchange rate, by model
+    field.
+
+    Uses the in-memory rates of rate_table instead of querying them
+    """
+    return rate_table.get_rate_table().convert(currency_iso, value_date, value)
@@ -9,9 +9,13 @@ import mechanicalsoup
 from django.utils.encoding import smart_text
 from lxml import etree
 
+from currency_convert import rate_table
 from currency_convert.models import MonthlyAverage
 from iati_codelists.models import Currency
 
+# The precision of MonthlyAverage.value:
+AVERAGE_PRECISION = Decimal('1e-10')
+
 
 class RateBrowser():
 
@@ -63,6 +67,8 @@ class RateParser():
         self.max_tick = 0
         self.now = datetime.datetime.now()
         self.rates = {}
+        # (currency, year, month) of the averages which were added or changed
+        self.changed_rates = []
 
     def prepare_url(self):
         """
@@ -120,10 +126,15 @@ class RateParser():
         Based on self.rates (see parse_day_rates) calculates the average per
         currency for a specific month.
 
-        Stores the results into the MonthlyAverage model.
+        Stores the results into the MonthlyAverage model, the averages which
+        were added or changed are collected in self.changed_rates.
         """
         for currency_iso, cur_obj in self.rates.items():
-            average_value = sum(cur_obj['values']) / len(cur_obj['values'])
+            # rounded like MonthlyAverage.value is stored, so an unchanged
+            # average compares equal:
+            average_value = (
+                sum(cur_obj['values']) / len(cur_obj['values'])
+            ).quantize(AVERAGE_PRECISION)
             currency, created = Currency.objects.get_or_create(
                 code=currency_iso,
                 defaults={'name': cur_obj['name']})
@@ -131,11 +142,20 @@ class RateParser():
                 month=self.month,
                 year=self.year,
                 currency=currency,
-                imf_url=self.updated_imf_url,
-                defaults={'value': average_value})
-            if not created:
+                defaults={
+                    'value': average_value,
+                    'imf_url': self.updated_imf_url,
+                })
+            if not created and obj.value != average_value:
                 obj.value = average_value
+                obj.imf_url = self.updated_imf_url
                 obj.save()
+            elif not created:
+                continue
+
+            self.changed_rates.append((currency.code, self.year, self.month))
+
+        rate_table.invalidate()
 
     def ticks(self, dt):
         """
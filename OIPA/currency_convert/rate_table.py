@@ -0,0 +1,263 @@
+"""
+All MonthlyAverage exchange rates in memory, so converting a value doesn't
+need any queries.
+
+The table of a process is loaded on first use (see get_rate_table) and
+dropped when RateParser.save_averages stores new rates (see invalidate).
+Other processes notice the invalidation through a version number in the
+default cache, which they check at most every RATE_TABLE_CHECK_INTERVAL
+seconds. When the cache doesn't hold the version (f.e. the DummyCache of
+the development settings, or after it was evicted), the table is reloaded
+every RATE_TABLE_CHECK_INTERVAL seconds instead.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from currency_convert.models import MonthlyAverage
+
+# The currencies every value is converted to, with the model field the
+# converted value is stored in:
+CURRENCY_FIELDS = OrderedDict([
+    ('XDR', 'xdr_value'),
+    ('USD', 'usd_value'),
+    ('EUR', 'eur_value'),
+    ('GBP', 'gbp_value'),
+    ('JPY', 'jpy_value'),
+    ('CAD', 'cad_value'),
+])
+
+RATE_TABLE_VERSION_KEY = 'currency_convert:rate_table_version'
+
+RATE_TABLE_CHECK_INTERVAL = 60
+
+_lock = threading.Lock()
+_state = {
+    'table': None,
+    'version': None,
+    'checked': 0,
+}
+
+
+def round_value(value, digits):
+    return round(value, digits) if value is not None else None
+
+
+class RateTable(object):
+    """
+    The monthly average exchange rates (to XDR) indexed by
+    (currency, year, month).
+
+    Converts the same way as currency_convert.convert, which queries the
+    rates one at a time
+    """
+
+    def __init__(self, averages=()):
+        """
+        averages -- (currency, year, month, value, imf_url) tuples
+        """
+        self.rates = {}
+        self.imf_urls = {}
+
+        for currency, year, month, value, imf_url in averages:
+            self.rates[(currency, year, month)] = value
+            self.imf_urls[(currency, year, month)] = imf_url
+
+    @classmethod
+    def load(cls):
+        return cls(MonthlyAverage.objects.values_list(
+            'currency_id', 'year', 'month', 'value', 'imf_url'
+        ).iterator())
+
+    def __len__(self):
+        return len(self.rates)
+
+    def get_monthly_average(self, currency_iso, value_date):
+        value = self.rates.get(
+            (currency_iso, value_date.year, value_date.month), False)
+        # MonthlyAverage.value is nullable:
+        return value if value is not None else False
+
+    def get_imf_url_and_exchange_rate(self, from_currency_iso, value_date):
+        if value_date is None:
+            return None, None
+
+        key = ('USD', value_date.year, value_date.month)
+        if key not in self.rates:
+            return None, None
+
+        imf_url = self.imf_urls[key]
+        usd_rate = self.rates[key]
+        exchange_rate_to_xdr = self.get_monthly_average(
+            from_currency_iso, value_date)
+
+        if exchange_rate_to_xdr and usd_rate:
+            return imf_url, exchange_rate_to_xdr / usd_rate
+        return imf_url, None
+
+    def to_xdr(self, currency_iso, value_date, value):
+        if None in (currency_iso, value_date, value):
+            return 0
+
+        exchange_rate_to_xdr = self.get_monthly_average(
+            currency_iso, value_date)
+        if exchange_rate_to_xdr:
+            return value * exchange_rate_to_xdr
+        return 0
+
+    def from_xdr(self, currency_iso, value_date, value):
+        if None in (currency_iso, value_date, value):
+            return 0
+
+        exchange_rate_from_xdr = self.get_monthly_average(
+            currency_iso, value_date)
+        if exchange_rate_from_xdr:
+            return value / exchange_rate_from_xdr
+        return 0
+
+    def currency_from_to(self, from_currency_iso, to_currency_iso, value_date,
+                         value):
+        if from_currency_iso == to_currency_iso:
+            return value
+
+        xdr_value = self.to_xdr(from_currency_iso, value_date, value)
+
+        if to_currency_iso == 'XDR':
+            return xdr_value
+
+        return self.from_xdr(to_currency_iso, value_date, xdr_value)
+
+    def convert(self, currency_iso, value_date, value):
+        """
+        The values of a Transaction, Budget or PlannedDisbursement in all
+        currencies of CURRENCY_FIELDS, with its IMF url and USD exchange
+        rate, by model field
+        """
+        values = OrderedDict(
+            (field, self.currency_from_to(
+                currency_iso, to_currency_iso, value_date, value))
+            for to_currency_iso, field in CURRENCY_FIELDS.items()
+        )
+        values['usd_value'] = round_value(values['usd_value'], 2)
+
+        imf_url, usd_exchange_rate = self.get_imf_url_and_exchange_rate(
+            currency_iso, value_date)
+        values['imf_url'] = imf_url
+        values['usd_exchange_rate'] = round_value(usd_exchange_rate, 5)
+
+        return values
+
+    def convert_many(self, values, currency_isos, value_dates):
+        """
+        convert() over whole columns of values, currencies and value dates
+        (f.e. the value_list of a queryset), returning a list with a dict per
+        row.
+
+        The rows are converted per distinct (currency, month), so the rates
+        are looked up once per group instead of once per row
+        """
+        converted = [None] * len(values)
+        groups = OrderedDict()
+
+        for i, (currency_iso, value_date) in enumerate(
+                zip(currency_isos, value_dates)):
+            month = (value_date.year, value_date.month) \
+                if value_date is not None else None
+            groups.setdefault((currency_iso, month), []).append(i)
+
+        for (currency_iso, month), rows in groups.items():
+            if month is None or currency_iso is None:
+                for i in rows:
+                    converted[i] = self.convert(
+                        currency_iso, value_dates[i], values[i])
+                continue
+
+            value_date = value_dates[rows[0]]
+            rates = self._get_rates(currency_iso, value_date)
+            imf_url, usd_exchange_rate = self.get_imf_url_and_exchange_rate(
+                currency_iso, value_date)
+            usd_exchange_rate = round_value(usd_exchange_rate, 5)
+
+            for i in rows:
+                converted[i] = self._convert_with_rates(
+                    rates, values[i], imf_url, usd_exchange_rate)
+
+        return converted
+
+    def _get_rates(self, currency_iso, value_date):
+        """
+        The rate to XDR of a currency and the rates from XDR to
+        CURRENCY_FIELDS, None for same currency (no conversion)
+        """
+        to_xdr = self.get_monthly_average(currency_iso, value_date)
+
+        rates = OrderedDict()
+        for to_currency_iso in CURRENCY_FIELDS:
+            if to_currency_iso == currency_iso:
+                rates[to_currency_iso] = None
+            elif to_currency_iso == 'XDR':
+                rates[to_currency_iso] = (to_xdr, True)
+            else:
+                rates[to_currency_iso] = (
+                    to_xdr,
+                    self.get_monthly_average(to_currency_iso, value_date))
+        return rates
+
+    def _convert_with_rates(self, rates, value, imf_url, usd_exchange_rate):
+        values = OrderedDict()
+
+        for to_currency_iso, field in CURRENCY_FIELDS.items():
+            rate = rates[to_currency_iso]
+
+            if rate is None:
+                values[field] = value
+                continue
+
+            to_xdr, from_xdr = rate
+            xdr_value = value * to_xdr if value is not None and to_xdr else 0
+
+            if to_currency_iso == 'XDR':
+                values[field] = xdr_value
+            else:
+                # same as from_xdr(), which returns 0 for a missing rate
+                values[field] = xdr_value / from_xdr if from_xdr else 0
+
+        values['usd_value'] = round_value(values['usd_value'], 2)
+        values['imf_url'] = imf_url
+        values['usd_exchange_rate'] = usd_exchange_rate
+        return values
+
+
+def get_rate_table():
+    """
+    The RateTable of this process, (re)loaded when it was invalidated
+    """
+    now = time.time()
+
+    with _lock:
+        if _state['table'] is not None and \
+                now - _state['checked'] < RATE_TABLE_CHECK_INTERVAL:
+            return _state['table']
+
+        version = cache.get(RATE_TABLE_VERSION_KEY)
+        _state['checked'] = now
+
+        # without a version, an invalidation can't be noticed:
+        if _state['table'] is None or version is None \
+                or version != _state['version']:
+            _state['table'] = RateTable.load()
+            _state['version'] = version
+
+        return _state['table']
+
+
+def invalidate():
+    """
+    Drop the loaded RateTables, after the MonthlyAverages have changed
+    """
+    with _lock:
+        _state['table'] = None
+
+    cache.set(RATE_TABLE_VERSION_KEY, time.time(), timeout=None)
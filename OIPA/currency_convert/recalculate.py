@@ -0,0 +1,173 @@
+"""
+Recalculates the converted values stored on transactions, budgets and
+planned disbursements after exchange rates changed, without reparsing their
+datasets.
+
+Only the rows converted with a changed rate are updated, chunk by chunk with
+one UPDATE ... FROM (VALUES ...) statement per chunk. The activities of
+those rows get their aggregations and Solr documents refreshed.
+"""
+import logging
+from functools import reduce
+from operator import or_
+
+from django.db import connection
+from django.db.models import Q
+
+from currency_convert.rate_table import CURRENCY_FIELDS, RateTable
+from iati.activity_aggregation_calculation import (
+    ActivityAggregationCalculation
+)
+from iati.models import Budget, PlannedDisbursement
+from iati.transaction.models import Transaction
+from solr.activity.tasks import ActivityTaskIndexing
+
+logger = logging.getLogger(__name__)
+
+MODELS = (Transaction, Budget, PlannedDisbursement)
+
+# The columns RateTable.convert() returns, with their SQL type:
+COLUMNS = [(field, 'numeric') for field in CURRENCY_FIELDS.values()] + [
+    ('imf_url', 'text'),
+    ('usd_exchange_rate', 'numeric'),
+]
+
+
+def get_changed_rows_filter(changed_rates):
+    """
+    A filter on the rows converted with any of the changed rates.
+
+    changed_rates -- (currency, year, month) tuples
+
+    A changed rate of a currency values are converted to (USD, EUR etc.)
+    affects the values in every currency of that month, any other only the
+    values in that currency
+    """
+    filters = []
+
+    for currency, year, month in set(map(tuple, changed_rates)):
+        month_filter = Q(value_date__year=year, value_date__month=month)
+
+        if currency in CURRENCY_FIELDS:
+            filters.append(month_filter)
+        else:
+            filters.append(month_filter & Q(currency_id=currency))
+
+    return reduce(or_, filters) if filters else None
+
+
+def update_rows(model, rows):
+    """
+    Write the converted values of many rows with a single UPDATE.
+
+    rows -- (id, values) tuples, values as returned by RateTable.convert()
+    """
+    if not rows:
+        return
+
+    placeholder = '({})'.format(', '.join(
+        ['%s::integer'] + ['%s::{}'.format(sql_type)
+                           for _, sql_type in COLUMNS]
+    ))
+
+    params = []
+    for row_id, values in rows:
+        params.append(row_id)
+        params.extend(values[column] for column, _ in COLUMNS)
+
+    sql = (
+        'UPDATE {table} SET {assignments} '
+        'FROM (VALUES {values}) AS converted (id, {columns}) '
+        'WHERE {table}.id = converted.id'
+    ).format(
+        table=connection.ops.quote_name(model._meta.db_table),
+        assignments=', '.join(
+            '{0} = converted.{0}'.format(column) for column, _ in COLUMNS),
+        values=', '.join([placeholder] * len(rows)),
+        columns=', '.join(column for column, _ in COLUMNS),
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def recalculate_model(model, rows_filter, rate_table, chunk_size=1000):
+    """
+    Recalculate the converted values of the rows of a model matching
+    rows_filter.
+
+    Returns the ids of their activities
+    """
+    activity_ids = set()
+
+    rows = model.objects.filter(rows_filter).filter(
+        value__isnull=False,
+        value_date__isnull=False,
+    ).order_by('id').values_list(
+        'id', 'activity_id', 'value', 'currency_id', 'value_date')
+
+    chunk = []
+
+    def flush(chunk):
+        ids, _, values, currencies, value_dates = zip(*chunk)
+        update_rows(model, list(zip(
+            ids, rate_table.convert_many(values, currencies, value_dates))))
+
+    for row in rows.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        activity_ids.add(row[1])
+
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+
+    if chunk:
+        flush(chunk)
+
+    return activity_ids
+
+
+def refresh_activities(activity_ids, batch_size=500):
+    """
+    Recalculate the aggregations of activities and reindex them in Solr
+    """
+    activity_ids = sorted(activity_ids)
+
+    try:
+        ActivityAggregationCalculation().parse_activity_aggregations_by_ids(
+            activity_ids)
+    except Exception as e:
+        logger.exception(e)
+
+    for i in range(0, len(activity_ids), batch_size):
+        ActivityTaskIndexing(related=True).run_batch(
+            activity_ids[i:i + batch_size])
+
+
+def recalculate_values(changed_rates, chunk_size=1000):
+    """
+    Recalculate all values converted with any of the changed rates, then
+    refresh their activities.
+
+    changed_rates -- (currency, year, month) tuples, see
+    RateParser.changed_rates
+
+    Returns the ids of the affected activities
+    """
+    rows_filter = get_changed_rows_filter(changed_rates)
+    if rows_filter is None:
+        return set()
+
+    rate_table = RateTable.load()
+    activity_ids = set()
+
+    for model in MODELS:
+        activity_ids |= recalculate_model(
+            model, rows_filter, rate_table, chunk_size)
+
+    logger.info(
+        "Recalculated the currency values of %d activities",
+        len(activity_ids))
+
+    refresh_activities(activity_ids)
+    return activity_ids
@@ -1,18 +1,24 @@
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
 from urllib.error import URLError
 
 import mechanicalsoup
 from django.test import TestCase
 from lxml.builder import E
-from mock import MagicMock, Mock
+from mock import MagicMock, Mock, patch
 
-from currency_convert import convert
+from currency_convert import convert, rate_table
 from currency_convert.factory.currency_convert_factory import (
     MonthlyAverageFactory
 )
 from currency_convert.imf_rate_parser import RateBrowser, RateParser
 from currency_convert.models import MonthlyAverage
+from currency_convert.rate_table import RateTable
+from currency_convert.recalculate import recalculate_values
+from iati.factory import iati_factory
+from iati.models import Budget
+from iati.transaction import factories as transaction_factory
+from iati.transaction.models import Transaction
 from iati_codelists.models import Currency
 
 
@@ -106,6 +112,23 @@ class RateParserTestCase(TestCase):
             month=12, year=1993, currency='EUR')[0]
         self.assertTrue(average_item.value == 1.75)
 
+    def test_save_same_averages_again(self):
+        self.rate_parser.year = 1994
+        self.rate_parser.month = 2
+        self.rate_parser.rates = {
+            'EUR': {'name': 'Euro', 'values': [
+                Decimal('0.7234568'), Decimal('0.7234568'),
+                Decimal('0.7234569')]}
+        }
+        self.rate_parser.save_averages()
+        self.assertEqual(self.rate_parser.changed_rates, [('EUR', 1994, 2)])
+
+        # a forced update with the same IMF data:
+        self.rate_parser.changed_rates = []
+        self.rate_parser.save_averages()
+
+        self.assertEqual(self.rate_parser.changed_rates, [])
+
     def test_ticks(self):
         dt = datetime(1994, 1, 1)
         ticks = self.rate_parser.ticks(dt)
@@ -221,3 +244,163 @@ class ConvertTestCase(TestCase):
         value_date = datetime(1995, 1, 1)
         rate = convert.from_xdr('EUR', value_date, 100)
         self.assertEqual(rate, 0)
+
+
+class RateTableTestCase(TestCase):
+
+    def setUp(self):
+        currency, created = Currency.objects.get_or_create(
+            code='EUR', name='Euro')
+        MonthlyAverageFactory.create(
+            year=1994, month=1, currency=currency, value=Decimal('1.5'),
+            imf_url='http://imf.org/1994-1')
+        usd_currency, created = Currency.objects.get_or_create(
+            code='USD', name='USD')
+        MonthlyAverageFactory.create(
+            year=1994, month=1, currency=usd_currency, value=Decimal('3'),
+            imf_url='http://imf.org/1994-1')
+
+        with self.assertNumQueries(1):
+            self.rate_table = RateTable.load()
+
+    def test_same_as_convert(self):
+        """
+        converts like the queries of convert do
+        """
+        value_date = datetime(1994, 1, 1)
+
+        with self.assertNumQueries(0):
+            for from_currency, to_currency, value in [
+                    ('USD', 'EUR', 200), ('USD', 'XDR', 100),
+                    ('EUR', 'USD', 150), ('USD', 'UGX', 100)]:
+                self.assertEqual(
+                    self.rate_table.currency_from_to(
+                        from_currency, to_currency, value_date, value),
+                    convert.currency_from_to(
+                        from_currency, to_currency, value_date, value))
+
+            self.assertEqual(
+                self.rate_table.get_imf_url_and_exchange_rate(
+                    'EUR', value_date),
+                ('http://imf.org/1994-1', Decimal('0.5')))
+
+        self.assertEqual(
+            self.rate_table.get_imf_url_and_exchange_rate(
+                'EUR', datetime(1995, 1, 1)),
+            (None, None))
+
+    def test_convert(self):
+        values = self.rate_table.convert(
+            'EUR', datetime(1994, 1, 1), Decimal('100'))
+
+        self.assertEqual(values['xdr_value'], 150)
+        self.assertEqual(values['usd_value'], 50)
+        self.assertEqual(values['eur_value'], 100)
+        self.assertEqual(values['gbp_value'], 0)
+        self.assertEqual(values['imf_url'], 'http://imf.org/1994-1')
+        self.assertEqual(values['usd_exchange_rate'], Decimal('0.5'))
+
+    def test_convert_many(self):
+        values = [Decimal('100'), Decimal('200'), Decimal('300'), None]
+        currencies = ['EUR', 'USD', 'EUR', 'EUR']
+        value_dates = [
+            datetime(1994, 1, 1), datetime(1994, 1, 2),
+            datetime(1995, 1, 1), None
+        ]
+
+        self.assertEqual(
+            self.rate_table.convert_many(values, currencies, value_dates),
+            [
+                self.rate_table.convert(*row)
+                for row in zip(currencies, value_dates, values)
+            ])
+
+    def test_save_averages_invalidates(self):
+        rate_table.invalidate()
+        self.assertEqual(len(rate_table.get_rate_table()), 2)
+
+        rate_parser = RateParser()
+        rate_parser.year = 1994
+        rate_parser.month = 2
+        rate_parser.rates = {
+            'EUR': {'name': 'Euro', 'values': [Decimal('1.5')]}
+        }
+        rate_parser.save_averages()
+
+        self.assertEqual(len(rate_table.get_rate_table()), 3)
+
+    @patch('currency_convert.rate_table.cache')
+    def test_reload_without_cached_version(self, cache):
+        # a cache which doesn't keep the version, like the DummyCache:
+        cache.get.return_value = None
+        rate_table.invalidate()
+        self.assertEqual(len(rate_table.get_rate_table()), 2)
+
+        # new rates saved by another process:
+        MonthlyAverageFactory.create(
+            year=1994, month=2, currency=Currency.objects.get(code='EUR'),
+            value=Decimal('1.5'))
+        self.assertEqual(len(rate_table.get_rate_table()), 2)
+
+        # once RATE_TABLE_CHECK_INTERVAL passed:
+        rate_table._state['checked'] = 0
+        self.assertEqual(len(rate_table.get_rate_table()), 3)
+
+
+class RecalculateTestCase(TestCase):
+
+    def setUp(self):
+        self.eur, created = Currency.objects.get_or_create(
+            code='EUR', name='Euro')
+        self.usd, created = Currency.objects.get_or_create(
+            code='USD', name='USD')
+        MonthlyAverageFactory.create(
+            year=1994, month=1, currency=self.eur, value=Decimal('1.5'))
+        MonthlyAverageFactory.create(
+            year=1994, month=1, currency=self.usd, value=Decimal('3'))
+
+        activity = iati_factory.ActivityFactory.create()
+        self.transaction = transaction_factory.TransactionFactory.create(
+            activity=activity, currency=self.eur, value=100,
+            value_date=date(1994, 1, 15))
+        self.budget = iati_factory.BudgetFactory.create(
+            activity=activity, currency=self.eur, value=200,
+            value_date=date(1994, 2, 15))
+        self.activity = activity
+
+    @patch('currency_convert.recalculate.refresh_activities')
+    def test_recalculate_values(self, refresh_activities):
+        activity_ids = recalculate_values([('EUR', 1994, 1)])
+
+        self.assertEqual(activity_ids, {self.activity.id})
+        refresh_activities.assert_called_once_with({self.activity.id})
+
+        transaction = Transaction.objects.get(id=self.transaction.id)
+        self.assertEqual(transaction.xdr_value, 150)
+        self.assertEqual(transaction.usd_value, 50)
+        self.assertEqual(transaction.eur_value, 100)
+        self.assertEqual(transaction.usd_exchange_rate, Decimal('0.5'))
+
+        # a month without changed rates:
+        budget = Budget.objects.get(id=self.budget.id)
+        self.assertEqual(budget.xdr_value, 0)
+
+    @patch('currency_convert.recalculate.refresh_activities')
+    def test_other_currency_is_not_recalculated(self, refresh_activities):
+        activity_ids = recalculate_values([('UGX', 1994, 1)])
+
+        self.assertEqual(activity_ids, set())
+        self.assertEqual(
+            Transaction.objects.get(id=self.transaction.id).xdr_value, 0)
+
+    def test_save_averages_changed_rates(self):
+        rate_parser = RateParser()
+        rate_parser.year = 1994
+        rate_parser.month = 1
+        rate_parser.rates = {
+            'EUR': {'name': 'Euro', 'values': [Decimal('1.5')]},
+            'USD': {'name': 'USD', 'values': [Decimal('2')]},
+        }
+        rate_parser.save_averages()
+
+        self.assertEqual(rate_parser.changed_rates, [('USD', 1994, 1)])
@@ -1,413 +1,391 @@
-from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError
+"""
+Calculates the ActivityAggregation, ChildAggregation and
+ActivityPlusChildAggregation of many activities at once.
+
+The budgets and transactions of a batch of activities (and of their
+children) are summed with a few queries grouped by activity, transaction
+type and currency, the results are combined in memory and written with one
+INSERT ... ON CONFLICT statement per model.
+
+While parsing a dataset, the parents of changed activities are collected in
+a DirtyParents set, so each parent is recalculated once after the whole
+dataset was parsed, instead of once for each of its children.
+"""
+import logging
+from collections import OrderedDict, defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
 from django.db.models import Sum
-from django.db.utils import IntegrityError as Integrity
 
 from iati.models import (
-    Activity, ActivityAggregation, ActivityPlusChildAggregation,
-    ChildAggregation
+    Activity, ActivityAggregation, ActivityPlusChildAggregation, Budget,
+    ChildAggregation, RelatedActivity
 )
 from iati.transaction.models import Transaction
 
+logger = logging.getLogger(__name__)
+
+# The aggregated transaction types, by code, with the prefix of their
+# aggregation fields:
+TRANSACTION_TYPES = OrderedDict([
+    ('1', 'incoming_funds'),
+    ('2', 'commitment'),
+    ('3', 'disbursement'),
+    ('4', 'expenditure'),
+    ('5', 'interest_payment'),
+    ('6', 'loan_repayment'),
+    ('7', 'reimbursement'),
+    ('8', 'purchase_of_equity'),
+    ('9', 'sale_of_equity'),
+    ('10', 'credit_guarantee'),
+    ('11', 'incoming_commitment'),
+])
+
+AGGREGATION_TYPES = ['budget'] + list(TRANSACTION_TYPES.values())
+
+# the RelatedActivityType of a parent activity:
+PARENT_TYPE = 1
+
+
+def get_aggregation(totals):
+    """
+    The (currency, value) of an aggregation from its totals per currency.
+
+    The values of all currencies are added up, the currency is only set when
+    there is a single one. Without totals both are None
+    """
+    if not totals:
+        return None, None
+
+    value = Decimal(0)
+    for total in totals.values():
+        if total:
+            value += total
+
+    currency = list(totals)[0] if len(totals) == 1 else None
+    return currency, value
+
+
+def get_total_aggregation(activity_aggregation, child_aggregation):
+    """
+    The (currency, value) of an ActivityPlusChildAggregation from the
+    (currency, value) of the activity and its children
+    """
+    activity_currency, activity_value = activity_aggregation
+    child_currency, child_value = child_aggregation
+
+    currency = None
+    if (activity_value != 0 and child_value == 0
+            or activity_value == child_value):
+        currency = activity_currency
+    elif activity_value == 0 and child_value != 0:
+        currency = child_currency
+
+    if activity_value is not None and child_value is not None:
+        value = activity_value + child_value
+    elif activity_value is not None:
+        value = activity_value
+    else:
+        value = child_value
+
+    return currency, value
+
+
+def upsert(model, rows):
+    """
+    Insert or update the aggregations of many activities at once.
+
+    rows -- {activity_id: {aggregation type: (currency, value)}}
+    """
+    if not rows:
+        return
+
+    columns = ['activity_id']
+    for aggregation_type in AGGREGATION_TYPES:
+        columns.append(aggregation_type + '_currency')
+        columns.append(aggregation_type + '_value')
+
+    params = []
+    for activity_id, aggregations in rows.items():
+        params.append(activity_id)
+        for aggregation_type in AGGREGATION_TYPES:
+            params.extend(aggregations[aggregation_type])
+
+    placeholder = '({})'.format(', '.join(['%s'] * len(columns)))
+
+    sql = (
+        'INSERT INTO {table} ({columns}) VALUES {values} '
+        'ON CONFLICT (activity_id) DO UPDATE SET {assignments}'
+    ).format(
+        table=connection.ops.quote_name(model._meta.db_table),
+        columns=', '.join(columns),
+        values=', '.join([placeholder] * len(rows)),
+        assignments=', '.join(
+            '{0} = EXCLUDED.{0}'.format(column) for column in columns[1:]),
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+class DirtyParents(object):
+    """
+    The parents whose children changed (were added, updated or removed)
+    while parsing a dataset, as (child, parent) iati identifier pairs.
+
+    Recalculating one child at a time would have recalculated a parent for
+    every pair, marked and recalculated count both so the difference shows
+    what was saved
+    """
+
+    def __init__(self):
+        self.links = set()
+        self.marked = 0
+        self.recalculated = 0
+
+    def __len__(self):
+        return len(self.get_refs())
+
+    @property
+    def saved(self):
+        """
+        The number of parent recalculations saved by recalculating each
+        parent once
+        """
+        return self.marked - self.recalculated
 
-class ActivityAggregationCalculation():
+    def get_refs(self):
+        return {ref for _, ref in self.links}
 
-    def parse_all_activity_aggregations(self):
-        for activity in Activity.objects.all():
-            self.parse_activity_aggregations(activity)
+    def mark(self, links):
+        self.links.update((child, ref) for child, ref in links if ref)
 
-    def parse_activity_aggregations_by_source(self, dataset_id):
-        for activity in Activity.objects.filter(dataset__id=dataset_id):
-            self.parse_activity_aggregations(activity)
+    def mark_related_activities(self, related_activities):
+        """
+        Mark the parents of the RelatedActivity models of a parsed activity
+        """
+        self.mark(
+            (related_activity.current_activity.iati_identifier,
+             related_activity.ref)
+            for related_activity in related_activities
+            if related_activity.type_id == str(PARENT_TYPE))
 
-    def parse_activity_aggregations(self, activity):
-        self.calculate_activity_aggregations(activity)
-        self.calculate_child_aggregations(activity)
-        self.calculate_activity_plus_child_aggregations(activity)
-        self.update_parents_child_budgets(activity)
-        try:
-            activity.save()
-        except Integrity():
-            activity.update()
-
-    def update_parents_child_budgets(self, activity):
-
-        if activity.hierarchy != 1:
-            # update the parent's child budgets
-            parent_activity = activity.relatedactivity_set.filter(type__code=1)
-            if len(parent_activity) and parent_activity[0].ref_activity:
-                parent_activity = parent_activity[0].ref_activity
-                try:
-                    parent_activity.activity_aggregation
-                except ObjectDoesNotExist:
-                    self.calculate_activity_aggregations(parent_activity)
-                self.calculate_child_aggregations(parent_activity)
-                self.calculate_activity_plus_child_aggregations(
-                    parent_activity)
-                parent_activity.save()
-
-    def set_aggregation(
-            self,
-            activity_aggregation,
-            currency_field_name,
-            value_field_name,
-            aggregation_object):
+    def mark_activities(self, activities):
+        """
+        Mark the current parents of saved activities, f.e. before they are
+        deleted
         """
+        self.mark(RelatedActivity.objects.filter(
+            current_activity__in=activities,
+            type=PARENT_TYPE,
+        ).values_list('current_activity__iati_identifier', 'ref'))
 
+    def pop_activity_ids(self):
         """
+        The ids of the dirty parents, which are no longer dirty after
+        """
+        activity_ids = set(Activity.objects.filter(
+            iati_identifier__in=self.get_refs()).values_list('id', flat=True))
 
-        currency = None
+        self.marked += len(self.links)
+        self.recalculated += len(activity_ids)
+        self.links = set()
 
-        value = (0, None)[len(aggregation_object) <= 0]
+        return activity_ids
 
-        for agg_item in aggregation_object:
-            currency = agg_item[0]
-            if agg_item[1]:
-                value = value + agg_item[1]
 
-        if len(aggregation_object) > 1:
-            # mixed currencies, set as None
-            currency = None
+class ActivityAggregationCalculation():
 
-        setattr(activity_aggregation, currency_field_name, currency)
-        setattr(activity_aggregation, value_field_name, value)
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
 
-        return activity_aggregation
+    def parse_all_activity_aggregations(self):
+        activity_ids = Activity.objects.order_by('id').values_list(
+            'id', flat=True)
+        self.parse_activity_aggregations_by_ids(activity_ids)
 
-    def calculate_activity_aggregations(self, activity):
+    def parse_activity_aggregations_by_source(self, dataset_id,
+                                              dirty_parents=None):
         """
+        The aggregations of the activities of a dataset and of their parents,
+        whose child aggregations include them.
 
+        Keyword arguments:
+        dirty_parents -- the DirtyParents collected while parsing the
+        dataset, instead of the current parents of its activities
         """
+        activity_ids = set(Activity.objects.filter(
+            dataset__id=dataset_id).values_list('id', flat=True))
 
-        try:
-            activity_aggregation = activity.activity_aggregation
-        except ObjectDoesNotExist:
-            activity_aggregation = ActivityAggregation()
-            activity_aggregation.activity = activity
-
-        budget_total = activity.budget_set.values_list(
-            'currency').annotate(Sum('value'))
-        activity_aggregation = self.set_aggregation(
-            activity_aggregation,
-            'budget_currency',
-            'budget_value',
-            budget_total)
-
-        incoming_fund_total = activity.transaction_set.filter(
-            transaction_type=1).values_list('currency').annotate(Sum('value'))
-        activity_aggregation = self.set_aggregation(
-            activity_aggregation,
-            'incoming_funds_currency',
-            'incoming_funds_value',
-            incoming_fund_total)
-
-        commitment_total = activity.transaction_set.filter(
-            transaction_type=2).values_list('currency').annotate(
-            Sum('value'))
-        activity_aggregation = self.set_aggregation(
-            activity_aggregation,
-            'commitment_currency',
-            'commitment_value',
-            commitment_total)
-
-        disbursement_total = activity.transaction_set.filter(
-            transaction_type=3).values_list('currency').annotate(
-            Sum('value'))
-        activity_aggregation = self.set_aggregation(
-            activity_aggregation,
-            'disbursement_currency',
-            'disbursement_value',
-            disbursement_total)
-
-        expenditure_total = activity.transaction_set.filter(
-            transaction_type=4).values_list('currency').annotate(
-            Sum('value'))
-        activity_aggregation = self.set_aggregation(
-            activity_aggregation,
-            'expenditure_currency',
-            'expenditure_value',
-            expenditure_total)
-
-        interest_payment_total = activity.transaction_set.filter(
-            transaction_type=5).values_list('currency').annotate(Sum('value'))
-        activity_aggregation = self.set_aggregation(
-            activity_aggregation,
-            'interest_payment_currency',
-            'interest_payment_value',
-            interest_payment_total)
-
-        loan_repayment_total = activity.transaction_set.filter(
-            transaction_type=6).values_list('currency').annotate(Sum('value'))
-        activity_aggregation = self.set_aggregation(
-            activity_aggregation,
-            'loan_repayment_currency',
-            'loan_repayment_value',
-            loan_repayment_total)
-
-        reimbursement_total = activity.transaction_set.filter(
-            transaction_type=7).values_list('currency').annotate(Sum('value'))
-        activity_aggregation = self.set_aggregation(
-            activity_aggregation,
-            'reimbursement_currency',
-            'reimbursement_value',
-            reimbursement_total)
-
-        purchase_of_equity_total = activity.transaction_set.filter(
-            transaction_type=8).values_list('currency').annotate(Sum('value'))
-        activity_aggregation = self.set_aggregation(
-            activity_aggregation,
-            'purchase_of_equity_currency',
-            'purchase_of_equity_value',
-            purchase_of_equity_total)
-
-        sale_of_equity_total = activity.transaction_set.filter(
-            transaction_type=9).values_list('currency').annotate(Sum('value'))
-        activity_aggregation = self.set_aggregation(
-            activity_aggregation,
-            'sale_of_equity_currency',
-            'sale_of_equity_value',
-            sale_of_equity_total)
-
-        credit_guarantee_total = activity.transaction_set.filter(
-            transaction_type=10).values_list('currency').annotate(Sum('value'))
-        activity_aggregation = self.set_aggregation(
-            activity_aggregation,
-            'credit_guarantee_currency',
-            'credit_guarantee_value',
-            credit_guarantee_total)
-
-        incoming_commitment_total = activity.transaction_set.filter(
-            transaction_type=11).values_list('currency').annotate(Sum('value'))
-        activity_aggregation = self.set_aggregation(
-            activity_aggregation,
-            'incoming_commitment_currency',
-            'incoming_commitment_value',
-            incoming_commitment_total)
-
-        # raises IntegrityError when an activity appears in multiple sources
-        # and they are parsed at the same time TODO find solution that's less
-        # ugly
-        try:
-            activity_aggregation.save()
-        except IntegrityError:
-            pass
-
-    def calculate_child_budget_aggregation(
-            self,
-            activity):
-
-        return Activity.objects\
-            .filter(
-                relatedactivity__ref=activity.iati_identifier,
-                relatedactivity__type=1,)\
-            .filter(budget__currency__isnull=False)\
-            .values_list('budget__currency')\
-            .annotate(total_budget=Sum('budget__value'))
-
-    def calculate_child_transaction_aggregation(
-            self,
-            activity,
-            transaction_type):
-
-        return Transaction.objects .filter(
-            activity__relatedactivity__ref=activity.iati_identifier,
-            activity__relatedactivity__type=1) .filter(
-            transaction_type=transaction_type) .filter(
-            currency__isnull=False) .values_list('currency') .annotate(
-                Sum('value'))
-
-    def calculate_child_aggregations(self, activity):
+        if dirty_parents is None:
+            activity_ids |= self.get_parent_ids(activity_ids)
+        else:
+            activity_ids |= dirty_parents.pop_activity_ids()
+
+            logger.info(
+                "Dataset %s: recalculated %d parent activities for %d "
+                "changed children, saving %d recalculations",
+                dataset_id, dirty_parents.recalculated,
+                dirty_parents.marked, dirty_parents.saved)
+
+        self.parse_activity_aggregations_by_ids(sorted(activity_ids))
+
+    def parse_activity_aggregations(self, activity):
+        activity_ids = {activity.id} | self.get_parent_ids([activity.id])
+        self.parse_activity_aggregations_by_ids(sorted(activity_ids))
+
+    def parse_activity_aggregations_by_ids(self, activity_ids):
+        activity_ids = list(activity_ids)
+
+        for i in range(0, len(activity_ids), self.batch_size):
+            self.calculate_aggregations(activity_ids[i:i + self.batch_size])
+
+    def get_parent_ids(self, activity_ids):
+        parent_identifiers = RelatedActivity.objects.filter(
+            current_activity_id__in=activity_ids,
+            type=PARENT_TYPE,
+        ).values('ref')
+
+        return set(Activity.objects.filter(
+            iati_identifier__in=parent_identifiers
+        ).values_list('id', flat=True))
+
+    def calculate_aggregations(self, activity_ids):
+        """
+        Calculate and save all aggregations of a batch of activities
+        """
+        activity_totals = self.get_activity_totals(activity_ids)
+        child_totals = self.get_child_totals(activity_ids)
+
+        activity_aggregations = {}
+        child_aggregations = {}
+        total_aggregations = {}
+
+        for activity_id in activity_ids:
+            activity_aggregation = {}
+            child_aggregation = {}
+            total_aggregation = {}
+
+            for aggregation_type in AGGREGATION_TYPES:
+                activity_aggregation[aggregation_type] = get_aggregation(
+                    activity_totals[activity_id][aggregation_type])
+                child_aggregation[aggregation_type] = get_aggregation(
+                    child_totals[activity_id][aggregation_type])
+                total_aggregation[aggregation_type] = get_total_aggregation(
+                    activity_aggregation[aggregation_type],
+                    child_aggregation[aggregation_type])
+
+            activity_aggregations[activity_id] = activity_aggregation
+            child_aggregations[activity_id] = child_aggregation
+            total_aggregations[activity_id] = total_aggregation
+
+        aggregations = [
+            (ActivityAggregation, activity_aggregations),
+            (ChildAggregation, child_aggregations),
+            (ActivityPlusChildAggregation, total_aggregations),
+        ]
 
         try:
-            child_aggregation = activity.child_aggregation
-        except ObjectDoesNotExist:
-            child_aggregation = ChildAggregation()
-            child_aggregation.activity = activity
-
-        budget_total = self.calculate_child_budget_aggregation(activity)
-        child_aggregation = self.set_aggregation(
-            child_aggregation,
-            'budget_currency',
-            'budget_value',
-            budget_total)
-
-        incoming_fund_total = self.calculate_child_transaction_aggregation(
-            activity, 1)
-        child_aggregation = self.set_aggregation(
-            child_aggregation,
-            'incoming_funds_currency',
-            'incoming_funds_value',
-            incoming_fund_total)
-
-        commitment_total = self.calculate_child_transaction_aggregation(
-            activity, 2)
-        child_aggregation = self.set_aggregation(
-            child_aggregation,
-            'commitment_currency',
-            'commitment_value',
-            commitment_total)
-
-        disbursement_total = self.calculate_child_transaction_aggregation(
-            activity, 3)
-        child_aggregation = self.set_aggregation(
-            child_aggregation,
-            'disbursement_currency',
-            'disbursement_value',
-            disbursement_total)
-
-        expenditure_total = self.calculate_child_transaction_aggregation(
-            activity, 4)
-        child_aggregation = self.set_aggregation(
-            child_aggregation,
-            'expenditure_currency',
-            'expenditure_value',
-            expenditure_total)
-
-        interest_payment_total = self.calculate_child_transaction_aggregation(
-            activity, 5)
-        child_aggregation = self.set_aggregation(
-            child_aggregation,
-            'interest_payment_currency',
-            'interest_payment_value',
-            interest_payment_total)
-
-        loan_repayment_total = self.calculate_child_transaction_aggregation(
-            activity, 6)
-        child_aggregation = self.set_aggregation(
-            child_aggregation,
-            'loan_repayment_currency',
-            'loan_repayment_value',
-            loan_repayment_total)
-
-        reimbursement_total = self.calculate_child_transaction_aggregation(
-            activity, 7)
-        child_aggregation = self.set_aggregation(
-            child_aggregation,
-            'reimbursement_currency',
-            'reimbursement_value',
-            reimbursement_total)
-
-        purchase_of_equity_total = self\
-            .calculate_child_transaction_aggregation(
-                activity, 8)
-        child_aggregation = self.set_aggregation(
-            child_aggregation,
-            'purchase_of_equity_currency',
-            'purchase_of_equity_value',
-            purchase_of_equity_total)
-
-        sale_of_equity_total = self.calculate_child_transaction_aggregation(
-            activity, 9)
-        child_aggregation = self.set_aggregation(
-            child_aggregation,
-            'sale_of_equity_currency',
-            'sale_of_equity_value',
-            sale_of_equity_total)
-
-        credit_guarantee_total = self.calculate_child_transaction_aggregation(
-            activity, 10)
-        child_aggregation = self.set_aggregation(
-            child_aggregation,
-            'credit_guarantee_currency',
-            'credit_guarantee_value',
-            credit_guarantee_total)
-
-        incoming_commitment_total = self\
-            .calculate_child_transaction_aggregation(
-                activity, 11)
-        child_aggregation = self.set_aggregation(
-            child_aggregation,
-            'incoming_commitment_currency',
-            'incoming_commitment_value',
-            incoming_commitment_total)
-
-        # raises IntegrityError when an activity appears in multiple sources
-        # and they are parsed at the same time TODO find solution that's less
-        # ugly
-        try:
-            child_aggregation.save()
-        except IntegrityError:
-            pass
-
-    def update_total_aggregation(
-            self,
-            activity,
-            total_aggregation,
-            aggregation_type):
+            self.save_aggregations(aggregations)
+        except IntegrityError as e:
+            # f.e. an activity of the batch was deleted meanwhile, by a
+            # parse of another dataset with the same activity:
+            logger.warning(
+                "Aggregations of %d activities: %s, saving them for the "
+                "remaining activities", len(activity_ids), e)
+
+            remaining = set(Activity.objects.filter(
+                id__in=activity_ids).values_list('id', flat=True))
+
+            try:
+                self.save_aggregations([
+                    (model, {activity_id: row
+                             for activity_id, row in rows.items()
+                             if activity_id in remaining})
+                    for model, rows in aggregations
+                ])
+            except IntegrityError as e:
+                logger.exception(e)
+
+    def save_aggregations(self, aggregations):
         """
+        Upsert the aggregations of a batch at once, (model, rows) pairs (see
+        upsert)
+        """
+        with transaction.atomic():
+            for model, rows in aggregations:
+                upsert(model, rows)
 
+    def get_activity_totals(self, activity_ids):
         """
-        activity_value = getattr(
-            activity.activity_aggregation, aggregation_type + '_value')
-        activity_currency = getattr(
-            activity.activity_aggregation, aggregation_type + '_currency')
-        child_value = getattr(activity.child_aggregation,
-                              aggregation_type + '_value')
-        child_currency = getattr(
-            activity.child_aggregation, aggregation_type + '_currency')
-
-        total_aggregation_currency = None
-
-        if (activity_value != 0 and child_value == 0
-                or activity_value == child_value):
-            total_aggregation_currency = activity_currency
-        elif activity_value == 0 and child_value != 0:
-            total_aggregation_currency = child_currency
-
-        if (activity_value is not None) and (child_value is not None):
-            total_aggregation_value = activity_value + child_value
-        elif (activity_value is not None) and (child_value is None):
-            total_aggregation_value = activity_value
-        elif (activity_value is None) and (child_value is not None):
-            total_aggregation_value = child_value
-        else:
-            total_aggregation_value = None
+        The budget and transaction totals per currency of a batch of
+        activities:
+        {activity_id: {aggregation type: {currency: total}}}
+        """
+        totals = defaultdict(lambda: defaultdict(OrderedDict))
 
-        setattr(total_aggregation, aggregation_type +
-                '_currency', total_aggregation_currency)
-        setattr(total_aggregation, aggregation_type +
-                '_value', total_aggregation_value)
+        budgets = Budget.objects.filter(
+            activity_id__in=activity_ids,
+        ).values_list('activity_id', 'currency_id').annotate(
+            Sum('value')).order_by()
 
-        return total_aggregation
+        for activity_id, currency, total in budgets:
+            totals[activity_id]['budget'][currency] = total
 
-    def calculate_activity_plus_child_aggregations(self, activity):
+        transactions = Transaction.objects.filter(
+            activity_id__in=activity_ids,
+            transaction_type__in=list(TRANSACTION_TYPES),
+        ).values_list(
+            'activity_id', 'transaction_type_id', 'currency_id'
+        ).annotate(Sum('value')).order_by()
 
-        try:
-            total_aggregation = activity.activity_plus_child_aggregation
-        except ObjectDoesNotExist:
-            total_aggregation = ActivityPlusChildAggregation()
-            total_aggregation.activity = activity
-
-        total_aggregation = self.update_total_aggregation(
-            activity, total_aggregation, 'budget')
-        total_aggregation = self.update_total_aggregation(
-            activity, total_aggregation, 'incoming_funds')
-        total_aggregation = self.update_total_aggregation(
-            activity, total_aggregation, 'commitment')
-        total_aggregation = self.update_total_aggregation(
-            activity, total_aggregation, 'disbursement')
-        total_aggregation = self.update_total_aggregation(
-            activity, total_aggregation, 'expenditure')
-
-        total_aggregation = self.update_total_aggregation(
-            activity, total_aggregation, 'interest_payment')
-        total_aggregation = self.update_total_aggregation(
-            activity, total_aggregation, 'loan_repayment')
-        total_aggregation = self.update_total_aggregation(
-            activity, total_aggregation, 'reimbursement')
-        total_aggregation = self.update_total_aggregation(
-            activity, total_aggregation, 'purchase_of_equity')
-        total_aggregation = self.update_total_aggregation(
-            activity, total_aggregation, 'sale_of_equity')
-        total_aggregation = self.update_total_aggregation(
-            activity, total_aggregation, 'credit_guarantee')
-        total_aggregation = self.update_total_aggregation(
-            activity, total_aggregation, 'incoming_commitment')
-
-        # raises IntegrityError when an activity appears in multiple sources
-        # and they are parsed at the same time TODO find solution that's less
-        # ugly
-        try:
-            total_aggregation.save()
-        except IntegrityError:
-            pass
+        for activity_id, transaction_type, currency, total in transactions:
+            aggregation_type = TRANSACTION_TYPES[transaction_type]
+            totals[activity_id][aggregation_type][currency] = total
+
+        return totals
+
+    def get_child_totals(self, activity_ids):
+        """
+        The budget and transaction totals per currency of the children of a
+        batch of activities (the activities which refer to them as their
+        parent), in the same form as get_activity_totals
+        """
+        totals = defaultdict(lambda: defaultdict(OrderedDict))
+
+        activity_ids_by_identifier = defaultdict(list)
+        for activity_id, iati_identifier in Activity.objects.filter(
+                id__in=activity_ids).values_list('id', 'iati_identifier'):
+            activity_ids_by_identifier[iati_identifier].append(activity_id)
+
+        children = {
+            'activity__relatedactivity__ref__in': list(
+                activity_ids_by_identifier),
+            'activity__relatedactivity__type': PARENT_TYPE,
+            'currency__isnull': False,
+        }
+
+        budgets = Budget.objects.filter(**children).values_list(
+            'activity__relatedactivity__ref', 'currency_id'
+        ).annotate(Sum('value')).order_by()
+
+        for ref, currency, total in budgets:
+            for activity_id in activity_ids_by_identifier[ref]:
+                totals[activity_id]['budget'][currency] = total
+
+        transactions = Transaction.objects.filter(
+            transaction_type__in=list(TRANSACTION_TYPES),
+            **children
+        ).values_list(
+            'activity__relatedactivity__ref',
+            'transaction_type_id',
+            'currency_id',
+        ).annotate(Sum('value')).order_by()
+
+        for ref, transaction_type, currency, total in transactions:
+            aggregation_type = TRANSACTION_TYPES[transaction_type]
+            for activity_id in activity_ids_by_identifier[ref]:
+                totals[activity_id][aggregation_type][currency] = total
+
+        return totals
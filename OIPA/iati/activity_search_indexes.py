@@ -1,11 +1,11 @@
 from datetime import datetime
-from functools import partial
 
 from django.conf import settings
 from django.contrib.postgres.search import SearchVector
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.transaction import atomic
 
-from common.util import print_progress, setInterval
+from common.util import print_progress
 from iati.models import (
     Activity, ActivitySearch, BudgetItemDescription, Conditions,
     ContactInfoDepartment, ContactInfoJobTitle, ContactInfoMailingAddress,
@@ -19,19 +19,89 @@ from iati.transaction.models import (
 from iati_organisation.models import Organisation, OrganisationName
 from iati_synchroniser.models import Publisher
 
+SEARCH_FIELDS = (
+    'iati_identifier',
+    'title',
+    'description',
+    'reporting_org',
+    'participating_org',
+    'recipient_country',
+    'recipient_region',
+    'sector',
+    'document_link',
+    'other_identifier',
+    'contact_info',
+    'location',
+    'country_budget_items',
+    'policy_marker',
+    'transaction',
+    'related_activity',
+    'conditions',
+    'result'
+)
 
-# TODO: prefetches - 2016-01-07
-def reindex_activity(activity):
-    if hasattr(
-        settings, 'FTS_ENABLED'
-    ) and getattr(settings, 'FTS_ENABLED') is False:
-        return
+# Everything get_search_fields reads, loaded with one query per relation for
+# a whole batch of activities (see get_queryset):
+SELECT_RELATED = (
+    'title',
+    'publisher__organisation__name',
+    'country_budget_items',
+    'conditions',
+)
 
-    try:
-        activity_search = ActivitySearch.objects.get(activity=activity.id)
-    except ObjectDoesNotExist:
-        activity_search = ActivitySearch()
+PREFETCH_RELATED = (
+    'title__narratives',
+    'description_set__narratives',
+    'reporting_organisations__narratives',
+    'publisher__organisation__name__narratives',
+    'participating_organisations__narratives',
+    'recipient_country',
+    'recipient_region',
+    'sector',
+    'documentlink_set__categories',
+    'documentlink_set__documentlinktitle__narratives',
+    'otheridentifier_set__narratives',
+    'contactinfo_set__organisation__narratives',
+    'contactinfo_set__department__narratives',
+    'contactinfo_set__person_name__narratives',
+    'contactinfo_set__job_title__narratives',
+    'contactinfo_set__mailing_address__narratives',
+    'location_set',
+    'country_budget_items__budgetitem_set__description__narratives',
+    'activitypolicymarker_set__narratives',
+    'transaction_set__description__narratives',
+    'transaction_set__provider_organisation__narratives',
+    'transaction_set__receiver_organisation__narratives',
+    'relatedactivity_set',
+    'conditions__condition_set__narratives',
+    'result_set__resulttitle__narratives',
+    'result_set__resultdescription__narratives',
+    'result_set__resultindicator_set__resultindicatortitle__narratives',
+    'result_set__resultindicator_set__resultindicatordescription__narratives',  # NOQA: E501
+    'result_set__resultindicator_set__resultindicatorperiod_set__targets__resultindicatorperiodtargetcomment_set__narratives',  # NOQA: E501
+    'result_set__resultindicator_set__resultindicatorperiod_set__actuals__resultindicatorperiodactualcomment_set__narratives',  # NOQA: E501
+)
+
+
+def fts_enabled():
+    return getattr(settings, 'FTS_ENABLED', True) is not False
 
+
+def get_queryset():
+    return Activity.objects.select_related(
+        *SELECT_RELATED
+    ).prefetch_related(
+        *PREFETCH_RELATED
+    )
+
+
+def get_search_fields(activity):
+    """
+    The texts of an activity to search in, per ActivitySearch field.
+
+    Reads the related rows through .all() only, so they are served from the
+    prefetch cache when the activity comes from get_queryset()
+    """
     # data prep
     title_text = []
     try:
@@ -58,8 +128,9 @@ def reindex_activity(activity):
             reporting_org_text.append(narrative.content)
     except (
         Publisher.DoesNotExist, Organisation.DoesNotExist,
-        OrganisationName.DoesNotExist
+        OrganisationName.DoesNotExist, AttributeError
     ):
+        # AttributeError: no publisher or organisation at all
         pass
 
     participating_org_text = []
@@ -108,10 +179,7 @@ def reindex_activity(activity):
     for contact_info in activity.contactinfo_set.all():
         # iati-activities/iati-activity/contact-info/organisation/narrative
         try:
-            organisation = ContactInfoOrganisation.objects.get(
-                contact_info=contact_info
-            )
-            for narrative in organisation.narratives.all():
+            for narrative in contact_info.organisation.narratives.all():
                 contact_info_text.append(narrative.content)
         except ContactInfoOrganisation.DoesNotExist as e:
             pass
@@ -253,70 +321,98 @@ def reindex_activity(activity):
                         for narrative in actual_comment.narratives.all():
                             result_text.append(narrative.content)
 
-    activity_search.activity = activity
-    activity_search.iati_identifier = activity.iati_identifier
-    activity_search.title = " ".join(title_text)
-    activity_search.description = " ".join(description_text)
-    activity_search.reporting_org = " ".join(reporting_org_text)
-    activity_search.participating_org = " ".join(participating_org_text)
-    activity_search.recipient_country = " ".join(recipient_country_text)
-    activity_search.recipient_region = " ".join(recipient_region_text)
-    activity_search.sector = " ".join(sector_text)
-    activity_search.document_link = " ".join(document_link_text)
-    activity_search.other_identifier = " ".join(other_identifier_text)
-    activity_search.contact_info = " ".join(contact_info_text)
-    activity_search.location = " ".join(location_text)
-    activity_search.country_budget_items = " ".join(country_budget_items_text)
-    activity_search.transaction = " ".join(transaction_text)
-    activity_search.policy_marker = " ".join(policy_marker_text)
-    activity_search.related_activity = " ".join(related_activity_text)
-    activity_search.conditions = " ".join(conditions_text)
-    activity_search.result = " ".join(result_text)
-
-    combined_vector = SearchVector(
-        'iati_identifier',
-        'title',
-        'description',
-        'reporting_org',
-        'participating_org',
-        'recipient_country',
-        'recipient_region',
-        'sector',
-        'document_link',
-        'other_identifier',
-        'contact_info',
-        'location',
-        'country_budget_items',
-        'policy_marker',
-        'transaction',
-        'related_activity',
-        'conditions',
-        'result'
-    )
+    return {
+        'iati_identifier': activity.iati_identifier,
+        'title': " ".join(title_text),
+        'description': " ".join(description_text),
+        'reporting_org': " ".join(reporting_org_text),
+        'participating_org': " ".join(participating_org_text),
+        'recipient_country': " ".join(recipient_country_text),
+        'recipient_region': " ".join(recipient_region_text),
+        'sector': " ".join(sector_text),
+        'document_link': " ".join(document_link_text),
+        'other_identifier': " ".join(other_identifier_text),
+        'contact_info': " ".join(contact_info_text),
+        'location': " ".join(location_text),
+        'country_budget_items': " ".join(country_budget_items_text),
+        'transaction': " ".join(transaction_text),
+        'policy_marker': " ".join(policy_marker_text),
+        'related_activity': " ".join(related_activity_text),
+        'conditions': " ".join(conditions_text),
+        'result': " ".join(result_text),
+    }
 
-    activity_search.last_reindexed = datetime.now()
-    activity_search.save()
 
-    ActivitySearch.objects.filter(id=activity_search.id).update(
-        search_vector_text=combined_vector
-    )
+def reindex_activities(activity_ids):
+    """
+    Reindex the full text search values of a batch of activities.
+
+    The related rows are loaded with one query per relation for the whole
+    batch, the ActivitySearch rows are replaced with one bulk insert and the
+    search vectors are computed by a single UPDATE. The number of queries
+    doesn't depend on the number of activities.
+    """
+    if not fts_enabled():
+        return
+
+    activity_ids = list(activity_ids)
+    if not activity_ids:
+        return
+
+    last_reindexed = datetime.now()
+    activity_searches = [
+        ActivitySearch(
+            activity=activity,
+            last_reindexed=last_reindexed,
+            **get_search_fields(activity)
+        ) for activity in get_queryset().filter(id__in=activity_ids)
+    ]
+
+    with atomic():
+        ActivitySearch.objects.filter(activity_id__in=activity_ids).delete()
+        ActivitySearch.objects.bulk_create(activity_searches)
 
+        ActivitySearch.objects.filter(activity_id__in=activity_ids).update(
+            search_vector_text=SearchVector(*SEARCH_FIELDS)
+        )
 
-def reindex_all_activities():
 
+def reindex_activity(activity):
+    reindex_activities([activity.id])
+
+
+def reindex_queryset(queryset, batch_size=500):
+    """
+    Reindex the activities of a queryset in batches of batch_size, printing
+    the progress after every batch
+    """
     progress = {
         'offset': 0,
-        'count': Activity.objects.all().count()
+        'count': queryset.count()
     }
 
-    setInterval(partial(print_progress, progress), 10)
+    batch = []
+    ids = queryset.order_by('id').values_list('id', flat=True)
+
+    for activity_id in ids.iterator(chunk_size=batch_size):
+        batch.append(activity_id)
+
+        if len(batch) >= batch_size:
+            reindex_activities(batch)
+            progress['offset'] += len(batch)
+            print_progress(progress)
+            batch = []
+
+    if batch:
+        reindex_activities(batch)
+        progress['offset'] += len(batch)
+        print_progress(progress)
+
 
-    for activity in Activity.objects.all().iterator():
-        reindex_activity(activity)
-        progress['offset'] += 1
+def reindex_all_activities(batch_size=500):
+    reindex_queryset(Activity.objects.all(), batch_size)
 
 
-def reindex_activity_by_source(dataset_id):
-    activities = Activity.objects.all().filter(dataset__id=dataset_id)
-    for activity in activities:
-        reindex_activity(activity)
+def reindex_activity_by_source(dataset_id, batch_size=500):
+    reindex_queryset(
+        Activity.objects.filter(dataset__id=dataset_id), batch_size)
@@ -0,0 +1,156 @@
+import glob
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from lxml import etree
+
+from iati.parser.IATI_2_02 import Parse as IATI_202_Parser
+from iati.parser.IATI_2_03 import Parse as IATI_203_Parser
+from iati_organisation.parser.organisation_2_02 import Parse as Org_2_02_Parser
+from iati_organisation.parser.organisation_2_03 import Parse as Org_2_03_Parser
+
+PARSERS = {
+    ('iati-activities', '2.02'): IATI_202_Parser,
+    ('iati-activities', '2.03'): IATI_203_Parser,
+    ('iati-organisations', '2.02'): Org_2_02_Parser,
+    ('iati-organisations', '2.03'): Org_2_03_Parser,
+}
+
+
+def get_handler_names(table):
+    for node in table.values():
+        if node.handler is not None:
+            yield node.handler
+        yield from get_handler_names(node.children)
+
+
+class Command(BaseCommand):
+    """
+        Compare how many elements per second the parser dispatches to its
+        handler methods, using xpaths and generated function names (the
+        parse() from before the dispatch table) versus parse() with the
+        precompiled dispatch table. For both, the handlers are replaced by
+        the same stub, so no database is needed, and the rate is computed
+        from the elements each of them actually visited.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files',
+            nargs='*',
+            help='IATI XML files (2.02 / 2.03), defaults to the example files '
+                 'in static/xml')
+        parser.add_argument(
+            '--repeat',
+            action='store',
+            dest='repeat',
+            type=int,
+            default=20,
+            help='Number of times each file is dispatched')
+
+    def handle(self, *args, **options):
+        files = options['files'] or sorted(glob.glob(
+            os.path.join(settings.BASE_DIR, 'static', 'xml', '*.xml')))
+
+        for path in files:
+            root = etree.parse(
+                path, etree.XMLParser(huge_tree=True)).getroot()
+            parser_class = PARSERS.get((root.tag, root.get('version')))
+
+            if parser_class is None:
+                self.stdout.write('{}: skipped, unsupported file'.format(
+                    os.path.basename(path)))
+                continue
+
+            legacy = self.run(self.legacy_dispatch, parser_class, root,
+                              options['repeat'])
+            table = self.run(self.table_dispatch, parser_class, root,
+                             options['repeat'])
+
+            if legacy['handled'] != table['handled']:
+                self.stdout.write(
+                    '{}: the handlers were called {} times before and {} '
+                    'times after'.format(
+                        os.path.basename(path),
+                        legacy['handled'], table['handled']))
+
+            self.stdout.write(
+                '{}: {} handler calls, {} elements visited at {:.0f} '
+                'elements/sec before, {} elements visited at {:.0f} '
+                'elements/sec after, {:.1f}x faster per file'.format(
+                    os.path.basename(path),
+                    table['handled'],
+                    legacy['visited'],
+                    legacy['visited'] * options['repeat'] / legacy['time'],
+                    table['visited'],
+                    table['visited'] * options['repeat'] / table['time'],
+                    legacy['time'] / table['time']))
+
+    def get_parser(self, parser_class, root, counts):
+        """
+        A parser of which all handlers only count their calls, and which
+        counts the elements parse() visits
+        """
+        parser = parser_class(root)
+
+        def handler(element):
+            counts['handled'] += 1
+
+        for name in get_handler_names(parser_class.get_dispatch_table()):
+            setattr(parser, name, handler)
+
+        def parse(element, node=None):
+            if type(element).__name__ == '_Element' \
+                    and element.tag != etree.Comment:
+                counts['visited'] += 1
+            return parser_class.parse(parser, element, node)
+
+        # parse() recurses through self.parse:
+        parser.parse = parse
+
+        return parser
+
+    def run(self, dispatch, parser_class, root, repeat):
+        """
+        Dispatch all top-level elements of root repeat times, returns the
+        time it took and the elements visited and handler calls of one pass
+        """
+        counts = {'visited': 0, 'handled': 0}
+        parser = self.get_parser(parser_class, root, counts)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for element in root.getchildren():
+                dispatch(parser, element, counts)
+        elapsed = time.perf_counter() - start
+
+        return {
+            'time': elapsed,
+            'visited': counts['visited'] // repeat,
+            'handled': counts['handled'] // repeat,
+        }
+
+    def legacy_dispatch(self, parser, element, counts):
+        """
+        Like parse() before the dispatch table: every element's xpath is
+        turned into a function name, and all children are visited
+        """
+        if type(element).__name__ != '_Element' \
+                or element.tag == etree.Comment:
+            return
+        counts['visited'] += 1
+
+        function_name = parser.generate_function_name(
+            parser.root.getroottree().getpath(element))
+
+        if hasattr(parser, function_name) \
+                and callable(getattr(parser, function_name)):
+            getattr(parser, function_name)(element)
+
+        for e in element.getchildren():
+            self.legacy_dispatch(parser, e, counts)
+
+    def table_dispatch(self, parser, element, counts):
+        parser.parse(element)
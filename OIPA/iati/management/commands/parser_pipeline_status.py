@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from iati.parser import pipeline
+
+
+class Command(BaseCommand):
+    """
+        Show the throughput of every stage of the parser pipeline (see
+        iati.parser.pipeline) and the number of batches waiting in the queues
+        of the post save and indexing stages.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            dest='reset',
+            default=False,
+            help='Reset the metrics after showing them')
+
+    def handle(self, *args, **options):
+        queues = {
+            'post_save': pipeline.get_queue(pipeline.post_save_activities),
+            'indexing': pipeline.get_queue(pipeline.index_activities),
+        }
+
+        for stage, metrics in sorted(
+                pipeline.get_metrics().items(),
+                key=lambda item: pipeline.STAGES.index(item[0])):
+            line = (
+                '{stage}: {activities} activities in {batches} batches, '
+                '{per_second:.1f} activities/sec, waited {waited:.0f} sec '
+                'for the next stage'.format(
+                    stage=stage,
+                    waited=metrics['waited_milliseconds'] / 1000,
+                    **metrics))
+
+            if stage in queues:
+                line += ', {} batches queued'.format(
+                    pipeline.get_queue_length(queues[stage]))
+
+            self.stdout.write(line)
+
+        if options['reset']:
+            pipeline.reset_metrics()
@@ -25,12 +25,20 @@ class Command(BaseCommand):
                             help='Reindex only activities with this dataset_id'
                             )
 
+        parser.add_argument('--batch-size',
+                            action='store',
+                            dest='batch_size',
+                            type=int,
+                            default=500,
+                            help='Number of activities reindexed at once')
+
     def handle(self, *args, **options):
         if options['activity']:
             activity = Activity.objects.get(
                 iati_identifier=options['activity'])
             reindex_activity(activity)
         elif options['source']:
-            reindex_activity_by_source(options['source'])
+            reindex_activity_by_source(
+                options['source'], options['batch_size'])
         else:
-            reindex_all_activities()
+            reindex_all_activities(options['batch_size'])
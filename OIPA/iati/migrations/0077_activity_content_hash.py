@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-16 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iati', '0076_auto_20201106_1302'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
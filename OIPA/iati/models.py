@@ -215,6 +215,10 @@ class Activity(models.Model):
     # is this activity changed from the originally parsed version?
     modified = models.BooleanField(default=False, db_index=True)
 
+    # fingerprint of the parsed <iati-activity> element, unchanged activities
+    # are skipped when their dataset is parsed again:
+    content_hash = models.CharField(max_length=40, default="", blank=True)
+
     objects = ActivityManager(
         fields=('title', 'description'),  # fields on the model
         config='pg_catalog.simple',  # default dictionary to use
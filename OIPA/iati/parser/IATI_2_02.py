@@ -1,5 +1,4 @@
 import logging
-import numbers
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
 
@@ -187,6 +186,8 @@ class Parse(IatiParser):
         #     # TransactionProvider are not deleted atm - 2015-10-01
         #     # TODO: do this after activity is parsed along with other saves?
 
+        content_hash = self.get_content_hash(element)
+
         try:
             old_activity = models.Activity.objects.get(
                 iati_identifier=activity_id)
@@ -194,6 +195,10 @@ class Parse(IatiParser):
             old_activity = None
 
         if old_activity:
+            self.skip_unchanged_activity(old_activity, content_hash)
+            # it may not be a child of the same parent any longer:
+            self.dirty_parents.mark_activities([old_activity])
+            self.dirty_chains.mark([old_activity.iati_identifier])
             old_activity.delete()
 
         # TODO: assert title is in xml, for proper OneToOne relation
@@ -212,6 +217,7 @@ class Parse(IatiParser):
         activity.linked_data_uri = linked_data_uri
         activity.default_currency = default_currency
         activity.iati_standard_version_id = self.VERSION
+        activity.content_hash = content_hash
 
         activity.published = True
         activity.ready_to_publish = True
@@ -2050,24 +2056,10 @@ class Parse(IatiParser):
         budget.currency = currency
 
         if settings.CONVERT_CURRENCIES:
-            budget.xdr_value = convert.currency_from_to(
-                budget.currency_id, 'XDR', budget.value_date, budget.value)
-            budget.usd_value = round(convert.currency_from_to(
-                budget.currency_id, 'USD', budget.value_date, budget.value), 2)
-            budget.eur_value = convert.currency_from_to(
-                budget.currency_id, 'EUR', budget.value_date, budget.value)
-            budget.gbp_value = convert.currency_from_to(
-                budget.currency_id, 'GBP', budget.value_date, budget.value)
-            budget.jpy_value = convert.currency_from_to(
-                budget.currency_id, 'JPY', budget.value_date, budget.value)
-            budget.cad_value = convert.currency_from_to(
-                budget.currency_id, 'CAD', budget.value_date, budget.value)
-            imf_url, usd_exchange_rate = convert.get_imf_url_and_exchange_rate(
-                budget.currency_id, budget.value_date)
-            budget.imf_url = imf_url
-            budget.usd_exchange_rate = round(usd_exchange_rate,
-                                             5) if isinstance(
-                usd_exchange_rate, numbers.Number) else usd_exchange_rate
+            for field, converted in convert.convert_values(
+                    budget.currency_id, budget.value_date,
+                    budget.value).items():
+                setattr(budget, field, converted)
 
         return element
 
@@ -2199,38 +2191,11 @@ class Parse(IatiParser):
         planned_disbursement.currency = currency
 
         if settings.CONVERT_CURRENCIES:
-            planned_disbursement.xdr_value = convert.currency_from_to(
-                planned_disbursement.currency_id, 'XDR',
-                planned_disbursement.value_date,
-                planned_disbursement.value)
-            planned_disbursement.usd_value = round(convert.currency_from_to(
-                planned_disbursement.currency_id, 'USD',
-                planned_disbursement.value_date,
-                planned_disbursement.value), 2)
-            planned_disbursement.eur_value = convert.currency_from_to(
-                planned_disbursement.currency_id, 'EUR',
-                planned_disbursement.value_date,
-                planned_disbursement.value)
-            planned_disbursement.gbp_value = convert.currency_from_to(
-                planned_disbursement.currency_id, 'GBP',
-                planned_disbursement.value_date,
-                planned_disbursement.value)
-            planned_disbursement.jpy_value = convert.currency_from_to(
-                planned_disbursement.currency_id, 'JPY',
-                planned_disbursement.value_date,
-                planned_disbursement.value)
-            planned_disbursement.cad_value = convert.currency_from_to(
-                planned_disbursement.currency_id, 'CAD',
-                planned_disbursement.value_date,
-                planned_disbursement.value)
-            imf_url, usd_exchange_rate = convert.get_imf_url_and_exchange_rate(
-                planned_disbursement.currency_id,
-                planned_disbursement.value_date)
-            planned_disbursement.imf_url = imf_url
-            planned_disbursement.usd_exchange_rate = round(
-                usd_exchange_rate, 5) if isinstance(usd_exchange_rate,
-                                                    numbers.Number) else usd_exchange_rate  # NOQA: E501
-        return element
+            for field, converted in convert.convert_values(
+                    planned_disbursement.currency_id,
+                    planned_disbursement.value_date,
+                    planned_disbursement.value).items():
+                setattr(planned_disbursement, field, converted)
 
     def iati_activities__iati_activity__planned_disbursement__provider_org(
             self, element):
@@ -2451,30 +2416,10 @@ class Parse(IatiParser):
         transaction.currency = currency
 
         if settings.CONVERT_CURRENCIES:
-            transaction.xdr_value = convert.currency_from_to(
-                transaction.currency_id, 'XDR', transaction.value_date,
-                transaction.value)
-            transaction.usd_value = round(convert.currency_from_to(
-                transaction.currency_id, 'USD', transaction.value_date,
-                transaction.value), 2)
-            transaction.eur_value = convert.currency_from_to(
-                transaction.currency_id, 'EUR', transaction.value_date,
-                transaction.value)
-            transaction.gbp_value = convert.currency_from_to(
-                transaction.currency_id, 'GBP', transaction.value_date,
-                transaction.value)
-            transaction.jpy_value = convert.currency_from_to(
-                transaction.currency_id, 'JPY', transaction.value_date,
-                transaction.value)
-            transaction.cad_value = convert.currency_from_to(
-                transaction.currency_id, 'CAD', transaction.value_date,
-                transaction.value)
-            imf_url, usd_exchange_rate = convert.get_imf_url_and_exchange_rate(
-                transaction.currency_id, transaction.value_date)
-            transaction.imf_url = imf_url
-            transaction.usd_exchange_rate = round(usd_exchange_rate, 5) if \
-                isinstance(usd_exchange_rate, numbers.Number) else \
-                usd_exchange_rate
+            for field, converted in convert.convert_values(
+                    transaction.currency_id, transaction.value_date,
+                    transaction.value).items():
+                setattr(transaction, field, converted)
 
         return element
 
@@ -4217,7 +4162,7 @@ class Parse(IatiParser):
         self.register_model('FssForecast', fss_forecast)
         return element
 
-    def post_save_models(self):
+    def post_save_models(self, update_search_index=True):
         """Perform all actions that need to happen after a single activity's
         been parsed."""
         activity = self.get_model('Activity')
@@ -4229,15 +4174,8 @@ class Parse(IatiParser):
         participating_organisations = self.get_model_list(
             'ActivityParticipatingOrganisation')
 
-        post_save.set_related_activities(activity)
-        post_save.set_participating_organisation_activity_id(
-            participating_organisations)
-        post_save.set_transaction_provider_receiver_activity(activity)
-        post_save.set_derived_activity_dates(activity)
-        # post_save.set_activity_aggregations(activity)
-        post_save.update_activity_search_index(activity)
-        # post_save.set_sector_transaction(activity)
-        post_save.set_sector_budget(activity)
+        post_save.post_save_activity(
+            activity, participating_organisations, update_search_index)
 
     def post_save_file(self, dataset):
         """Perform all actions that need to happen after a single IATI
@@ -4247,6 +4185,9 @@ class Parse(IatiParser):
         dataset -- the Dataset object
         """
         self.delete_removed_activities(dataset)
+        post_save.set_dataset_activity_aggregations(
+            dataset, self.dirty_parents)
+        self.dirty_chains.save()
 
     def delete_removed_activities(self, dataset):
         """ Delete activities that were not found in the dataset any longer
@@ -4260,13 +4201,19 @@ class Parse(IatiParser):
         self.parse_start_datetime -- the datetime at which parsing this
         dataset started
         """
-        models.Activity.objects.filter(
+        removed_activities = models.Activity.objects.filter(
             dataset=dataset,
-            last_updated_model__lt=self.parse_start_datetime).delete()
+            last_updated_model__lt=self.parse_start_datetime)
+
+        self.dirty_parents.mark_activities(removed_activities)
+        self.dirty_chains.mark(
+            removed_activities.values_list('iati_identifier', flat=True))
+        removed_activities.delete()
 
     def post_save_validators(self, dataset):
 
-        for a in models.Activity.objects.filter(dataset=dataset):
+        # unchanged activities are not validated again, their notes are kept:
+        for a in self.get_changed_activities(dataset):
 
             post_save_validators.identifier_correct_prefix(self, a)
             post_save_validators.geo_percentages_add_up(self, a)
@@ -0,0 +1,177 @@
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import signals
+from django.db.models.fields.related import ForeignKey, OneToOneField
+
+log = logging.getLogger(__name__)
+
+# Models which point to their parent through a GenericForeignKey, the parent
+# is set on them as _related_object by the parsers (see add_narrative):
+GENERIC_RELATED_MODELS = ("OrganisationNarrative", "Narrative")
+
+
+class BulkSaver(object):
+    """
+    Saves the models collected by a parser (its model_store) with one
+    bulk_create per model class instead of one INSERT per model.
+
+    Model classes are inserted in the order of their foreign key dependencies,
+    so every model's related objects have a primary key by the time it is
+    inserted. Several model stores (f.e. of all activities in a batch) can be
+    saved at once.
+
+    Models which can't be bulk created (already saved models, models with
+    save signal receivers, multi-table inherited models and models pointing to
+    their own class) are saved one by one, like the parser used to do for
+    every model.
+    """
+
+    def __init__(self, update_related, batch_size=None):
+        """
+        Keyword arguments:
+        update_related -- function which sets the foreign keys of a model to
+        its related objects (see IatiParser.update_related)
+        batch_size -- the maximum number of rows per INSERT
+        """
+        self.update_related = update_related
+        self.batch_size = batch_size or settings.IATI_PARSER_BULK_CREATE_SIZE
+
+    def save(self, model_stores):
+        models_by_class = self.group_by_class(model_stores)
+
+        for model_class in self.sort_classes(models_by_class):
+            models = models_by_class[model_class]
+
+            if self.can_bulk_create(model_class):
+                self.bulk_create(model_class, models)
+            else:
+                self.save_one_by_one(models)
+
+    def group_by_class(self, model_stores):
+        models_by_class = OrderedDict()
+        seen = set()
+
+        for model_store in model_stores:
+            for model_list in model_store.values():
+                for model in model_list:
+                    # The same instance can be registered more than once:
+                    if model is None or id(model) in seen:
+                        continue
+                    seen.add(id(model))
+
+                    models_by_class.setdefault(
+                        model.__class__, []).append(model)
+
+        return models_by_class
+
+    def dependencies(self, model_class, models):
+        dependencies = set()
+
+        for field in model_class._meta.fields:
+            if isinstance(field, (ForeignKey, OneToOneField)):
+                dependencies.add(field.related_model)
+
+        if model_class.__name__ in GENERIC_RELATED_MODELS:
+            for model in models:
+                related_object = getattr(model, '_related_object', None)
+                if related_object is not None:
+                    dependencies.add(related_object.__class__)
+
+        dependencies.discard(model_class)
+        return dependencies
+
+    def sort_classes(self, models_by_class):
+        """
+        Topologically sort the model classes on their foreign keys, keeping
+        the order in which they were registered where possible. Classes in a
+        dependency cycle are saved in registration order.
+        """
+        dependencies = {
+            model_class: self.dependencies(model_class, models) & set(
+                models_by_class)
+            for model_class, models in models_by_class.items()
+        }
+
+        ordered = []
+        done = set()
+        pending = list(models_by_class)
+
+        while pending:
+            for model_class in pending:
+                if dependencies[model_class] <= done:
+                    break
+            else:
+                # a cycle, fall back to the registration order:
+                model_class = pending[0]
+
+            pending.remove(model_class)
+            ordered.append(model_class)
+            done.add(model_class)
+
+        return ordered
+
+    def can_bulk_create(self, model_class):
+        meta = model_class._meta
+
+        if meta.parents:
+            return False
+
+        if signals.pre_save.has_listeners(model_class) \
+                or signals.post_save.has_listeners(model_class):
+            return False
+
+        for field in meta.fields:
+            if isinstance(field, (ForeignKey, OneToOneField)) \
+                    and field.related_model == model_class:
+                return False
+
+        return True
+
+    def bulk_create(self, model_class, models):
+        new_models = []
+        saved_models = []
+
+        for model in models:
+            try:
+                self.update_related(model)
+            except Exception as e:
+                log.exception(e)
+                continue
+
+            if model.pk is None:
+                new_models.append(model)
+            else:
+                saved_models.append(model)
+
+        self.save_one_by_one(saved_models, update_related=False)
+
+        if not new_models:
+            return
+
+        try:
+            with transaction.atomic():
+                model_class.objects.bulk_create(
+                    new_models, batch_size=self.batch_size)
+        except Exception as e:
+            # Find and skip the invalid rows, the way it was done before
+            # bulk inserting:
+            log.exception(e)
+            for model in new_models:
+                model.pk = None
+            self.save_one_by_one(new_models, update_related=False)
+
+    def save_one_by_one(self, models, update_related=True):
+        for model in models:
+            try:
+                if update_related:
+                    self.update_related(model)
+
+                with transaction.atomic():
+                    model.save()
+
+            except Exception as e:
+                log.exception(e)
+                pass
@@ -1,27 +1,53 @@
 import datetime
+import hashlib
 import logging
 import re
+import time
 from collections import OrderedDict
 from decimal import Decimal, InvalidOperation
 
 import dateutil.parser
 from django.conf import settings
-from django.db.models import Model
+from django.db.models import Model, Q
 from django.db.models.fields.related import ForeignKey, OneToOneField
 from lxml import etree
 
 from common.util import findnth_occurence_in_string, normalise_unicode_string
+from iati.activity_aggregation_calculation import DirtyParents
+from iati.models import Activity
+from iati.parser import pipeline, post_save, post_save_validators
+from iati.parser.bulk_save import BulkSaver
 from iati.parser.exceptions import (
     FieldValidationError, IgnoredVocabularyError, NoUpdateRequired,
     ParserError, RequiredFieldError, ValidationError
 )
 from iati_codelists import models as codelist_models
-from iati_synchroniser.models import DatasetNote
+from iati_synchroniser.models import Dataset, DatasetNote
 from solr.activity.tasks import ActivityTaskIndexing
 from solr.datasetnote.tasks import DatasetNoteTaskIndexing
+from solr.tasks import IndexingBuffer
+from traceability.chain_graph import DirtyChains
 
 log = logging.getLogger(__name__)
 
+# The fields of the DatasetNotes handed over to the file stage:
+NOTE_FIELDS = ('iati_identifier', 'exception_type', 'model', 'field',
+               'message', 'line_number', 'variable')
+
+
+class DispatchNode(object):
+    """
+    A node in a parser's dispatch table. The table is a tree of tag names
+    (with '-' replaced by '_'), mirroring the handler method names of a
+    parser class, f.e. iati_activities__iati_activity__title__narrative
+    """
+    __slots__ = ('handler', 'children')
+
+    def __init__(self):
+        # name of the parser method handling this element, if any:
+        self.handler = None
+        self.children = {}
+
 
 class IatiParser(object):
     # default version
@@ -35,6 +61,17 @@ class IatiParser(object):
         self.dataset = None
         self.publisher = None
         self.force_reparse = False
+        # iati-identifiers of activities skipped because they did not change
+        # since they were last parsed:
+        self.unchanged_activities = []
+        # parents whose children changed, their aggregations are
+        # recalculated once the whole dataset has been parsed:
+        self.dirty_parents = DirtyParents()
+        # activities that changed, their chains are updated later on:
+        self.dirty_chains = DirtyChains()
+        # (post save task id, activity ids) of the batches handed over to
+        # the pipeline (see iati.parser.pipeline):
+        self.pipeline_batches = []
         self.default_lang = settings.DEFAULT_LANG
         # A cache to store codelist items in memory (for each element when
         # parsing).
@@ -46,6 +83,65 @@ class IatiParser(object):
         # commit to db on exit
         self.model_store = OrderedDict()
         self.root = root
+        # handler name -> bound method, filled while parsing:
+        self.bound_handlers = {}
+
+    @classmethod
+    def get_dispatch_table(cls):
+        """
+        Returns the dispatch table (see DispatchNode) of this parser class.
+        It is built once per class from the names of its handler methods, so
+        that parse() does not need to compute xpaths and function names for
+        every element.
+        """
+        # Look in the class' own __dict__, every (versioned) subclass has
+        # its own set of handlers:
+        table = cls.__dict__.get('_dispatch_table')
+        if table is not None:
+            return table
+
+        table = {}
+        for name in dir(cls):
+            if name.startswith('_') or '__' not in name:
+                continue
+            if not callable(getattr(cls, name, None)):
+                continue
+
+            children = table
+            for part in name.split('__'):
+                node = children.get(part)
+                if node is None:
+                    node = children[part] = DispatchNode()
+                children = node.children
+            node.handler = name
+
+        cls._dispatch_table = table
+        return table
+
+    def get_dispatch_node(self, element):
+        """
+        Look up the dispatch table node of an element by walking its
+        ancestors. Only needed once for the element parse() starts on, its
+        descendants are looked up from the node's children.
+        """
+        tags = [element.tag]
+        tags.extend(ancestor.tag for ancestor in element.iterancestors())
+
+        node = None
+        children = self.get_dispatch_table()
+        for tag in reversed(tags):
+            node = children.get(tag.replace('-', '_'))
+            if node is None:
+                return None
+            children = node.children
+
+        return node
+
+    def get_handler(self, name):
+        handler = self.bound_handlers.get(name)
+        if handler is None:
+            handler = self.bound_handlers[name] = getattr(self, name)
+        return handler
 
     def check_registration_agency_validity(self, element_name, element, ref):
         reg_agency_found = False
@@ -173,6 +269,61 @@ class IatiParser(object):
                 "iso-date",
                 "Unspecified or invalid. Date should be of type xml:date.")
 
+    def get_content_hash(self, element):
+        """
+        Returns a fingerprint of an element and its descendants: a sha1 of
+        their tags, (sorted) attributes and text, which does not change with
+        whitespace, attribute order, comments or namespace prefixes.
+        The parser version is included, so a file with another version is
+        always parsed again.
+        """
+        hasher = hashlib.sha1(self.VERSION.encode('utf-8'))
+
+        def update(e):
+            hasher.update(e.tag.encode('utf-8'))
+            for key, value in sorted(e.attrib.items()):
+                hasher.update(
+                    '\x00{}\x01{}'.format(key, value).encode('utf-8'))
+            hasher.update(
+                '\x02{}'.format((e.text or '').strip()).encode('utf-8'))
+
+            for child in e.iterchildren(tag=etree.Element):
+                update(child)
+
+            # marks the end of the element's children:
+            hasher.update(b'\x03')
+
+        update(element)
+        return hasher.hexdigest()
+
+    def skip_unchanged_activity(self, old_activity, content_hash):
+        """
+        Raises NoUpdateRequired when an already parsed activity did not
+        change, so the activity is not deleted, saved, nor indexed again.
+
+        Keyword arguments:
+        old_activity -- the Activity with the same iati-identifier
+        content_hash -- the fingerprint of the activity's element (see
+        get_content_hash)
+        """
+        if self.force_reparse or old_activity.modified:
+            return
+
+        dataset_id = getattr(self.dataset, 'id', None)
+        if old_activity.content_hash != content_hash \
+                or old_activity.dataset_id != dataset_id:
+            return
+
+        # Set last_updated_model to the start of this parse to prevent the
+        # activity from being deleted because it's not updated (and thereby
+        # assumed not found in the dataset, see delete_removed_activities).
+        # Saved activities have a later one, see get_changed_activities:
+        old_activity.__class__.objects.filter(pk=old_activity.pk).update(
+            last_updated_model=self.parse_start_datetime)
+        self.unchanged_activities.append(old_activity.iati_identifier)
+
+        raise NoUpdateRequired('activity', 'already up to date')
+
     def get_primary_name(self, element, primary_name):
         if primary_name:
             lang = element.attrib.get(
@@ -191,42 +342,220 @@ class IatiParser(object):
 
     def parse_activities(self, root):
         """
+        Parse all top-level elements (iati-activity / iati-organisation) of
+        an already loaded tree
+        """
+        self.parse_elements(root.getchildren())
+
+    def parse_elements(self, elements):
+        """
+        Parse, save and index each top-level element of a dataset, then run
+        the post file actions. Solr documents are posted in batches and
+        committed once, when the whole dataset has been parsed.
+
+        Keyword arguments:
+        elements -- an iterable of top-level elements. This can be a
+        generator (see ParseManager.iter_elements) which frees every element
+        once it has been parsed
+        """
+        with IndexingBuffer() as buffer:
+            self._parse_elements(elements)
+
+        log.info("Solr indexing of dataset %s: %s",
+                 getattr(self.dataset, 'id', None), dict(buffer.stats))
 
+    def get_element_identifier(self, element):
         """
-        for e in root.getchildren():
+        The identifier of a top-level element, read before it's parsed
+        """
+        return element.findtext('iati-identifier') \
+            or element.findtext('organisation-identifier')
+
+    def _parse_elements(self, elements):
+        # model stores of the parsed elements which are not saved yet, and
+        # the identifiers of these elements:
+        model_stores = []
+        pending = set()
+        batch_started = time.time()
+
+        for e in elements:
+            # An element which occurs again in the dataset replaces the
+            # earlier one, which has to be saved before it's parsed:
+            identifier = self.get_element_identifier(e)
+            if identifier and identifier in pending:
+                self.save_model_stores(model_stores, batch_started)
+                model_stores = []
+                pending = set()
+                batch_started = time.time()
+
             self.model_store = OrderedDict()
             parsed = self.parse(e)
             # only save if the activity is updated
 
             if parsed:
-                try:
-                    self.save_all_models()
-                    self.post_save_models()
-                except Exception:
-                    model = self.get_model('Activity')
-                    if model is not None:
-                        ActivityTaskIndexing(model,
-                                             related=True).run()
-                else:
-                    model = self.get_model('Activity')
-                    if model is not None:
-                        ActivityTaskIndexing(model, related=True).run()
+                model_stores.append(self.model_store)
+                pending.add(identifier)
+
+            if len(model_stores) >= settings.IATI_PARSER_SAVE_BATCH_SIZE:
+                self.save_model_stores(model_stores, batch_started)
+                model_stores = []
+                pending = set()
+                batch_started = time.time()
+
+        self.save_model_stores(model_stores, batch_started)
+
+        if settings.IATI_PARSER_PIPELINE:
+            # the post save stage may not have run for all activities yet,
+            # the file stage waits for it:
+            pipeline.emit_file(self, self.pipeline_batches)
+            self.pipeline_batches = []
+        else:
+            self.finish_file()
 
+    def finish_file(self):
+        """
+        The actions on the whole dataset, once all of its activities have
+        been saved and their post save actions have run
+        """
         self.post_save_file(self.dataset)
 
         if settings.ERROR_LOGS_ENABLED:
             self.post_save_validators(self.dataset)
 
-            # TODO - only delete errors on activities that were updated
-            self.dataset.note_count = len(self.errors)
-            self.dataset.save()
-
-            DatasetNote.objects.filter(dataset=self.dataset).delete()
+            # Notes of unchanged activities are kept, as these activities
+            # were not parsed again, except for the notes of the validators
+            # of the whole dataset:
+            unchanged_activities = Activity.objects.filter(
+                dataset=self.dataset,
+                last_updated_model=self.parse_start_datetime,
+            ).values('iati_identifier')
+            DatasetNote.objects.filter(dataset=self.dataset).filter(
+                ~Q(iati_identifier__in=unchanged_activities) |
+                post_save_validators.get_dataset_notes()
+            ).delete()
             DatasetNote.objects.bulk_create(self.errors)
 
+            self.dataset.note_count = DatasetNote.objects.filter(
+                dataset=self.dataset).count()
+            self.dataset.save()
+
             DatasetNoteTaskIndexing().run_from_dataset(dataset=self.dataset)
 
-    def post_save_models(self):
+    def save_model_stores(self, model_stores, started=None):
+        """
+        Save the models of a batch of parsed elements at once, then run the
+        post save actions and indexing for each of them.
+
+        With settings.IATI_PARSER_PIPELINE, the ids of the saved activities
+        are handed over to the post save and indexing stages on their own
+        queues instead (see iati.parser.pipeline).
+
+        Keyword arguments:
+        started -- when parsing the batch started, for the pipeline metrics
+        """
+        if not model_stores:
+            return
+
+        if started is None:
+            started = time.time()
+
+        try:
+            self.save_all_models(model_stores)
+        except Exception as e:
+            log.exception(e)
+            run_post_save = False
+        else:
+            run_post_save = True
+
+        activity_ids = []
+
+        for model_store in model_stores:
+            self.model_store = model_store
+
+            model = self.get_model('Activity')
+            if model is not None and model.pk is not None:
+                activity_ids.append(model.pk)
+                self.dirty_parents.mark_related_activities(
+                    self.get_model_list('RelatedActivity') or [])
+                self.dirty_chains.mark([model.iati_identifier])
+
+            if model is not None and settings.IATI_PARSER_PIPELINE:
+                # runs in the post save stage
+                continue
+
+            try:
+                if run_post_save and model is not None:
+                    # the search indexes are updated for the whole batch:
+                    self.post_save_models(update_search_index=False)
+                elif run_post_save:
+                    self.post_save_models()
+            except Exception as e:
+                log.exception(e)
+
+        if not activity_ids:
+            return
+
+        if settings.IATI_PARSER_PIPELINE:
+            # indexed after the file stage:
+            result, waited = pipeline.emit(
+                activity_ids, run_post_save, index=False)
+            self.pipeline_batches.append((result.id, activity_ids))
+            pipeline.record_metrics(
+                'parse',
+                len(activity_ids),
+                time.time() - started - waited,
+                waited
+            )
+        else:
+            if run_post_save:
+                try:
+                    post_save.update_activity_search_indexes(activity_ids)
+                except Exception as e:
+                    log.exception(e)
+
+            ActivityTaskIndexing(related=True).run_batch(activity_ids)
+
+    def get_file_state(self):
+        """
+        What finish_file needs of this parser, so the file stage of the
+        pipeline can run it in a task of its own (see set_file_state)
+        """
+        return {
+            'parser': '{}.{}'.format(
+                type(self).__module__, type(self).__name__),
+            'version': self.VERSION,
+            'dataset': self.dataset.id,
+            'parse_start_datetime': self.parse_start_datetime.isoformat(),
+            'dirty_parents': sorted(self.dirty_parents.links),
+            'dirty_chains': sorted(self.dirty_chains.iati_identifiers),
+            'errors': [
+                {field: getattr(note, field) for field in NOTE_FIELDS}
+                for note in self.errors
+            ],
+        }
+
+    def set_file_state(self, state):
+        self.VERSION = state['version']
+        self.dataset = Dataset.objects.get(id=state['dataset'])
+        self.publisher = self.dataset.publisher
+        self.parse_start_datetime = dateutil.parser.parse(
+            state['parse_start_datetime'])
+        self.dirty_parents.mark(
+            tuple(link) for link in state['dirty_parents'])
+        self.dirty_chains.mark(state['dirty_chains'])
+        self.errors = [DatasetNote(dataset=self.dataset, **note)
+                       for note in state['errors']]
+
+    def get_changed_activities(self, dataset):
+        """
+        The activities of a dataset saved by this parse. Unchanged activities
+        are set to the start of the parse, see skip_unchanged_activity
+        """
+        return Activity.objects.filter(
+            dataset=dataset,
+            last_updated_model__gt=self.parse_start_datetime)
+
+    def post_save_models(self, update_search_index=True):
         print("override in children")
 
     def post_save_file(self, dataset):
@@ -275,9 +604,14 @@ class IatiParser(object):
 
         self.errors.append(note)
 
-    def parse(self, element):
+    def parse(self, element, node=None):
         """All of the methods from specific parser file (i. e. IATI_2_03.py)
         get called in this method
+
+        Keyword arguments:
+        node -- the dispatch table node of the element (see
+        get_dispatch_table). Looked up from the element's ancestors when not
+        given, it's passed down when parsing the element's children
         """
         if element is None:
             return
@@ -286,12 +620,15 @@ class IatiParser(object):
         if element.tag == etree.Comment:
             return
 
-        x_path = self.root.getroottree().getpath(element)
-        function_name = self.generate_function_name(x_path)
+        if node is None:
+            node = self.get_dispatch_node(element)
+
+            # No handlers for this element, nor for any of its descendants:
+            if node is None:
+                return True
 
-        if hasattr(self, function_name)\
-                and callable(getattr(self, function_name)):
-            element_method = getattr(self, function_name)
+        if node.handler is not None:
+            element_method = self.get_handler(node.handler)
 
             try:
                 element_method(element)
@@ -347,8 +684,16 @@ class IatiParser(object):
                 log.exception(e)
                 return
 
+        children = node.children
         for e in element.getchildren():
-            self.parse(e)
+            if type(e).__name__ != '_Element' or e.tag == etree.Comment:
+                continue
+
+            # f.e. namespaced elements have a '{' in their tag and never
+            # match:
+            child_node = children.get(e.tag.replace('-', '_'))
+            if child_node is not None:
+                self.parse(e, child_node)
 
         return True
 
@@ -414,19 +759,17 @@ class IatiParser(object):
             if isinstance(field, (ForeignKey, OneToOneField)):
                 setattr(model, field.name, getattr(model, field.name))
 
-    def save_all_models(self):
+    def save_all_models(self, model_stores=None):
+        """
+        Save all models in the given model stores (defaults to the current
+        one), using one bulk insert per model class (see BulkSaver)
+        """
         # TODO: problem: assigning unsaved model to foreign key results in
         # error because field_id has not been set (see: https://git.io/fbphN)
-        for model_list in self.model_store.items():
-            for model in model_list[1]:
-                try:
-                    self.update_related(model)
-
-                    model.save()
+        if model_stores is None:
+            model_stores = [self.model_store]
 
-                except Exception as e:
-                    log.exception(e)
-                    pass
+        BulkSaver(self.update_related).save(model_stores)
 
     def remove_brackets(self, function_name):
         result = ""
@@ -1,13 +1,9 @@
-import hashlib
-from io import BytesIO
+import logging
 
-import requests
 from django import db
 from django.conf import settings
-from django.utils.encoding import smart_text
 from lxml import etree
 
-# from iati.filegrabber import FileGrabber
 from iati.parser import schema_validators
 from iati.parser.IATI_1_03 import Parse as IATI_103_Parser
 from iati.parser.IATI_1_05 import Parse as IATI_105_Parser
@@ -18,6 +14,9 @@ from iati_organisation.parser.organisation_1_05 import Parse as Org_1_05_Parser
 from iati_organisation.parser.organisation_2_01 import Parse as Org_2_01_Parser
 from iati_organisation.parser.organisation_2_02 import Parse as Org_2_02_Parser
 from iati_organisation.parser.organisation_2_03 import Parse as Org_2_03_Parser
+from iati_synchroniser.dataset_store import DatasetStore
+
+logger = logging.getLogger(__name__)
 
 
 class ParserDisabledError(Exception):
@@ -26,9 +25,18 @@ class ParserDisabledError(Exception):
 
 
 class ParseManager():
-    def __init__(self, dataset, root=None, force_reparse=False):
+    def __init__(self, dataset, root=None, force_reparse=False,
+                 streaming=None):
         """
         Given a IATI dataset, prepare an IATI parser
+
+        Keyword arguments:
+        streaming -- when True the stored file is parsed element by element
+        with lxml's iterparse, so the whole tree is never held in memory.
+        Defaults to settings.IATI_PARSER_STREAMING
+
+        The file is read from the DatasetStore, it's only downloaded when it
+        wasn't downloaded recently (f.e. by the DatasetSyncer).
         """
 
         if settings.IATI_PARSER_DISABLED:
@@ -40,78 +48,32 @@ class ParseManager():
         self.force_reparse = force_reparse
         self.hash_changed = True
         self.valid_dataset = True
+        self.streaming = settings.IATI_PARSER_STREAMING \
+            if streaming is None else streaming
+        self.root = None
+        self.file = None
 
         if root is not None:
             self.root = root
             self.parser = self._prepare_parser(self.root, dataset)
             return
 
-        # file_grabber = FileGrabber()
-        # response = file_grabber.get_the_file(self.url)
-        response = None
-        headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X '
-                                 '10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36'}  # NOQA: E501
+        store = DatasetStore()
+        sha1 = store.get(self.url)
 
-        try:
-            response = requests.get(self.url, headers=headers, timeout=30)
-        except requests.exceptions.SSLError:
-            response = requests.get(self.url, verify=False, headers=headers,
-                                    timeout=30)
-        except requests.exceptions.Timeout:
-            response = requests.get(self.url, verify=False, timeout=30)
-        except (requests.exceptions.ConnectionError,
-                requests.exceptions.TooManyRedirects,
-                requests.exceptions.Timeout):
-            pass
-        finally:
-            pass
-
-        from iati_synchroniser.models import DatasetNote
-        if not response or response.status_code != 200:
-            self.valid_dataset = False
-            note = DatasetNote(
-                dataset=self.dataset,
-                iati_identifier="n/a",
-                model="n/a",
-                field="n/a",
-                message="Cannot access the URL",
-                exception_type='UrlError',
-                line_number=None
-            )
-            note.save()
-            self.dataset.note_count = 1
-
-            # If not a XML file them sha1 should blank
-            self.dataset.sha1 = ''
-
-            self.dataset.save()
+        if sha1 is None:
+            self._url_error()
             return
 
-        # 1. Turn bytestring into string (treat it using specified encoding):
-        try:
-            iati_file = smart_text(response.content, 'utf-8')
-        # XXX: some files contain non utf-8 characters:
-        # FIXME: this is hardcoded:
-        except UnicodeDecodeError:
-            iati_file = smart_text(response.content, 'latin-1')
-
-        # 2. Encode the string to use for hashing:
-        hasher = hashlib.sha1()
-        hasher.update(iati_file.encode('utf-8'))
-        sha1 = hasher.hexdigest()
-
-        if dataset.sha1 == sha1:
-            # dataset did not change, no need to reparse normally
-            self.hash_changed = False
-        else:
-            dataset.sha1 = sha1
+        self._update_sha1(sha1)
 
-            # Save a sha1 in the first time of the process parse
-            dataset.save()
+        if self.streaming:
+            self._prepare_stream(store.open(sha1))
+            return
 
         try:
             parser = etree.XMLParser(huge_tree=True)
-            tree = etree.parse(BytesIO(response.content), parser)
+            tree = etree.parse(store.get_blob_path(sha1), parser)
             self.root = tree.getroot()
             self.parser = self._prepare_parser(self.root, dataset)
 
@@ -120,27 +82,115 @@ class ParseManager():
 
         # TODO: when moving error messages to frontend, create a separate error
         # for wrong file type:
-        except etree.XMLSyntaxError as e:
-            self.valid_dataset = False
-            DatasetNote.objects.filter(dataset=self.dataset).delete()
-            note = DatasetNote(
-                dataset=self.dataset,
-                iati_identifier="n/a",
-                model="n/a",
-                field="n/a",
-                message="This file contains XML syntax errors or it's not an "
-                        "XML file",
-                exception_type='XMLSyntaxError',
-                line_number=None
-            )
-            note.save()
-            self.dataset.note_count = 1
+        except etree.XMLSyntaxError:
+            self._xml_syntax_error()
+            return
 
-            # If not the XML should not have a sha1
-            self.dataset.sha1 = ''
+    def _update_sha1(self, sha1):
+        if self.dataset.sha1 == sha1:
+            # dataset did not change, no need to reparse normally
+            self.hash_changed = False
+        else:
+            self.dataset.sha1 = sha1
 
+            # Save a sha1 in the first time of the process parse
             self.dataset.save()
-            return
+
+    def _url_error(self):
+        from iati_synchroniser.models import DatasetNote
+
+        self.valid_dataset = False
+        note = DatasetNote(
+            dataset=self.dataset,
+            iati_identifier="n/a",
+            model="n/a",
+            field="n/a",
+            message="Cannot access the URL",
+            exception_type='UrlError',
+            line_number=None
+        )
+        note.save()
+        self.dataset.note_count = 1
+
+        # If not a XML file them sha1 should blank
+        self.dataset.sha1 = ''
+
+        self.dataset.save()
+
+    def _xml_syntax_error(self):
+        from iati_synchroniser.models import DatasetNote
+
+        self.valid_dataset = False
+        DatasetNote.objects.filter(dataset=self.dataset).delete()
+        note = DatasetNote(
+            dataset=self.dataset,
+            iati_identifier="n/a",
+            model="n/a",
+            field="n/a",
+            message="This file contains XML syntax errors or it's not an "
+                    "XML file",
+            exception_type='XMLSyntaxError',
+            line_number=None
+        )
+        note.save()
+        self.dataset.note_count = 1
+
+        # If not the XML should not have a sha1
+        self.dataset.sha1 = ''
+
+        self.dataset.save()
+
+    def _prepare_stream(self, file):
+        """
+        Read the root element of the stored file to prepare the parser, the
+        elements are read from the file by iter_elements.
+        """
+        self.file = file
+
+        try:
+            self.file.seek(0)
+            # Only the root's start tag is needed to find out the version,
+            # iterparse stops reading after the first buffer:
+            _, root = next(etree.iterparse(
+                self.file, events=('start',), huge_tree=True))
+            self.parser = self._prepare_parser(root, self.dataset)
+        except (etree.XMLSyntaxError, StopIteration):
+            self.close()
+            self._xml_syntax_error()
+
+    def iter_elements(self):
+        """
+        Yield the top-level elements (iati-activity / iati-organisation) of
+        the downloaded file one by one. Every element is cleared, and removed
+        from its parent, once the consumer is done with it, so memory stays
+        bounded by the size of a single activity.
+        """
+        self.file.seek(0)
+        depth = 0
+
+        for event, element in etree.iterparse(
+                self.file, events=('start', 'end'), huge_tree=True):
+            if event == 'start':
+                if depth == 0:
+                    # Parsers build xpaths relative to their root:
+                    self.parser.root = element
+                depth += 1
+                continue
+
+            depth -= 1
+            if depth != 1:
+                continue
+
+            yield element
+
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
 
     def _prepare_parser(self, root, dataset):
         """
@@ -206,18 +256,61 @@ class ParseManager():
 
         # only start parsing when the file changed (or on force)
         if (self.force_reparse or self.hash_changed) and self.valid_dataset:
-            self.parser.load_and_parse(self.root)
+            if self.streaming:
+                self._parse_stream()
+            else:
+                self.parser.load_and_parse(self.root)
+
+        self.close()
 
         # Throw away query logs when in debug mode to prevent memory from
         # overflowing
         if settings.DEBUG:
             db.reset_queries()
 
+    def _parse_stream(self):
+        # XSD validation needs the complete tree, which is exactly what
+        # streaming mode avoids building, so it's skipped here:
+        if settings.ERROR_LOGS_ENABLED:
+            logger.info(
+                "Skipping XSD validation of %s in streaming mode", self.url)
+
+        try:
+            self.parser.parse_elements(self.iter_elements())
+        except etree.XMLSyntaxError as e:
+            # Elements before the error have been saved already, but the
+            # post file actions (like deleting removed activities) are not
+            # run on a broken file:
+            logger.error(e)
+            self._xml_syntax_error()
+
+    def _parse_stream_activity(self, activity_id):
+        for element in self.iter_elements():
+            if element.findtext('iati-identifier') == activity_id:
+                self.parser.force_reparse = True
+                self.parser.parse(element)
+                self.parser.save_all_models()
+                self.parser.post_save_models()
+                return
+
+        raise ValueError(
+            "Activity {} doesn't exist in {}".format(
+                activity_id, self.url
+            )
+        )
+
     def parse_activity(self, activity_id):
         """
         Parse only one activity with {activity_id}
         """
 
+        if self.streaming:
+            try:
+                self._parse_stream_activity(activity_id)
+            finally:
+                self.close()
+            return
+
         try:
             (activity,) = self.root.xpath(
                 '//iati-activity/iati-identifier[text()="{}"]'.format(
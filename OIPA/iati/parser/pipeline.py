@@ -0,0 +1,258 @@
+"""
+The stages which follow parsing an activity, run on their own celery queues
+when settings.IATI_PARSER_PIPELINE is enabled:
+
+    parse      the parser task saves a batch of activities and emits their
+               ids (see IatiParser.save_model_stores)
+    post_save  post_save_activities runs the post save actions of a batch
+               (related activities, FTS indexes, sector budgets etc.)
+    file       post_save_file runs the actions on the whole dataset (removed
+               activities, aggregations, validators and notes) once the
+               post save stage of all of its batches has run, then hands
+               the batches over to the indexing stage
+    indexing   index_activities indexes a batch in Solr
+
+A stage waits before emitting a batch while the queue of the next stage is
+full (see wait_for_capacity), so a slow Solr or database doesn't pile up an
+unbounded backlog. Every stage counts the activities and time spent in the
+cache (see record_metrics / get_metrics).
+"""
+import logging
+import time
+
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from iati.models import Activity
+from iati.parser import post_save
+from OIPA.celery import app
+from solr.activity.tasks import ActivityTaskIndexing
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('parse', 'post_save', 'file', 'indexing')
+
+METRICS = ('batches', 'activities', 'milliseconds', 'waited_milliseconds')
+
+METRICS_KEY = 'iati_parser_pipeline:{stage}:{metric}'
+
+
+def get_queue(task):
+    """
+    The celery queue a task is routed to (see CELERY_TASK_ROUTES)
+    """
+    route = settings.CELERY_TASK_ROUTES.get(task.name, {})
+    return route.get('queue', app.conf.task_default_queue)
+
+
+def get_queue_length(queue):
+    """
+    The number of messages waiting in a queue of the broker
+    """
+    if app.conf.task_always_eager:
+        return 0
+
+    with app.connection_or_acquire() as connection:
+        channel = connection.channel()
+        try:
+            return channel.queue_declare(
+                queue=queue, passive=True).message_count
+        except connection.channel_errors:
+            # the queue doesn't exist yet, nothing was sent to it
+            return 0
+        finally:
+            channel.close()
+
+
+def wait_for_capacity(queue):
+    """
+    Block while a queue holds IATI_PARSER_PIPELINE_MAX_PENDING batches or
+    more, for at most IATI_PARSER_PIPELINE_MAX_WAIT seconds.
+
+    Returns the number of seconds waited
+    """
+    started = time.time()
+
+    while get_queue_length(queue) >= settings.IATI_PARSER_PIPELINE_MAX_PENDING:
+        waited = time.time() - started
+        if waited >= settings.IATI_PARSER_PIPELINE_MAX_WAIT:
+            logger.warning(
+                "Queue %s is still full after %d seconds, continuing",
+                queue, waited)
+            break
+
+        time.sleep(settings.IATI_PARSER_PIPELINE_POLL_INTERVAL)
+
+    return time.time() - started
+
+
+def record_metrics(stage, activities, seconds, waited=0):
+    values = {
+        'batches': 1,
+        'activities': activities,
+        'milliseconds': int(seconds * 1000),
+        'waited_milliseconds': int(waited * 1000),
+    }
+
+    for metric, value in values.items():
+        key = METRICS_KEY.format(stage=stage, metric=metric)
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            # the cache doesn't keep anything, f.e. the DummyCache
+            pass
+
+    logger.info(
+        "Parser pipeline %s: %d activities in %.2f seconds (%.1f/s), "
+        "waited %.2f seconds for the next stage",
+        stage, activities, seconds, activities / seconds if seconds else 0,
+        waited)
+
+
+def get_metrics():
+    """
+    The totals per stage, with the number of activities per second
+    """
+    metrics = {}
+
+    for stage in STAGES:
+        keys = [METRICS_KEY.format(stage=stage, metric=metric)
+                for metric in METRICS]
+        values = cache.get_many(keys)
+        stage_metrics = {
+            metric: values.get(key, 0) for metric, key in zip(METRICS, keys)
+        }
+
+        seconds = stage_metrics['milliseconds'] / 1000
+        stage_metrics['per_second'] = (
+            stage_metrics['activities'] / seconds if seconds else 0)
+        metrics[stage] = stage_metrics
+
+    return metrics
+
+
+def reset_metrics():
+    cache.delete_many([
+        METRICS_KEY.format(stage=stage, metric=metric)
+        for stage in STAGES for metric in METRICS
+    ])
+
+
+def emit(activity_ids, run_post_save=True, index=True):
+    """
+    Hand a batch of saved activities over to the post save stage.
+
+    Keyword arguments:
+    index -- False when the batch is indexed after the file stage
+
+    Returns the post save task and the number of seconds waited for the post
+    save queue
+    """
+    waited = wait_for_capacity(get_queue(post_save_activities))
+    result = post_save_activities.delay(activity_ids, run_post_save, index)
+    return result, waited
+
+
+def emit_file(parser, batches):
+    """
+    Hand the actions on the whole dataset of a parser over to the file
+    stage.
+
+    batches -- (post save task id, activity ids) of the batches emitted
+    while parsing the dataset
+    """
+    post_save_file.delay(parser.get_file_state(), batches)
+
+
+def is_done(task_ids):
+    """
+    Whether the given tasks have run (or failed)
+    """
+    if app.conf.task_always_eager:
+        return True
+
+    return all(app.AsyncResult(task_id).ready() for task_id in task_ids)
+
+
+@shared_task(bind=True, max_retries=None)
+def post_save_file(self, state, batches):
+    """
+    Run the actions on a whole dataset (see IatiParser.finish_file) once the
+    post save actions of all of its batches have run, as they set the
+    references between activities the file actions rely on. Then hand the
+    batches over to the indexing stage, with their aggregations
+    """
+    interval = settings.IATI_PARSER_PIPELINE_POLL_INTERVAL
+
+    if not is_done([task_id for task_id, _ in batches]):
+        if self.request.retries * interval < \
+                settings.IATI_PARSER_PIPELINE_MAX_WAIT:
+            raise self.retry(countdown=interval)
+
+        logger.warning(
+            "Post save stage of dataset %s is still running after %d "
+            "seconds, continuing", state['dataset'],
+            self.request.retries * interval)
+
+    started = time.time()
+
+    parser = import_string(state['parser'])(None)
+    parser.set_file_state(state)
+    parser.finish_file()
+
+    finished = time.time()
+    waited = 0
+    for _, activity_ids in batches:
+        waited += wait_for_capacity(get_queue(index_activities))
+        index_activities.delay(activity_ids)
+
+    record_metrics(
+        'file',
+        sum(len(activity_ids) for _, activity_ids in batches),
+        finished - started,
+        waited)
+
+
+@shared_task
+def post_save_activities(activity_ids, run_post_save=True, index=True):
+    """
+    Run the post save actions of a batch of activities, then hand them over
+    to the indexing stage (unless the file stage does)
+    """
+    started = time.time()
+
+    if run_post_save:
+        for activity in Activity.objects.filter(id__in=activity_ids):
+            try:
+                post_save.post_save_activity(
+                    activity, update_search_index=False)
+            except Exception as e:
+                logger.exception(e)
+
+        try:
+            post_save.update_activity_search_indexes(activity_ids)
+        except Exception as e:
+            logger.exception(e)
+
+    finished = time.time()
+    waited = 0
+    if index:
+        waited = wait_for_capacity(get_queue(index_activities))
+        index_activities.delay(activity_ids)
+
+    record_metrics(
+        'post_save', len(activity_ids), finished - started, waited)
+
+
+@shared_task
+def index_activities(activity_ids):
+    """
+    Index a batch of activities with their transactions, budgets and results
+    """
+    started = time.time()
+    ActivityTaskIndexing(related=True).run_batch(activity_ids)
+
+    record_metrics('indexing', len(activity_ids), time.time() - started)
@@ -2,6 +2,7 @@
 Methods triggered after activity has been parsed
 """
 
+import logging
 from decimal import Decimal
 
 from iati import activity_search_indexes, models
@@ -10,6 +11,34 @@ from iati.activity_aggregation_calculation import (
 )
 from iati.transaction import models as transaction_models
 
+logger = logging.getLogger(__name__)
+
+
+def post_save_activity(activity, participating_organisations=(),
+                       update_search_index=True):
+    """
+    Perform all actions that need to happen after a single activity has been
+    saved
+
+    Keyword arguments:
+    update_search_index -- False when the caller reindexes a whole batch of
+    activities at once (see update_activity_search_indexes)
+    """
+    set_related_activities(activity)
+    set_participating_organisation_activity_id(participating_organisations)
+    set_transaction_provider_receiver_activity(activity)
+    set_derived_activity_dates(activity)
+    # set_activity_aggregations(activity)
+    if update_search_index:
+        update_activity_search_index(activity)
+
+    # TODO: This is right related to this documnetation
+    # http://reference.iatistandard.org/203/activity-standard/iati-activities/iati-activity/transaction/sector/  # NOQA: E501
+    # For now we skip to make the automatically make a new sector in the transaction  # NOQA: E501
+    # set_sector_transaction(activity)
+
+    set_sector_budget(activity)
+
 
 def set_related_activities(activity):
     """ update related-activity references to this activity """
@@ -66,6 +95,20 @@ def set_activity_aggregations(activity):
     aac.parse_activity_aggregations(activity)
 
 
+def set_dataset_activity_aggregations(dataset, dirty_parents=None):
+    """
+    set the aggregations of all activities of a dataset (and their parents)
+    at once, after the whole dataset has been parsed
+    """
+    aac = ActivityAggregationCalculation()
+
+    # the rest of the post file actions still have to run:
+    try:
+        aac.parse_activity_aggregations_by_source(dataset.id, dirty_parents)
+    except Exception as e:
+        logger.exception(e)
+
+
 def update_activity_search_index(activity):
     """
     Update the Postgres FTS indexes
@@ -73,6 +116,13 @@ def update_activity_search_index(activity):
     activity_search_indexes.reindex_activity(activity)
 
 
+def update_activity_search_indexes(activity_ids):
+    """
+    Update the Postgres FTS indexes of a batch of activities at once
+    """
+    activity_search_indexes.reindex_activities(activity_ids)
+
+
 def set_country_region_transaction(activity):
     """
     IATI business rule: If transaction/recipient-country AND/OR
@@ -1,4 +1,4 @@
-from django.db.models import Max
+from django.db.models import Max, Q
 
 from iati.models import (
     Activity, ActivityParticipatingOrganisation, RelatedActivity,
@@ -6,6 +6,19 @@ from iati.models import (
 )
 from iati.transaction.models import TransactionProvider, TransactionReceiver
 
+UNFOUND_ACTIVITY_MESSAGE = "Must be an existing IATI activity"
+DATASET_VALIDATION_ERROR = "dataset validation error"
+
+
+def get_dataset_notes():
+    """
+    A filter for the notes of unfound_identifiers and
+    transactions_at_multiple_levels. These check the whole dataset, also its
+    unchanged activities, so their notes are replaced on every parse
+    """
+    return Q(message=UNFOUND_ACTIVITY_MESSAGE) | \
+        Q(iati_identifier=DATASET_VALIDATION_ERROR)
+
 
 def identifier_correct_prefix(self, a):
     """
@@ -211,7 +224,7 @@ def transactions_at_multiple_levels(self, dataset):
              "hierarchical level"),
             -1,
             '-',
-            "dataset validation error")
+            DATASET_VALIDATION_ERROR)
 
 
 def unfound_identifiers(self, dataset):
@@ -224,7 +237,7 @@ def unfound_identifiers(self, dataset):
             "FieldValidationError",
             "related-activity",
             "ref",
-            "Must be an existing IATI activity",
+            UNFOUND_ACTIVITY_MESSAGE,
             -1,
             variable,
             activity_id)
@@ -240,7 +253,7 @@ def unfound_identifiers(self, dataset):
             "FieldValidationError",
             "transaction/provider-org",
             "provider-activity-id",
-            "Must be an existing IATI activity",
+            UNFOUND_ACTIVITY_MESSAGE,
             -1,
             variable,
             activity_id)
@@ -256,7 +269,7 @@ def unfound_identifiers(self, dataset):
             "FieldValidationError",
             "transaction/receiver-org",
             "receiver-activity-id",
-            "Must be an existing IATI activity",
+            UNFOUND_ACTIVITY_MESSAGE,
             -1,
             variable,
             activity_id)
@@ -270,7 +283,7 @@ def unfound_identifiers(self, dataset):
             "FieldValidationError",
             "participating-org",
             "activity-id",
-            "Must be an existing IATI activity",
+            UNFOUND_ACTIVITY_MESSAGE,
             -1,
             variable,
             activity_id)
@@ -0,0 +1,113 @@
+from collections import OrderedDict
+
+from django.test import TestCase, override_settings
+from lxml import etree
+from mock import patch
+
+from iati import models
+from iati.factory import iati_factory
+from iati.parser.bulk_save import BulkSaver
+from iati.parser.iati_parser import IatiParser
+from iati.transaction import models as transaction_models
+from iati_codelists.factory import codelist_factory
+
+
+class BulkSaverTestCase(TestCase):
+    """
+    Saving a parser's model store with bulk inserts
+    """
+
+    def setUp(self):
+        self.parser = IatiParser(None)
+        self.saver = BulkSaver(self.parser.update_related)
+        self.language = codelist_factory.LanguageFactory.create()
+
+    def build_model_store(self, activity):
+        title = models.Title(activity=activity)
+        narrative = models.Narrative(
+            activity=activity,
+            language=self.language,
+            content='A title')
+        narrative._related_object = title
+
+        model_store = OrderedDict()
+        # registered in an order where the narrative comes before its parent:
+        model_store['TitleNarrative'] = [narrative]
+        model_store['Activity'] = [activity]
+        model_store['Title'] = [title]
+        return model_store
+
+    def test_sort_classes_on_dependencies(self):
+        activity = iati_factory.ActivityFactory.create()
+        models_by_class = self.saver.group_by_class(
+            [self.build_model_store(activity)])
+
+        self.assertEqual(
+            self.saver.sort_classes(models_by_class),
+            [models.Activity, models.Title, models.Narrative])
+
+    def test_can_bulk_create(self):
+        self.assertTrue(self.saver.can_bulk_create(models.Title))
+        self.assertTrue(
+            self.saver.can_bulk_create(transaction_models.Transaction))
+
+    def test_save_model_stores(self):
+        first = iati_factory.ActivityFactory.create(iati_identifier='IATI-1')
+        second = iati_factory.ActivityFactory.create(iati_identifier='IATI-2')
+
+        self.saver.save([
+            self.build_model_store(first),
+            self.build_model_store(second),
+        ])
+
+        self.assertEqual(models.Title.objects.count(), 2)
+        self.assertEqual(
+            first.title.narratives.get().content, 'A title')
+        self.assertEqual(
+            second.title.narratives.get().content, 'A title')
+
+    def test_invalid_rows_are_skipped(self):
+        activity = iati_factory.ActivityFactory.create()
+        model_store = self.build_model_store(activity)
+        # a narrative without language can't be saved:
+        invalid = models.Narrative(activity=activity, content='Invalid')
+        invalid._related_object = model_store['Title'][0]
+        model_store['TitleNarrative'].append(invalid)
+
+        self.saver.save([model_store])
+
+        self.assertEqual(
+            activity.title.narratives.get().content, 'A title')
+
+
+@override_settings(IATI_PARSER_SAVE_BATCH_SIZE=20, IATI_PARSER_PIPELINE=False)
+class ParseBatchTestCase(TestCase):
+    """
+    Batching the parsed elements of a dataset before saving them
+    """
+
+    def setUp(self):
+        self.parser = IatiParser(None)
+
+    def get_element(self, iati_identifier):
+        return etree.fromstring(
+            '<iati-activity><iati-identifier>{}</iati-identifier>'
+            '</iati-activity>'.format(iati_identifier))
+
+    @patch.object(IatiParser, 'finish_file')
+    @patch.object(IatiParser, 'save_model_stores')
+    @patch.object(IatiParser, 'parse', return_value=True)
+    def test_repeated_identifier_flushes_batch(
+            self, parse, save_model_stores, finish_file):
+        elements = [
+            self.get_element(iati_identifier)
+            for iati_identifier in ['IATI-1', 'IATI-2', 'IATI-1', 'IATI-3']
+        ]
+
+        self.parser._parse_elements(elements)
+
+        # the first IATI-1 is saved before the second one is parsed, so the
+        # last one replaces it:
+        self.assertEqual(
+            [len(call[0][0]) for call in save_model_stores.call_args_list],
+            [2, 2])
@@ -0,0 +1,93 @@
+import hashlib
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from mock import MagicMock, patch
+
+from iati.parser.IATI_2_03 import Parse as Parser_203
+from iati.parser.parse_manager import ParseManager
+from iati_synchroniser.factory import synchroniser_factory
+
+XML = (
+    b'<?xml version="1.0" encoding="UTF-8"?>'
+    b'<iati-activities version="2.03">'
+    b'<iati-activity><iati-identifier>NL-1-1</iati-identifier>'
+    b'</iati-activity>'
+    b'<!-- a comment between activities -->'
+    b'<iati-activity><iati-identifier>NL-1-2</iati-identifier>'
+    b'</iati-activity>'
+    b'</iati-activities>'
+)
+
+
+def mock_response(content, chunk_size=16):
+    response = MagicMock()
+    response.status_code = 200
+    response.headers = {}
+    response.iter_content.return_value = [
+        content[i:i + chunk_size] for i in range(0, len(content), chunk_size)
+    ]
+    return response
+
+
+class StreamingParseManagerTestCase(TestCase):
+    """
+    ParseManager in streaming (iterparse) mode
+    """
+
+    def setUp(self):
+        self.dataset = synchroniser_factory.DatasetFactory.create(sha1='')
+
+        store_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_root)
+        settings = override_settings(DATASET_STORE_ROOT=store_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def get_parse_manager(self, content=XML):
+        with patch('iati_synchroniser.dataset_store.requests.get') as get:
+            get.return_value = mock_response(content)
+            return ParseManager(self.dataset, streaming=True)
+
+    def test_hashes_streamed_bytes(self):
+        self.get_parse_manager()
+
+        self.dataset.refresh_from_db()
+        self.assertEqual(self.dataset.sha1, hashlib.sha1(XML).hexdigest())
+
+    def test_prepares_versioned_parser_from_root(self):
+        parse_manager = self.get_parse_manager()
+
+        self.assertIsInstance(parse_manager.get_parser(), Parser_203)
+        self.assertTrue(parse_manager.valid_dataset)
+
+    def test_iter_elements_yields_and_clears_activities(self):
+        parse_manager = self.get_parse_manager()
+
+        identifiers = []
+        seen = []
+        for element in parse_manager.iter_elements():
+            identifiers.append(element.findtext('iati-identifier'))
+            seen.append(element)
+
+        self.assertEqual(identifiers, ['NL-1-1', 'NL-1-2'])
+        # processed activities are emptied and removed from the root:
+        self.assertEqual(len(seen[0]), 0)
+        self.assertEqual(len(parse_manager.parser.root), 1)
+
+    def test_parse_all_hands_elements_to_parser(self):
+        parse_manager = self.get_parse_manager()
+        parse_manager.parser.parse_elements = MagicMock()
+
+        parse_manager.parse_all()
+
+        parse_manager.parser.parse_elements.assert_called_once()
+        self.assertIsNone(parse_manager.file)
+
+    def test_xml_syntax_error(self):
+        parse_manager = self.get_parse_manager(b'not xml at all')
+
+        self.assertFalse(parse_manager.valid_dataset)
+        self.assertEqual(self.dataset.sha1, '')
+        self.assertEqual(self.dataset.datasetnote_set.count(), 1)
@@ -0,0 +1,171 @@
+import json
+from collections import OrderedDict
+
+from celery.exceptions import Retry
+from django.test import TestCase, override_settings
+from mock import MagicMock, patch
+
+from iati.factory import iati_factory
+from iati.models import Activity
+from iati.parser import pipeline
+from iati.parser.IATI_2_03 import Parse as Parser_203
+from iati.parser.iati_parser import IatiParser
+from iati_synchroniser.factory.synchroniser_factory import DatasetFactory
+
+
+class PipelineTestCase(TestCase):
+    """
+    Handing saved activities over to the post save and indexing stages
+    """
+
+    def setUp(self):
+        self.parser = IatiParser(None)
+        self.parser.save_all_models = MagicMock()
+        self.parser.post_save_models = MagicMock()
+
+        self.model_stores = [
+            OrderedDict([('Activity', [Activity(id=1)])]),
+            OrderedDict([('Activity', [Activity(id=2)])]),
+        ]
+
+    @override_settings(IATI_PARSER_PIPELINE=False)
+    @patch('iati.parser.post_save.update_activity_search_indexes')
+    @patch('iati.parser.iati_parser.ActivityTaskIndexing')
+    def test_without_pipeline(self, task_indexing,
+                              update_activity_search_indexes):
+        self.parser.save_model_stores(self.model_stores)
+
+        self.assertEqual(self.parser.post_save_models.call_count, 2)
+        self.parser.post_save_models.assert_called_with(
+            update_search_index=False)
+        update_activity_search_indexes.assert_called_once_with([1, 2])
+        task_indexing.return_value.run_batch.assert_called_once_with([1, 2])
+
+    @override_settings(IATI_PARSER_PIPELINE=True)
+    @patch('iati.parser.pipeline.record_metrics')
+    @patch('iati.parser.pipeline.emit',
+           return_value=(MagicMock(id='task-1'), 0))
+    @patch('iati.parser.iati_parser.ActivityTaskIndexing')
+    def test_emit_activity_ids(self, task_indexing, emit, record_metrics):
+        self.parser.save_model_stores(self.model_stores)
+
+        # indexed after the file stage:
+        emit.assert_called_once_with([1, 2], True, index=False)
+        self.assertEqual(self.parser.pipeline_batches, [('task-1', [1, 2])])
+        self.parser.post_save_models.assert_not_called()
+        task_indexing.assert_not_called()
+        self.assertEqual(record_metrics.call_args[0][:2], ('parse', 2))
+
+    @override_settings(
+        IATI_PARSER_PIPELINE_MAX_PENDING=10,
+        IATI_PARSER_PIPELINE_MAX_WAIT=60,
+        IATI_PARSER_PIPELINE_POLL_INTERVAL=5)
+    @patch('iati.parser.pipeline.time')
+    @patch('iati.parser.pipeline.get_queue_length')
+    def test_wait_for_capacity(self, get_queue_length, time):
+        time.time.side_effect = [0, 0, 5, 10]
+        get_queue_length.side_effect = [12, 10, 3]
+
+        self.assertEqual(pipeline.wait_for_capacity('parser_indexing'), 10)
+        self.assertEqual(time.sleep.call_count, 2)
+
+    @override_settings(
+        IATI_PARSER_PIPELINE_MAX_PENDING=10,
+        IATI_PARSER_PIPELINE_MAX_WAIT=60,
+        IATI_PARSER_PIPELINE_POLL_INTERVAL=5)
+    @patch('iati.parser.pipeline.time')
+    @patch('iati.parser.pipeline.get_queue_length', return_value=20)
+    def test_wait_for_capacity_gives_up(self, get_queue_length, time):
+        time.time.side_effect = [0, 60, 60]
+
+        self.assertEqual(pipeline.wait_for_capacity('parser_indexing'), 60)
+        time.sleep.assert_not_called()
+
+    @patch('iati.parser.pipeline.index_activities')
+    @patch('iati.parser.pipeline.wait_for_capacity', return_value=0)
+    @patch('iati.parser.pipeline.record_metrics')
+    @patch('iati.parser.pipeline.post_save.update_activity_search_indexes')
+    @patch('iati.parser.pipeline.post_save.post_save_activity')
+    def test_post_save_stage(self, post_save_activity,
+                             update_activity_search_indexes, record_metrics,
+                             wait_for_capacity, index_activities):
+        activity = iati_factory.ActivityFactory.create()
+
+        pipeline.post_save_activities([activity.id], True)
+
+        post_save_activity.assert_called_once_with(
+            activity, update_search_index=False)
+        update_activity_search_indexes.assert_called_once_with([activity.id])
+        index_activities.delay.assert_called_once_with([activity.id])
+        self.assertEqual(record_metrics.call_args[0][:2], ('post_save', 1))
+
+
+class FileStageTestCase(TestCase):
+    """
+    The actions on the whole dataset, once its post save stage has run
+    """
+
+    def setUp(self):
+        self.parser = Parser_203(None)
+        self.parser.dataset = DatasetFactory.create()
+        self.parser.dirty_parents.mark([('IATI-0002', 'IATI-0001')])
+        self.parser.dirty_chains.mark(['IATI-0002'])
+        self.parser.append_error(
+            'FieldValidationError', 'title', 'narrative', 'Required', 12,
+            iati_id='IATI-0002')
+
+        self.batches = [('task-1', [1, 2]), ('task-2', [3])]
+
+    @override_settings(IATI_PARSER_PIPELINE=True)
+    @patch('iati.parser.pipeline.emit_file')
+    def test_file_stage_is_emitted(self, emit_file):
+        self.parser.post_save_file = MagicMock()
+        self.parser.pipeline_batches = list(self.batches)
+
+        self.parser.parse_elements([])
+
+        emit_file.assert_called_once_with(self.parser, self.batches)
+        self.parser.post_save_file.assert_not_called()
+
+    def test_file_state(self):
+        # it's sent as a celery message:
+        state = json.loads(json.dumps(self.parser.get_file_state()))
+
+        parser = Parser_203(None)
+        parser.set_file_state(state)
+
+        self.assertEqual(parser.dataset, self.parser.dataset)
+        self.assertEqual(parser.parse_start_datetime,
+                         self.parser.parse_start_datetime)
+        self.assertEqual(parser.dirty_parents.links,
+                         {('IATI-0002', 'IATI-0001')})
+        self.assertEqual(parser.dirty_chains.iati_identifiers, {'IATI-0002'})
+        self.assertEqual(
+            [(note.iati_identifier, note.model, note.line_number)
+             for note in parser.errors],
+            [('IATI-0002', 'title', 12)])
+
+    @patch('iati.parser.pipeline.is_done', return_value=False)
+    @patch('iati.parser.IATI_2_03.Parse.finish_file')
+    def test_waits_for_post_save_stage(self, finish_file, is_done):
+        with self.assertRaises(Retry):
+            pipeline.post_save_file(
+                self.parser.get_file_state(), self.batches)
+
+        is_done.assert_called_once_with(['task-1', 'task-2'])
+        finish_file.assert_not_called()
+
+    @patch('iati.parser.pipeline.is_done', return_value=True)
+    @patch('iati.parser.pipeline.index_activities')
+    @patch('iati.parser.pipeline.wait_for_capacity', return_value=0)
+    @patch('iati.parser.pipeline.record_metrics')
+    @patch('iati.parser.IATI_2_03.Parse.finish_file')
+    def test_file_stage(self, finish_file, record_metrics, wait_for_capacity,
+                        index_activities, is_done):
+        pipeline.post_save_file(self.parser.get_file_state(), self.batches)
+
+        finish_file.assert_called_once_with()
+        self.assertEqual(
+            [c[0] for c in index_activities.delay.call_args_list],
+            [([1, 2],), ([3],)])
+        self.assertEqual(record_metrics.call_args[0][:2], ('file', 3))
@@ -0,0 +1,155 @@
+from decimal import Decimal
+
+from django.db import IntegrityError
+from django.test import TestCase
+from mock import patch
+
+from iati.activity_aggregation_calculation import (
+    ActivityAggregationCalculation, DirtyParents, get_aggregation,
+    get_total_aggregation, upsert
+)
+from iati.factory import iati_factory
+from iati.models import ActivityAggregation, ChildAggregation
+from iati.parser.post_save import set_dataset_activity_aggregations
+from iati.transaction.factories import TransactionFactory
+from iati_codelists.factory import codelist_factory
+from iati_synchroniser.factory.synchroniser_factory import DatasetFactory
+
+
+class AggregationTestCase(TestCase):
+
+    def test_get_aggregation(self):
+        self.assertEqual(get_aggregation({}), (None, None))
+        self.assertEqual(
+            get_aggregation({'USD': Decimal(10)}), ('USD', Decimal(10)))
+        # mixed currencies:
+        self.assertEqual(
+            get_aggregation({'USD': Decimal(10), 'EUR': Decimal(5)}),
+            (None, Decimal(15)))
+
+    def test_get_total_aggregation(self):
+        self.assertEqual(
+            get_total_aggregation(('USD', Decimal(10)), ('USD', Decimal(0))),
+            ('USD', Decimal(10)))
+        self.assertEqual(
+            get_total_aggregation(('USD', Decimal(0)), ('EUR', Decimal(5))),
+            ('EUR', Decimal(5)))
+        self.assertEqual(
+            get_total_aggregation(('USD', Decimal(10)), (None, None)),
+            (None, Decimal(10)))
+
+
+class ActivityAggregationCalculationTestCase(TestCase):
+
+    def setUp(self):
+        self.dataset = DatasetFactory.create()
+
+        self.parent = iati_factory.ActivityFactory.create(
+            iati_identifier='IATI-0001')
+        self.child = iati_factory.ActivityFactory.create(
+            iati_identifier='IATI-0002', dataset=self.dataset)
+
+        iati_factory.RelatedActivityFactory.create(
+            current_activity=self.child,
+            ref_activity=self.parent,
+            ref=self.parent.iati_identifier)
+
+        usd = codelist_factory.CurrencyFactory.create(code='USD')
+        eur = codelist_factory.CurrencyFactory.create(code='EUR')
+        incoming_funds = codelist_factory.TransactionTypeFactory.create(
+            code='1')
+
+        iati_factory.BudgetFactory.create(
+            activity=self.parent, currency=usd, value=100)
+        iati_factory.BudgetFactory.create(
+            activity=self.parent, currency=usd, value=50)
+
+        iati_factory.BudgetFactory.create(
+            activity=self.child, currency=usd, value=20)
+        TransactionFactory.create(
+            activity=self.child, transaction_type=incoming_funds,
+            currency=usd, value=10)
+        TransactionFactory.create(
+            activity=self.child, transaction_type=incoming_funds,
+            currency=eur, value=5)
+
+    def test_parse_activity_aggregations_by_source(self):
+        ActivityAggregationCalculation().parse_activity_aggregations_by_source(
+            self.dataset.id)
+
+        self.child.refresh_from_db()
+        self.parent.refresh_from_db()
+
+        child_aggregation = self.child.activity_aggregation
+        self.assertEqual(child_aggregation.budget_value, 20)
+        self.assertEqual(child_aggregation.budget_currency, 'USD')
+        self.assertEqual(child_aggregation.incoming_funds_value, 15)
+        self.assertIsNone(child_aggregation.incoming_funds_currency)
+        self.assertIsNone(child_aggregation.disbursement_value)
+
+        # the parent of an activity in the dataset is updated too:
+        self.assertEqual(self.parent.activity_aggregation.budget_value, 150)
+        self.assertEqual(self.parent.child_aggregation.budget_value, 20)
+        self.assertEqual(
+            self.parent.child_aggregation.incoming_funds_value, 15)
+
+        total_aggregation = self.parent.activity_plus_child_aggregation
+        self.assertEqual(total_aggregation.budget_value, 170)
+        self.assertEqual(total_aggregation.incoming_funds_value, 15)
+
+    def test_existing_aggregations_are_updated(self):
+        ActivityAggregation.objects.create(
+            activity=self.parent, budget_value=1, budget_currency='EUR')
+
+        ActivityAggregationCalculation().parse_all_activity_aggregations()
+
+        aggregation = ActivityAggregation.objects.get(activity=self.parent)
+        self.assertEqual(aggregation.budget_value, 150)
+        self.assertEqual(aggregation.budget_currency, 'USD')
+
+    def test_dirty_parents(self):
+        dirty_parents = DirtyParents()
+        dirty_parents.mark_activities([self.child])
+        # marked again by the parsed version of the same child:
+        dirty_parents.mark([('IATI-0002', 'IATI-0001')])
+        dirty_parents.mark([('IATI-0003', 'IATI-0001')])
+
+        self.assertEqual(len(dirty_parents), 1)
+
+        ActivityAggregationCalculation().parse_activity_aggregations_by_source(
+            self.dataset.id, dirty_parents)
+
+        self.assertEqual(
+            ChildAggregation.objects.get(activity=self.parent).budget_value,
+            20)
+        self.assertEqual(dirty_parents.marked, 2)
+        self.assertEqual(dirty_parents.recalculated, 1)
+        self.assertEqual(dirty_parents.saved, 1)
+        self.assertEqual(len(dirty_parents), 0)
+
+    def test_deleted_activity_in_batch(self):
+        calls = []
+
+        def upsert_once(model, rows):
+            calls.append(set(rows))
+            if len(calls) == 1:
+                raise IntegrityError('violates foreign key constraint')
+            upsert(model, rows)
+
+        with patch('iati.activity_aggregation_calculation.upsert',
+                   side_effect=upsert_once):
+            ActivityAggregationCalculation().calculate_aggregations(
+                [self.child.id, 0])
+
+        # saved again for the activities which still exist:
+        self.assertEqual(calls[1:], [{self.child.id}] * 3)
+        self.assertEqual(
+            ActivityAggregation.objects.get(activity=self.child).budget_value,
+            20)
+
+    @patch('iati.parser.post_save.ActivityAggregationCalculation'
+           '.parse_activity_aggregations_by_source',
+           side_effect=IntegrityError)
+    def test_dataset_aggregation_errors_are_logged(self, _):
+        # the other post file actions keep running:
+        set_dataset_activity_aggregations(self.dataset)
@@ -0,0 +1,68 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from iati.activity_search_indexes import reindex_activities, reindex_activity
+from iati.factory import iati_factory
+from iati.models import ActivitySearch
+
+
+def create_activity(iati_identifier):
+    activity = iati_factory.ActivityFactory.create(
+        iati_identifier=iati_identifier)
+
+    title = iati_factory.TitleFactory.create(activity=activity)
+    iati_factory.NarrativeFactory.create(
+        related_object=title, activity=activity, content='Title')
+
+    description = iati_factory.DescriptionFactory.create(activity=activity)
+    iati_factory.NarrativeFactory.create(
+        related_object=description, activity=activity, content='Water')
+
+    iati_factory.ActivitySectorFactory.create(activity=activity)
+    iati_factory.ActivityRecipientCountryFactory.create(activity=activity)
+
+    return activity
+
+
+@override_settings(FTS_ENABLED=True)
+class ReindexActivitiesTestCase(TestCase):
+
+    def setUp(self):
+        self.activities = [
+            create_activity('IATI-{}'.format(i)) for i in range(3)
+        ]
+        self.activity_ids = [activity.id for activity in self.activities]
+
+    def test_reindex_activities(self):
+        reindex_activities(self.activity_ids)
+
+        activity_search = ActivitySearch.objects.get(
+            activity=self.activities[0])
+        self.assertEqual(activity_search.iati_identifier, 'IATI-0')
+        self.assertEqual(activity_search.title, 'Title')
+        self.assertEqual(activity_search.description, 'Water')
+        self.assertIsNotNone(activity_search.search_vector_text)
+
+        self.assertEqual(
+            ActivitySearch.objects.filter(
+                search_vector_text='water').count(),
+            len(self.activity_ids))
+
+    def test_reindex_replaces_rows(self):
+        reindex_activity(self.activities[0])
+        reindex_activities(self.activity_ids)
+
+        self.assertEqual(
+            ActivitySearch.objects.filter(
+                activity=self.activities[0]).count(), 1)
+
+    def test_queries_per_batch_are_constant(self):
+        # the first run fills caches, like the one of content types:
+        reindex_activities(self.activity_ids[:1])
+
+        with CaptureQueriesContext(connection) as context:
+            reindex_activities(self.activity_ids[:1])
+
+        with self.assertNumQueries(len(context.captured_queries)):
+            reindex_activities(self.activity_ids)
@@ -6,13 +6,19 @@ from unittest import skip
 import pytest
 from django.core import management
 from django.test import TestCase as DjangoTestCase
+from lxml import etree
 from lxml.builder import E
+from mock import patch
 
 import iati_codelists.models as codelist_models
 from iati.factory import iati_factory
 from iati.models import Activity
+from iati.parser.exceptions import NoUpdateRequired
 from iati.parser.IATI_2_01 import Parse as Parser_201
+from iati.parser.IATI_2_03 import Parse as Parser_203
 from iati.parser.iati_parser import IatiParser
+from iati_synchroniser.factory.synchroniser_factory import DatasetFactory
+from iati_synchroniser.models import DatasetNote
 
 # TODO: use factories instead of these fixtures
 
@@ -153,6 +159,162 @@ class IatiParserTestCase(DjangoTestCase):
         raise NotImplementedError()
 
 
+class DispatchTableTestCase(DjangoTestCase):
+    """
+    Unit tests for the parser's dispatch table
+    """
+
+    class Parser(IatiParser):
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.parsed = []
+
+        def iati_activities__iati_activity(self, element):
+            self.parsed.append(element.tag)
+
+        def iati_activities__iati_activity__title__narrative(self, element):
+            self.parsed.append(element.text)
+
+        def iati_activities__iati_activity__sector(self, element):
+            raise Exception('children of sector should not be parsed')
+
+        def iati_activities__iati_activity__sector__narrative(self, element):
+            self.parsed.append(element.text)
+
+    def setUp(self):
+        self.root = E(
+            'iati-activities',
+            E('iati-activity',
+              E('title', E('narrative', 'title')),
+              E('sector', E('narrative', 'sector')),
+              E('{http://example.org/ns}title', E('narrative', 'ns'))))
+        self.parser = self.Parser(self.root)
+
+    def test_dispatch_table_is_built_per_class(self):
+        table = self.Parser.get_dispatch_table()
+
+        self.assertIs(table, self.Parser.get_dispatch_table())
+        self.assertIsNot(table, Parser_201.get_dispatch_table())
+
+        activity = table['iati_activities'].children['iati_activity']
+        self.assertEqual(activity.handler, 'iati_activities__iati_activity')
+        self.assertIsNone(activity.children['title'].handler)
+
+    def test_get_dispatch_node(self):
+        narrative = self.root[0][0][0]
+
+        node = self.parser.get_dispatch_node(narrative)
+
+        self.assertEqual(
+            node.handler, 'iati_activities__iati_activity__title__narrative')
+
+    def test_parse_dispatches_to_handlers(self):
+        parsed = self.parser.parse(self.root[0])
+
+        self.assertTrue(parsed)
+        # sector raised an error, namespaced elements have no handlers:
+        self.assertEqual(self.parser.parsed, ['iati-activity', 'title'])
+
+
+class ContentHashTestCase(DjangoTestCase):
+    """
+    Skipping activities which did not change since they were last parsed
+    """
+
+    def setUp(self):
+        self.parser = IatiParser(None)
+        self.parser.dataset = DatasetFactory.create()
+
+    def test_content_hash_is_canonical(self):
+        first = etree.fromstring(
+            '<iati-activity a="1" b="2"><!-- comment -->'
+            '<title>\n <narrative>Title</narrative></title></iati-activity>')
+        second = etree.fromstring(
+            '<iati-activity b="2" a="1"><title>'
+            '<narrative> Title </narrative>\n</title></iati-activity>')
+        changed = etree.fromstring(
+            '<iati-activity a="1" b="2"><title>'
+            '<narrative>Other title</narrative></title></iati-activity>')
+
+        self.assertEqual(self.parser.get_content_hash(first),
+                         self.parser.get_content_hash(second))
+        self.assertNotEqual(self.parser.get_content_hash(first),
+                            self.parser.get_content_hash(changed))
+
+    def test_skip_unchanged_activity(self):
+        activity = iati_factory.ActivityFactory.create(
+            content_hash='a' * 40, dataset=self.parser.dataset)
+        last_updated_model = activity.last_updated_model
+
+        with self.assertRaises(NoUpdateRequired):
+            self.parser.skip_unchanged_activity(activity, 'a' * 40)
+
+        activity.refresh_from_db()
+        self.assertNotEqual(activity.last_updated_model, last_updated_model)
+        self.assertEqual(activity.last_updated_model,
+                         self.parser.parse_start_datetime)
+        self.assertEqual(self.parser.unchanged_activities,
+                         [activity.iati_identifier])
+
+    def test_changed_activity_is_not_skipped(self):
+        activity = iati_factory.ActivityFactory.create(
+            content_hash='a' * 40, dataset=self.parser.dataset)
+
+        self.parser.skip_unchanged_activity(activity, 'b' * 40)
+
+        self.parser.force_reparse = True
+        self.parser.skip_unchanged_activity(activity, 'a' * 40)
+
+        self.assertEqual(self.parser.unchanged_activities, [])
+
+
+class DatasetNotesTestCase(DjangoTestCase):
+    """
+    The notes of unchanged activities when a dataset is parsed again
+    """
+
+    def setUp(self):
+        self.parser = Parser_203(None)
+        self.parser.dataset = DatasetFactory.create()
+        self.activity = iati_factory.ActivityFactory.create(
+            content_hash='a' * 40, dataset=self.parser.dataset)
+        # a parent which doesn't exist:
+        iati_factory.RelatedActivityFactory.create(
+            current_activity=self.activity,
+            ref_activity=None,
+            ref='IATI-MISSING')
+
+        # the notes of the last parse:
+        for model, field, message in [
+                ('related-activity', 'ref',
+                 'Must be an existing IATI activity'),
+                ('title', 'narrative', 'Required')]:
+            DatasetNote.objects.create(
+                dataset=self.parser.dataset,
+                iati_identifier=self.activity.iati_identifier,
+                exception_type='FieldValidationError',
+                model=model,
+                field=field,
+                message=message,
+                line_number=-1)
+
+    @patch('iati.parser.iati_parser.DatasetNoteTaskIndexing')
+    def test_notes_of_unchanged_activity(self, _):
+        with self.assertRaises(NoUpdateRequired):
+            self.parser.skip_unchanged_activity(self.activity, 'a' * 40)
+
+        self.parser.parse_elements([])
+
+        # the parse note is kept, the dataset validation is not repeated:
+        self.assertEqual(
+            sorted(DatasetNote.objects.values_list('model', 'message')),
+            [('related-activity', 'Must be an existing IATI activity'),
+             ('title', 'Required')])
+        self.parser.dataset.refresh_from_db()
+        self.assertEqual(self.parser.dataset.note_count, 2)
+
+
 class ParserTestCase(DjangoTestCase):
     """
     Integration tests for the parser
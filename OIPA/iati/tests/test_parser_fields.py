@@ -14,7 +14,7 @@ from mock import MagicMock
 import iati.models as iati_models
 import iati_codelists.models as codelist_models
 import iati_synchroniser.models as synchroniser_models
-from currency_convert import convert
+from currency_convert.rate_table import RateTable
 from iati.factory import iati_factory
 from iati.parser.exceptions import FieldValidationError, RequiredFieldError
 from iati.parser.IATI_1_03 import Parse as Parser_103
@@ -2275,8 +2275,8 @@ class BudgetTestCase(ParserSetupTestCase):
         text = "2000.2"
 
         xdr_value = 200
-        currency_from_to = convert.currency_from_to
-        convert.currency_from_to = MagicMock(return_value=xdr_value)
+        currency_from_to = RateTable.currency_from_to
+        RateTable.currency_from_to = MagicMock(return_value=xdr_value)
 
         value = E('value', text, **attrs)
 
@@ -2301,7 +2301,7 @@ class BudgetTestCase(ParserSetupTestCase):
         self.assertEqual(budget.jpy_value, xdr_value)
         self.assertEqual(budget.cad_value, xdr_value)
 
-        convert.currency_from_to = currency_from_to
+        RateTable.currency_from_to = currency_from_to
 
     def test_budget_no_value_date_should_not_parse_202(self):
         """
@@ -2667,8 +2667,8 @@ class TransactionTestCase(ParserSetupTestCase):
         value = E('value', value_text, **attrs)
 
         # mock xdr canculation
-        currency_from_to = convert.currency_from_to
-        convert.currency_from_to = MagicMock(return_value=xdr_value)
+        currency_from_to = RateTable.currency_from_to
+        RateTable.currency_from_to = MagicMock(return_value=xdr_value)
 
         self.parser_202.iati_activities__iati_activity__transaction__value(
             value)
@@ -2686,7 +2686,7 @@ class TransactionTestCase(ParserSetupTestCase):
         self.assertEqual(transaction.jpy_value, xdr_value)
         self.assertEqual(transaction.cad_value, xdr_value)
 
-        convert.currency_from_to = currency_from_to
+        RateTable.currency_from_to = currency_from_to
 
     def test_transaction_no_value_date_should_not_parse_202(self):
         """
@@ -2,7 +2,7 @@ import datetime
 
 from django.test import TestCase
 from lxml.builder import E
-from mock import MagicMock
+from mock import MagicMock, patch
 
 from iati.factory import iati_factory
 from iati.models import Activity
@@ -28,7 +28,8 @@ class PostSaveFileTestCase(TestCase):
             iati_standard_version=self.first_activity.iati_standard_version,
             dataset=self.dataset)
 
-    def test_post_save_file(self):
+    @patch('iati.parser.post_save.set_dataset_activity_aggregations')
+    def test_post_save_file(self, set_dataset_activity_aggregations):
         """
         Check if all required functions are called
         """
@@ -38,6 +39,8 @@ class PostSaveFileTestCase(TestCase):
         self.parser.post_save_file(self.parser.dataset)
         self.parser.delete_removed_activities.assert_called_once_with(
             self.parser.dataset)
+        set_dataset_activity_aggregations.assert_called_once_with(
+            self.parser.dataset, self.parser.dirty_parents)
 
     def test_delete_removed_activities(self):
         """The parser should remove activities that are not in the source any longer
@@ -0,0 +1,48 @@
+"""
+Counts the activities (or organisations) of an IATI file in one streaming
+pass, reading the version of the file on the way.
+"""
+from lxml import etree
+
+# The counted top level elements by Dataset.filetype:
+ELEMENT_TAGS = {
+    1: 'iati-activity',
+    2: 'iati-organisation',
+}
+
+
+def count_elements(file, tag):
+    """
+    The version attribute of the root element and the number of its child
+    elements with the tag, f.e. count_elements(f, 'iati-activity').
+
+    The file is read with iterparse, every top level element is cleared and
+    removed as soon as it's counted, so memory stays bounded by the size of
+    a single element.
+
+    Returns (version, count), version is None when the root has none
+    """
+    version = None
+    count = 0
+    depth = 0
+
+    for event, element in etree.iterparse(
+            file, events=('start', 'end'), huge_tree=True):
+        if event == 'start':
+            if depth == 0:
+                version = element.get('version')
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth != 1:
+            continue
+
+        if element.tag == tag:
+            count += 1
+
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+    return version, count
@@ -40,8 +40,12 @@ def export_xml_by_source(request, dataset_id):
         rf = RequestFactory()
         req = rf.get(base_url.format(page=page_num))
 
-        view = IATIActivityList.as_view()(req).render()
-        xml.extend(etree.fromstring(view.content).getchildren())
+        view = IATIActivityList.as_view()(req)
+        if view.streaming:
+            content = b''.join(view.streaming_content)
+        else:
+            content = view.render().content
+        xml.extend(etree.fromstring(content).getchildren())
 
         link_header = view.get('link')
 
@@ -0,0 +1,161 @@
+"""
+Downloads the files of many datasets at once into the DatasetStore, for the
+DatasetSyncer.
+
+The files are downloaded by a pool of threads sharing one pooled
+requests.Session, with at most settings.DATASET_FETCH_PER_HOST downloads
+from the same host at once so a slow host can't hold up (or be hammered by)
+the whole pool. Failed downloads (connection errors, timeouts and 5xx
+responses) are retried with an exponential backoff.
+
+When the store still has the file of the last download, the ETag and
+Last-Modified of the Dataset are sent back. A 304 response keeps the stored
+file, so it's neither downloaded nor hashed again and the sha1 of the
+Dataset stays the same, which makes the parser skip it.
+
+Use:
+fetcher = DatasetFetcher()
+records = fetcher.fetch_all([(url, etag, last_modified), ...])
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from iati_synchroniser.dataset_store import HEADERS, DatasetStore
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetFetcher(object):
+
+    def __init__(self, store=None, workers=None, per_host=None, retries=None,
+                 backoff=None, timeout=30):
+        self.store = store or DatasetStore()
+        self.workers = workers or settings.DATASET_FETCH_WORKERS
+        self.per_host = per_host or settings.DATASET_FETCH_PER_HOST
+        self.retries = settings.DATASET_FETCH_RETRIES \
+            if retries is None else retries
+        self.backoff = settings.DATASET_FETCH_BACKOFF \
+            if backoff is None else backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(
+            pool_connections=self.workers, pool_maxsize=self.per_host)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.host_limits = {}
+        self.lock = threading.Lock()
+
+    def get_host_limit(self, url):
+        host = urlsplit(url).netloc
+
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(
+                    self.per_host)
+            return self.host_limits[host]
+
+    def fetch_all(self, datasets):
+        """
+        Download the files of many datasets concurrently.
+
+        datasets -- (url, etag, last_modified) tuples, the headers of the
+        last download of the url (or empty)
+
+        Returns the fetch records (see DatasetStore.get_record) by url
+        """
+        datasets = {url: (url, etag, last_modified)
+                    for url, etag, last_modified in datasets}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                url: executor.submit(self.fetch, *dataset)
+                for url, dataset in datasets.items()
+            }
+
+        return {url: future.result() for url, future in futures.items()}
+
+    def get_conditional_headers(self, url, etag, last_modified):
+        """
+        The headers to only get the file of a url when it changed, as long
+        as the store still has the file of its last download
+        """
+        record = self.store.get_record(url)
+        if not record or not record['sha1'] or \
+                not self.store.has_blob(record['sha1']):
+            return {}
+
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        return headers
+
+    def fetch(self, url, etag='', last_modified=''):
+        """
+        Download the file of a url to the store unless it didn't change, and
+        record it
+        """
+        headers = self.get_conditional_headers(url, etag, last_modified)
+        sha1 = None
+
+        with self.get_host_limit(url):
+            response = self.request(url, headers)
+
+            if response is None:
+                pass
+            elif response.status_code == 304:
+                response.close()
+                sha1 = self.store.get_record(url)['sha1']
+                # the server doesn't have to repeat them:
+                response.headers.setdefault('ETag', etag)
+                response.headers.setdefault('Last-Modified', last_modified)
+            elif response.status_code == 200:
+                sha1 = self.store.write(response)
+            else:
+                response.close()
+
+        return self.store.save_record(url, response, sha1)
+
+    def request(self, url, headers):
+        """
+        GET a url, retrying connection errors, timeouts and 5xx responses.
+        Returns the last response, None when the url couldn't be reached
+        """
+        response = None
+        verify = True
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+            try:
+                response = self.session.get(
+                    url, headers=headers, timeout=self.timeout, stream=True,
+                    verify=verify)
+            except requests.exceptions.SSLError as e:
+                # like the other downloads, retry without verifying:
+                logger.info('%s (%s) %s', e, type(e), url)
+                verify = False
+                continue
+            except requests.exceptions.RequestException as e:
+                logger.info('%s (%s) %s', e, type(e), url)
+                continue
+
+            if response.status_code < 500:
+                return response
+
+            response.close()
+
+        return response
@@ -0,0 +1,246 @@
+"""
+A content-addressed store of the downloaded dataset files on local disk.
+
+Every downloaded file is kept as blobs/<sha1[:2]>/<sha1>, named by the sha1
+of its bytes, and a fetch record (urls/<sha1 of the url>.json) keeps which
+blob a source url had when it was last downloaded. As long as that record is
+younger than settings.DATASET_STORE_MAX_AGE, the syncer, the download and
+validation tasks, the parser and the activity count all read the same blob
+instead of downloading the url again, and only the sha1 of a file is passed
+to the tasks.
+
+The store doesn't know about datasets; prune (called after every sync with
+the registry, see DatasetSyncer, or by the prune_dataset_store command)
+removes the records of urls and the blobs which are no longer used.
+
+Use:
+store = DatasetStore()
+sha1 = store.get(dataset.source_url)
+if sha1:
+    with store.open(sha1) as f:
+        ...
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X '
+                         '10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36'}  # NOQA: E501
+
+# Size of the chunks in which a file is downloaded and hashed:
+CHUNK_SIZE = 64 * 1024
+
+# Files younger than this are never pruned, they might belong to a download
+# which is still running:
+PRUNE_MIN_AGE = 60 * 60
+
+
+def get_response(url):
+    """
+    A streaming GET of a dataset url, None when it can't be reached
+    """
+    try:
+        return requests.get(url, headers=HEADERS, timeout=30, stream=True)
+    except requests.exceptions.SSLError:
+        try:
+            return requests.get(url, verify=False, headers=HEADERS,
+                                timeout=30, stream=True)
+        except requests.exceptions.RequestException as e:
+            logger.info('%s (%s) %s', e, type(e), url)
+    except requests.exceptions.RequestException as e:
+        logger.info('%s (%s) %s', e, type(e), url)
+
+    return None
+
+
+class DatasetStore(object):
+
+    def __init__(self, root=None, max_age=None):
+        self.root = root or settings.DATASET_STORE_ROOT
+        self.max_age = settings.DATASET_STORE_MAX_AGE \
+            if max_age is None else max_age
+
+    def get_blob_path(self, sha1):
+        return os.path.join(self.root, 'blobs', sha1[:2], sha1)
+
+    def get_record_path(self, url):
+        return os.path.join(
+            self.root,
+            'urls',
+            hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def get_record(self, url):
+        """
+        The last fetch of a url: its sha1 (None when it couldn't be
+        downloaded), status code, ETag and Last-Modified headers and time
+        """
+        try:
+            with open(self.get_record_path(url)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def is_fresh(self, record):
+        if record is None:
+            return False
+
+        if time.time() - record['fetched_at'] > self.max_age:
+            return False
+
+        return record['sha1'] is None or self.has_blob(record['sha1'])
+
+    def get(self, url, force=False):
+        """
+        The sha1 of the file of a url, downloaded when it wasn't downloaded
+        recently (or when forced). None when the url can't be downloaded
+        """
+        record = self.get_record(url)
+
+        if force or not self.is_fresh(record):
+            record = self.fetch(url)
+
+        return record['sha1']
+
+    def fetch(self, url):
+        """
+        Download a url to the store and record it. The file is hashed while
+        it's written, and only moved to its blob path once complete
+        """
+        sha1 = None
+        response = get_response(url)
+
+        if response is not None and response.status_code == 200:
+            sha1 = self.write(response)
+        elif response is not None:
+            response.close()
+
+        return self.save_record(url, response, sha1)
+
+    def write(self, response):
+        hasher = hashlib.sha1()
+
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as f:
+            try:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    hasher.update(chunk)
+                    f.write(chunk)
+            except requests.exceptions.RequestException as e:
+                logger.info('%s (%s) %s', e, type(e), response.url)
+                os.remove(f.name)
+                return None
+            finally:
+                response.close()
+
+        sha1 = hasher.hexdigest()
+        blob_path = self.get_blob_path(sha1)
+
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(f.name, blob_path)
+
+        return sha1
+
+    def has_blob(self, sha1):
+        return os.path.exists(self.get_blob_path(sha1))
+
+    def save_record(self, url, response, sha1):
+        """
+        Record the download of a url (response is None when it couldn't be
+        reached) and return the record
+        """
+        headers = response.headers if response is not None else {}
+        record = {
+            'url': url,
+            'sha1': sha1,
+            'status_code': getattr(response, 'status_code', None),
+            'etag': headers.get('ETag', ''),
+            'last_modified': headers.get('Last-Modified', ''),
+            'fetched_at': time.time(),
+        }
+
+        path = self.get_record_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(
+                'w', dir=os.path.dirname(path), delete=False) as f:
+            json.dump(record, f)
+        os.replace(f.name, path)
+
+        return record
+
+    def open(self, sha1):
+        return open(self.get_blob_path(sha1), 'rb')
+
+    def copy(self, sha1, path):
+        shutil.copyfile(self.get_blob_path(sha1), path)
+
+    def iter_files(self, directory):
+        for dirpath, dirnames, filenames in os.walk(
+                os.path.join(self.root, directory)):
+            for filename in filenames:
+                yield os.path.join(dirpath, filename)
+
+    def remove_if_old(self, path, min_age):
+        """
+        Remove a file not modified in the last min_age seconds, returns if
+        it was removed
+        """
+        try:
+            if time.time() - os.path.getmtime(path) < min_age:
+                return False
+            os.remove(path)
+        except OSError:
+            # already removed (by another prune):
+            return False
+
+        return True
+
+    def prune(self, urls, sha1s=(), min_age=PRUNE_MIN_AGE):
+        """
+        Remove the records of the urls which are not in urls, the blobs
+        which are neither in sha1s nor in a remaining record, and the
+        leftovers of interrupted downloads in tmp/. Returns the number of
+        removed files by kind
+        """
+        urls = set(urls)
+        referenced = set(sha1 for sha1 in sha1s if sha1)
+        removed = {'records': 0, 'blobs': 0, 'tmp': 0}
+
+        for path in self.iter_files('urls'):
+            try:
+                with open(path) as f:
+                    record = json.load(f)
+            except (IOError, ValueError):
+                record = None
+
+            if record is not None and record.get('url') in urls:
+                if record.get('sha1'):
+                    referenced.add(record['sha1'])
+            elif self.remove_if_old(path, min_age):
+                removed['records'] += 1
+            elif record is not None and record.get('sha1'):
+                referenced.add(record['sha1'])
+
+        for path in self.iter_files('blobs'):
+            if os.path.basename(path) in referenced:
+                continue
+            if self.remove_if_old(path, min_age):
+                removed['blobs'] += 1
+
+        for path in self.iter_files('tmp'):
+            if self.remove_if_old(path, min_age):
+                removed['tmp'] += 1
+
+        logger.info('Pruned the dataset store: %s', removed)
+        return removed
@@ -1,17 +1,15 @@
 import datetime
-import hashlib
 import json
 import logging
 import ssl
 import urllib
 
-import requests
-from django.utils.encoding import smart_text
-
 from iati_organisation.models import Organisation
 from iati_synchroniser.create_publisher_organisation import (
     create_publisher_organisation
 )
+from iati_synchroniser.dataset_fetcher import DatasetFetcher
+from iati_synchroniser.dataset_store import DatasetStore
 from iati_synchroniser.models import Dataset, Publisher
 from task_queue.tasks import DatasetDownloadTask, DatasetValidationTask
 
@@ -24,6 +22,7 @@ logger = logging.getLogger(__name__)
 
 class DatasetSyncer(object):
     is_download_datasets = False
+    fetcher = None
 
     def get_data(self, url):
         req = urllib.request.Request(url)
@@ -74,9 +73,11 @@ class DatasetSyncer(object):
             # do not verify SSL (for downloading dataset):
             ssl._create_default_https_context = ssl._create_unverified_context
 
-            # update dataset
+            # download the files of the page at once, then update them:
+            records = self.fetch_datasets(results['result']['results'])
+
             for dataset in results['result']['results']:
-                self.update_or_create_dataset(dataset)
+                self.update_or_create_dataset(dataset, records)
 
             # check if done
             if len(results['result']['results']) == 0:
@@ -85,6 +86,23 @@ class DatasetSyncer(object):
         # remove deprecated publishers / datasets
         # self.remove_deprecated()
 
+        self.prune_dataset_store()
+
+    def prune_dataset_store(self):
+        """
+        Remove the downloads of urls and files no dataset refers to anymore
+        from the DatasetStore
+        """
+        urls = set()
+        sha1s = set()
+
+        for source_url, sha1, sync_sha1 in Dataset.objects.values_list(
+                'source_url', 'sha1', 'sync_sha1').iterator():
+            urls.add(source_url)
+            sha1s.update((sha1, sync_sha1))
+
+        return DatasetStore().prune(urls, sha1s)
+
     def get_iati_version(self, dataset_data):
 
         iati_version = self.get_val_in_list_of_dicts(
@@ -137,11 +155,47 @@ class DatasetSyncer(object):
 
         return filetype
 
-    def update_or_create_dataset(self, dataset):
+    def fetch_datasets(self, datasets):
+        """
+        Download the files of a page of datasets concurrently, sending back
+        the ETag and Last-Modified of their last download. Returns the fetch
+        records by url (see DatasetFetcher)
+        """
+        if self.fetcher is None:
+            self.fetcher = DatasetFetcher()
+
+        known = {
+            iati_id: (source_url, etag, last_modified)
+            for iati_id, source_url, etag, last_modified
+            in Dataset.objects.filter(
+                iati_id__in=[dataset['id'] for dataset in datasets]
+            ).values_list('iati_id', 'source_url', 'etag', 'last_modified')
+        }
+
+        urls = []
+        for dataset in datasets:
+            if not len(dataset['resources']):
+                continue
+
+            url = dataset['resources'][0]['url']
+            source_url, etag, last_modified = known.get(
+                dataset['id'], (None, '', ''))
+
+            if source_url == url:
+                urls.append((url, etag, last_modified))
+            else:
+                urls.append((url, '', ''))
+
+        return self.fetcher.fetch_all(urls)
+
+    def update_or_create_dataset(self, dataset, records=None):
         """
         Updates or creates a Dataset AND downloads it locally. Returns internal
         URL for the Dataset
 
+        Keyword arguments:
+        records -- the fetch records by url of fetch_datasets, the file is
+        downloaded here when it's not in there
         """
 
         filetype = self.get_dataset_filetype(dataset)
@@ -157,58 +211,15 @@ class DatasetSyncer(object):
                 iati_id=dataset['organization']['id'])
         except Publisher.DoesNotExist:
             publisher = None
-        sync_sha1 = ''
         source_url = dataset['resources'][0]['url']
-        response = None
-        headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X '
-                                 '10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36'}  # NOQA: E501
 
-        try:
-            response = requests.get(source_url, headers=headers, timeout=30)
-        except requests.exceptions.SSLError:
-            try:
-                response = requests.get(source_url, verify=False,
-                                        headers=headers, timeout=30)
-            except (requests.exceptions.SSLError,
-                    requests.exceptions.Timeout,
-                    requests.exceptions.ConnectionError,
-                    requests.exceptions.TooManyRedirects,
-                    requests.exceptions.ReadTimeout,
-                    requests.exceptions.ChunkedEncodingError,
-                    ):
-                pass
-        except requests.exceptions.Timeout:
-            try:
-                response = requests.get(source_url, timeout=30)
-            except (requests.exceptions.Timeout,
-                    requests.exceptions.ConnectionError,
-                    requests.exceptions.TooManyRedirects,
-                    requests.exceptions.ReadTimeout,
-                    requests.exceptions.ChunkedEncodingError,
-                    ):
-                pass
-        except (requests.exceptions.ConnectionError,
-                requests.exceptions.TooManyRedirects,
-                requests.exceptions.ReadTimeout,
-                requests.exceptions.ChunkedEncodingError,
-                ):
-            pass
-        finally:
-            pass
+        # A sync starts a new download cycle, the other consumers of the file
+        # read it from the store:
+        record = (records or {}).get(source_url)
+        if record is None:
+            record = DatasetStore().fetch(source_url)
 
-        try:
-            iati_file = smart_text(response.content, 'utf-8')
-        # XXX: some files contain non utf-8 characters:
-        # FIXME: this is hardcoded:
-        except UnicodeDecodeError:
-            iati_file = smart_text(response.content, 'latin-1')
-        except AttributeError:
-            iati_file = ''
-
-        # 2. Encode the string to use for hashing:
-        hasher = hashlib.sha1()
-        hasher.update(iati_file.encode('utf-8'))
-        sync_sha1 = hasher.hexdigest()
+        sync_sha1 = record['sha1'] or ''
 
         obj, created = Dataset.objects.update_or_create(
             iati_id=dataset['id'],
@@ -223,12 +234,19 @@ class DatasetSyncer(object):
                 'added_manually': False,
                 'date_created': dataset['metadata_created'],
                 'date_updated': dataset['metadata_modified'],
-                'sync_sha1': sync_sha1
+                'sync_sha1': sync_sha1,
+                'etag': record['etag'],
+                'last_modified': record['last_modified'],
             }
         )
+
+        # the file didn't change (304) and was saved before:
+        if record['status_code'] == 304 and obj.internal_url:
+            return
+
         # this also returns internal URL for the Dataset:
         DatasetDownloadTask.delay(dataset_data=dataset,
-                                  content=iati_file,
+                                  sha1=sync_sha1,
                                   dataset_obj_id=obj.pk)
         # obj.internal_url = return_value.get(disable_sync_subtasks=False)
         # or ''
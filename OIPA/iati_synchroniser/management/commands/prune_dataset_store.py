@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from iati_synchroniser.dataset_syncer import DatasetSyncer
+
+
+class Command(BaseCommand):
+    """
+        Remove the downloads no dataset refers to anymore from the
+        DatasetStore (this is done after every sync with the registry too)
+    """
+
+    def handle(self, *args, **options):
+        removed = DatasetSyncer().prune_dataset_store()
+
+        self.stdout.write(
+            'Removed {records} url records, {blobs} files and {tmp} '
+            'unfinished downloads'.format(**removed))
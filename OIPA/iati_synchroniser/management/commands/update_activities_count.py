@@ -0,0 +1,67 @@
+import logging
+import os
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from iati_synchroniser.models import Dataset
+
+logger = logging.getLogger(__name__)
+
+
+def update_activities_count(dataset_id):
+    """
+    Returns the number of activities in the XML of a dataset (0 when it
+    couldn't be counted) and whether counting failed, a failing dataset
+    doesn't stop the others
+    """
+    try:
+        dataset = Dataset.objects.get(pk=dataset_id)
+        dataset.update_activities_count()
+        return dataset.activities_count_in_xml or 0, False
+    except Exception as e:
+        logger.exception(
+            'Counting the activities of dataset %s failed: %s',
+            dataset_id, e)
+        return 0, True
+
+
+class Command(BaseCommand):
+    """
+        Update the number of activities in the XML and in the database of
+        all (or the given) datasets, in a pool of processes
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset_ids',
+                            nargs='*',
+                            type=int,
+                            help='Only update these datasets')
+        parser.add_argument('--processes',
+                            action='store',
+                            dest='processes',
+                            type=int,
+                            default=os.cpu_count(),
+                            help='Number of datasets counted at once')
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.order_by('id')
+        if options['dataset_ids']:
+            datasets = datasets.filter(id__in=options['dataset_ids'])
+        dataset_ids = list(datasets.values_list('id', flat=True))
+
+        # every process opens its own database connection:
+        connections.close_all()
+
+        total = 0
+        failed = 0
+        with Pool(options['processes']) as pool:
+            for count, error in pool.imap_unordered(
+                    update_activities_count, dataset_ids):
+                total += count
+                failed += error
+
+        self.stdout.write(
+            'Counted {} activities in {} datasets, {} failed'.format(
+                total, len(dataset_ids) - failed, failed))
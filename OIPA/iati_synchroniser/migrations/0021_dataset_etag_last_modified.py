@@ -0,0 +1,23 @@
+# Generated by Django 2.0.13 on 2020-11-16 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iati_synchroniser', '0020_auto_20201102_2000'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='last_modified',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
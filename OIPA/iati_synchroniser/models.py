@@ -1,15 +1,14 @@
 import datetime
 import logging
-from io import BytesIO
 from pathlib import Path
 
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField
 from django.db import models
-from lxml import etree
 
-from iati.filegrabber import FileGrabber
 from iati_organisation.models import Organisation
+from iati_synchroniser.activity_counter import ELEMENT_TAGS, count_elements
+from iati_synchroniser.dataset_store import DatasetStore
 
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
@@ -73,6 +72,10 @@ class Dataset(models.Model):
     sha1 = models.CharField(max_length=40, default="", null=False, blank=True)
     sync_sha1 = models.CharField(max_length=40, default="", null=False,
                                  blank=True)
+    # The ETag and Last-Modified headers of the last download of the
+    # source_url, sent back to only download it again when it changed:
+    etag = models.CharField(max_length=255, default="", blank=True)
+    last_modified = models.CharField(max_length=255, default="", blank=True)
     note_count = models.IntegerField(default=0)
 
     export_in_progress = models.BooleanField(default=False)
@@ -153,31 +156,31 @@ class Dataset(models.Model):
         # and in the XML
 
         try:
-            # Activity count in the XML
-            file_grabber = FileGrabber()
-            response = file_grabber.get_the_file(self.source_url)
-
-            # Parse to XML tree
-            tree = etree.fromstring(response.content)
+            # Activity count in the XML, read from the stored file in one
+            # pass (the file parse_all just parsed, when called by process):
+            store = DatasetStore()
+            sha1 = store.get(self.source_url)
+            if sha1 is None:
+                logger.error('Cannot access the URL %s', self.source_url)
+                return
+
+            with store.open(sha1) as f:
+                iati_version, count = count_elements(
+                    f, ELEMENT_TAGS.get(self.filetype, 'iati-activity'))
 
             # Get version from the XML
             if not self.iati_version:
-                parser = etree.XMLParser(huge_tree=True, encoding='utf-8')
-                parser_tree = etree.parse(BytesIO(response.content), parser)
-                root = parser_tree.getroot()
-
-                # Continue parsing if version is 2.01 or above
-                iati_version = root.xpath('@version')
-                if len(iati_version) > 0:
-                    iati_version = iati_version[0]
+                self.iati_version = iati_version or ''
 
-                self.iati_version = iati_version
-
-            count = len(tree.findall('iati-activity'))
             self.activities_count_in_xml = count
 
             # Activity count in the Database
-            self.activities_count_in_database = self.activity_set.all().count()
+            if self.filetype == 2:
+                self.activities_count_in_database = \
+                    self.organisation_set.count()
+            else:
+                self.activities_count_in_database = \
+                    self.activity_set.count()
 
             self.save(process=False)
         except Exception as e:
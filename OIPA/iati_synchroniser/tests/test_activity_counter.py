@@ -0,0 +1,64 @@
+from io import BytesIO
+
+from django.test import SimpleTestCase, TestCase
+from mock import patch
+
+from iati_synchroniser.activity_counter import count_elements
+from iati_synchroniser.factory.synchroniser_factory import DatasetFactory
+from iati_synchroniser.management.commands.update_activities_count import (
+    update_activities_count
+)
+from iati_synchroniser.models import Dataset
+
+ACTIVITIES = (
+    b'<?xml version="1.0" encoding="UTF-8"?>'
+    b'<iati-activities version="2.03">'
+    b'<iati-activity><iati-identifier>NL-1-1</iati-identifier>'
+    b'<related-activity ref="NL-1-2" type="1"/>'
+    b'</iati-activity>'
+    b'<!-- a comment between activities -->'
+    b'<iati-activity><iati-identifier>NL-1-2</iati-identifier>'
+    b'</iati-activity>'
+    b'</iati-activities>'
+)
+
+
+class CountElementsTestCase(SimpleTestCase):
+
+    def test_counts_top_level_activities(self):
+        self.assertEqual(
+            count_elements(BytesIO(ACTIVITIES), 'iati-activity'),
+            ('2.03', 2))
+
+    def test_counts_organisations(self):
+        xml = (
+            b'<iati-organisations version="2.02">'
+            b'<iati-organisation/><iati-organisation/><iati-organisation/>'
+            b'</iati-organisations>'
+        )
+
+        self.assertEqual(
+            count_elements(BytesIO(xml), 'iati-organisation'), ('2.02', 3))
+
+    def test_without_version(self):
+        xml = b'<iati-activities><iati-activity/></iati-activities>'
+
+        self.assertEqual(
+            count_elements(BytesIO(xml), 'iati-activity'), (None, 1))
+
+
+class UpdateActivitiesCountTestCase(TestCase):
+
+    def setUp(self):
+        self.dataset = DatasetFactory.create()
+
+    @patch.object(Dataset, 'update_activities_count')
+    def test_count(self, count):
+        Dataset.objects.filter(pk=self.dataset.pk).update(
+            activities_count_in_xml=3)
+
+        self.assertEqual(update_activities_count(self.dataset.pk), (3, False))
+
+    @patch.object(Dataset, 'update_activities_count', side_effect=ValueError)
+    def test_failed_dataset(self, count):
+        self.assertEqual(update_activities_count(self.dataset.pk), (0, True))
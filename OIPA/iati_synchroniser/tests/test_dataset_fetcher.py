@@ -0,0 +1,138 @@
+import hashlib
+import shutil
+import socket
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from django.test import SimpleTestCase
+
+from iati_synchroniser.dataset_fetcher import DatasetFetcher
+from iati_synchroniser.dataset_store import DatasetStore
+
+XML = b'<iati-activities version="2.03"></iati-activities>'
+ETAG = '"v1"'
+LAST_MODIFIED = 'Mon, 16 Nov 2020 10:00:00 GMT'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serves XML with an ETag and Last-Modified, answers 304 when they are
+    sent back and fails the first `failures[path]` requests of a path
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers)))
+
+        if server.failures.get(self.path, 0) > 0:
+            server.failures[self.path] -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.send_header('Content-Length', str(len(XML)))
+        self.end_headers()
+        self.wfile.write(XML)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class DatasetFetcherTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = []
+        self.server.failures = {}
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.store = DatasetStore(root=root)
+        self.fetcher = DatasetFetcher(
+            store=self.store, workers=4, per_host=2, retries=2, backoff=0)
+
+    def get_url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self.server.server_port, path)
+
+    def test_fetch_all(self):
+        urls = [self.get_url('/{}.xml'.format(i)) for i in range(5)]
+
+        records = self.fetcher.fetch_all([(url, '', '') for url in urls])
+
+        self.assertEqual(sorted(records), sorted(urls))
+        for record in records.values():
+            self.assertEqual(record['status_code'], 200)
+            self.assertEqual(record['sha1'], hashlib.sha1(XML).hexdigest())
+            self.assertEqual(record['etag'], ETAG)
+            self.assertEqual(record['last_modified'], LAST_MODIFIED)
+
+    def test_not_modified(self):
+        url = self.get_url('/activities.xml')
+        sha1 = self.fetcher.fetch(url)['sha1']
+
+        record = self.fetcher.fetch(url, ETAG, LAST_MODIFIED)
+
+        self.assertEqual(record['status_code'], 304)
+        # the stored file is kept:
+        self.assertEqual(record['sha1'], sha1)
+        self.assertEqual(record['etag'], ETAG)
+        self.assertEqual(
+            self.server.requests[-1][1]['If-Modified-Since'], LAST_MODIFIED)
+
+    def test_no_conditional_get_without_stored_file(self):
+        url = self.get_url('/activities.xml')
+
+        record = self.fetcher.fetch(url, ETAG, LAST_MODIFIED)
+
+        self.assertEqual(record['status_code'], 200)
+        self.assertNotIn('If-None-Match', self.server.requests[-1][1])
+
+    def test_retries_server_errors(self):
+        url = self.get_url('/activities.xml')
+        self.server.failures['/activities.xml'] = 2
+
+        record = self.fetcher.fetch(url)
+
+        self.assertEqual(record['status_code'], 200)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_gives_up_after_retries(self):
+        url = self.get_url('/activities.xml')
+        self.server.failures['/activities.xml'] = 5
+
+        record = self.fetcher.fetch(url)
+
+        self.assertEqual(record['status_code'], 503)
+        self.assertIsNone(record['sha1'])
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_unreachable_url(self):
+        # a port nothing listens on:
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+
+        record = self.fetcher.fetch(
+            'http://127.0.0.1:{}/activities.xml'.format(port))
+
+        self.assertIsNone(record['status_code'])
+        self.assertIsNone(record['sha1'])
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import requests
+from django.test import SimpleTestCase
+from mock import MagicMock, patch
+
+from iati_synchroniser.dataset_store import DatasetStore
+
+URL = 'http://example.com/activities.xml'
+XML = b'<iati-activities version="2.03"></iati-activities>'
+
+
+def mock_response(content, status_code=200):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = {}
+    response.iter_content.return_value = [content[:10], content[10:]]
+    return response
+
+
+class DatasetStoreTestCase(SimpleTestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.store = DatasetStore(root=root, max_age=60)
+
+        patcher = patch('iati_synchroniser.dataset_store.requests.get')
+        self.get = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.get.return_value = mock_response(XML)
+
+    def test_stores_file_by_sha1(self):
+        sha1 = self.store.get(URL)
+
+        self.assertEqual(sha1, hashlib.sha1(XML).hexdigest())
+        with self.store.open(sha1) as f:
+            self.assertEqual(f.read(), XML)
+        self.assertEqual(self.store.get_record(URL)['sha1'], sha1)
+
+    def test_downloads_url_once(self):
+        self.store.get(URL)
+        self.store.get(URL)
+
+        self.assertEqual(self.get.call_count, 1)
+
+    def test_downloads_again_when_forced(self):
+        self.store.get(URL)
+        self.store.get(URL, force=True)
+
+        self.assertEqual(self.get.call_count, 2)
+
+    def test_downloads_again_when_record_expired(self):
+        self.store.get(URL)
+        self.store.max_age = -1
+        self.store.get(URL)
+
+        self.assertEqual(self.get.call_count, 2)
+
+    def test_downloads_again_when_blob_removed(self):
+        sha1 = self.store.get(URL)
+        os.remove(self.store.get_blob_path(sha1))
+
+        self.assertEqual(self.store.get(URL), sha1)
+        self.assertEqual(self.get.call_count, 2)
+
+    def test_failed_download(self):
+        self.get.return_value = mock_response(b'', status_code=404)
+
+        self.assertIsNone(self.store.get(URL))
+        # the failure is recorded as well:
+        self.assertIsNone(self.store.get(URL))
+        self.assertEqual(self.get.call_count, 1)
+        self.assertEqual(self.store.get_record(URL)['status_code'], 404)
+
+    def test_unreachable_url(self):
+        self.get.side_effect = requests.exceptions.ConnectionError
+
+        self.assertIsNone(self.store.get(URL))
+        self.assertIsNone(self.store.get_record(URL)['status_code'])
+
+    def test_prune(self):
+        other_url = 'http://example.com/other.xml'
+        sha1 = self.store.get(URL)
+        self.get.return_value = mock_response(b'<iati-activities/>')
+        other_sha1 = self.store.get(other_url)
+
+        tmp_path = os.path.join(self.store.root, 'tmp', 'interrupted')
+        os.makedirs(os.path.dirname(tmp_path))
+        open(tmp_path, 'w').close()
+
+        removed = self.store.prune([URL], min_age=0)
+
+        self.assertEqual(removed, {'records': 1, 'blobs': 1, 'tmp': 1})
+        self.assertTrue(self.store.has_blob(sha1))
+        self.assertFalse(self.store.has_blob(other_sha1))
+        self.assertIsNone(self.store.get_record(other_url))
+        self.assertFalse(os.path.exists(tmp_path))
+
+    def test_prune_keeps_blobs_of_datasets(self):
+        sha1 = self.store.get(URL)
+
+        self.store.prune([], sha1s=[sha1], min_age=0)
+
+        self.assertIsNone(self.store.get_record(URL))
+        self.assertTrue(self.store.has_blob(sha1))
+
+    def test_prune_keeps_recent_files(self):
+        sha1 = self.store.get(URL)
+
+        removed = self.store.prune([])
+
+        self.assertEqual(removed, {'records': 0, 'blobs': 0, 'tmp': 0})
+        self.assertTrue(self.store.has_blob(sha1))
+        self.assertIsNotNone(self.store.get_record(URL))
@@ -34,7 +34,7 @@ from solr.result.serializers import ResultSerializer
 from solr.transaction.references import TransactionReference
 from solr.transaction.serializers import TransactionSerializer
 from solr.utils import (
-    bool_string, date_string, decimal_string, get_child_attr,
+    bool_string, date_string, decimal_string, get_child_attr, get_first,
     get_narrative_lang_list, make_normalized_usd_namespace_element,
     value_string
 )
@@ -58,7 +58,7 @@ class ActivityIndexing(BaseIndexing):
         )
 
     def reporting_org(self):
-        reporting_org = self.record.reporting_organisations.first()
+        reporting_org = get_first(self.record.reporting_organisations)
         if reporting_org:
             self.add_field(
                 'reporting_org',
@@ -1573,13 +1573,17 @@ class ActivityIndexing(BaseIndexing):
                     self.indexing['transaction_tied_status_code'].append(' ')
 
     def document_link(self):
-        document_link_all = self.record.documentlink_set.filter(
-            result_id__isnull=True,
-            result_indicator_id__isnull=True,
-            result_indicator_baseline_id__isnull=True,
-            result_indicator_period_actual_id__isnull=True,
-            result_indicator_period_target_id__isnull=True
-        )
+        # Filtered here instead of in the database, to use the prefetched
+        # document links:
+        document_link_all = [
+            document_link
+            for document_link in self.record.documentlink_set.all()
+            if document_link.result_id is None
+            and document_link.result_indicator_id is None
+            and document_link.result_indicator_baseline_id is None
+            and document_link.result_indicator_period_actual_id is None
+            and document_link.result_indicator_period_target_id is None
+        ]
         if document_link_all:
             self.add_field('document_link', [])
             self.add_field('document_link_xml', [])
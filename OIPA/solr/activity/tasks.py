@@ -25,8 +25,73 @@ class ActivityTaskIndexing(BaseTaskIndexing):
     indexing = ActivityIndexing
     model = Activity
     solr = solr
+    select_related = ('dataset', 'publisher', 'title')
+    # Everything ActivityIndexing reads:
+    prefetch_related = (
+        'reporting_organisations__organisation__publisher',
+        'reporting_organisations__organisation__name__narratives',
+        'title__narratives',
+        'description_set__narratives',
+        'participating_organisations__narratives',
+        'otheridentifier_set__narratives',
+        'activitydate_set__narratives',
+        'contactinfo_set__organisation__narratives',
+        'contactinfo_set__department__narratives',
+        'contactinfo_set__person_name__narratives',
+        'contactinfo_set__job_title__narratives',
+        'contactinfo_set__mailing_address__narratives',
+        'activityrecipientcountry_set__narratives',
+        'activityrecipientregion_set__narratives',
+        'location_set__name__narratives',
+        'location_set__description__narratives',
+        'location_set__activity_description__narratives',
+        'location_set__locationadministrative_set',
+        'activitysector_set__narratives',
+        'activitytag_set__narratives',
+        'country_budget_items__budgetitem_set__description__narratives',
+        'humanitarianscope_set__narratives',
+        'activitypolicymarker_set__narratives',
+        'default_aid_types',
+        'budget_set',
+        'planneddisbursement_set__provider_organisation__narratives',
+        'planneddisbursement_set__receiver_organisation__narratives',
+        'transaction_set__description__narratives',
+        'transaction_set__provider_organisation__narratives',
+        'transaction_set__receiver_organisation__narratives',
+        'transaction_set__transactionsector_set',
+        'transaction_set__transactionrecipientcountry_set',
+        'transaction_set__transactionrecipientregion_set',
+        'transaction_set__transactionaidtype_set',
+        'documentlink_set__documentlinktitle__narratives',
+        'documentlink_set__documentlinkdescription__narratives',
+        'documentlink_set__documentlinkcategory_set',
+        'documentlink_set__documentlinklanguage_set',
+        'relatedactivity_set',
+        'legacydata_set',
+        'conditions__condition_set__narratives',
+        'result_set__resulttitle__narratives',
+        'result_set__resultdescription__narratives',
+        'result_set__documentlink_set',
+        'result_set__resultreference_set',
+        'result_set__resultindicator_set__resultindicatortitle__narratives',
+        'result_set__resultindicator_set__resultindicatorreference_set',
+        'result_set__resultindicator_set__resultindicatorperiod_set__targets',
+        'result_set__resultindicator_set__resultindicatorperiod_set__actuals',
+        'crsadd_set__other_flags',
+        'crsadd_set__loan_terms',
+        'crsadd_set__loan_status',
+        'fss_set__fssforecast_set',
+    )
 
     def run_related(self):
         TransactionTaskIndexing().run_from_activity(self.instance)
         BudgetTaskIndexing().run_from_activity(self.instance)
         ResultTaskIndexing().run_from_activity(self.instance)
+
+    def run_related_batch(self, ids):
+        for task in (TransactionTaskIndexing(),
+                     BudgetTaskIndexing(),
+                     ResultTaskIndexing()):
+            for instance in task.get_queryset().filter(activity_id__in=ids):
+                task.instance = instance
+                task.run()
@@ -26,5 +26,5 @@ class ActivitySectorTaskIndexing(BaseTaskIndexing):
 
     def delete(self):
         if settings.SOLR.get('indexing'):
-            self.solr.delete(q='iati_identifier:{iati_identifier}'.format(
+            self.delete_by(q='iati_identifier:{iati_identifier}'.format(
                 iati_identifier=self.instance.activity.iati_identifier))
@@ -20,6 +20,11 @@ class BudgetTaskIndexing(BaseTaskIndexing):
     indexing = BudgetIndexing
     model = Budget
     solr = solr
+    select_related = ('activity', )
+    prefetch_related = (
+        'activity__reporting_organisations__organisation',
+        'activity__activityrecipientcountry_set__country',
+    )
 
     def run_from_activity(self, activity):
         for budget in activity.budget_set.all():
@@ -23,4 +23,4 @@ class CodeListRegionTaskIndexing(BaseTaskIndexing):
 
     def delete(self):
         if settings.SOLR.get('indexing'):
-            self.solr.delete(q='id:{code}'.format(code=self.instance.code))
+            self.delete_by(q='id:{code}'.format(code=self.instance.code))
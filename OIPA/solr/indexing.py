@@ -1,8 +1,9 @@
 from rest_framework import serializers
 from rest_framework.renderers import JSONRenderer
 
-from api.activity.serializers import NarrativeSerializer
-from solr.utils import add_dict, add_value_list
+from solr.utils import add_dict, add_value_list, narrative_dict
+
+json_renderer = JSONRenderer()
 
 
 class BaseIndexing(serializers.Serializer):
@@ -29,7 +30,9 @@ class BaseIndexing(serializers.Serializer):
             if narratives_all:
                 narratives = list()
                 for narrative in narratives_all:
-                    value = JSONRenderer().render(NarrativeSerializer(narrative).data).decode() if is_json_string else NarrativeSerializer(narrative).data  # NOQA: E501
+                    value = narrative_dict(narrative)
+                    if is_json_string:
+                        value = json_renderer.render(value).decode()
                     add_value_list(narratives, value)
 
                 self.set_field(field_name, narratives)
@@ -50,10 +53,10 @@ class BaseIndexing(serializers.Serializer):
                     self.indexing[narrative_key].append(' ')
                     self.indexing[narrative_text_key].append(' ')
 
-                if narrative.language:
+                if narrative.language_id:
                     self.add_value_list(
                         narrative_lang_key,
-                        narrative.language.code
+                        narrative.language_id
                     )
                 else:
                     self.indexing[narrative_lang_key].append(' ')
@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+from multiprocessing import Pool, cpu_count
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Min
+
+from solr.activity.tasks import ActivityTaskIndexing
+from solr.budget.tasks import BudgetTaskIndexing
+from solr.result.tasks import ResultTaskIndexing
+from solr.tasks import IndexingBuffer
+from solr.transaction.tasks import TransactionTaskIndexing
+
+logger = logging.getLogger(__name__)
+
+CORES = {
+    'activity': ActivityTaskIndexing,
+    'transaction': TransactionTaskIndexing,
+    'budget': BudgetTaskIndexing,
+    'result': ResultTaskIndexing,
+}
+
+
+def init_worker():
+    # Every worker process needs its own database connections:
+    connections.close_all()
+
+
+def index_chunk(args):
+    """
+    Index the instances of a core with start <= id < end, with their related
+    rows prefetched, posting the documents in batches
+    """
+    core, start, end = args
+    task = CORES[core]()
+
+    count = 0
+    with IndexingBuffer():
+        for instance in task.get_queryset().filter(id__gte=start, id__lt=end):
+            task.instance = instance
+            task.run()
+            count += 1
+
+    return core, start, end, count
+
+
+class Checkpoint(object):
+    """
+    The chunks (by their [start, end) id range) which are indexed already,
+    per core, kept in a JSON file so an interrupted rebuild can be resumed.
+    A chunk only counts as done when its whole range matches, so resuming
+    with another --chunk-size (or after the first id changed) indexes the
+    ranges which weren't covered exactly again
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+
+        if os.path.isfile(path):
+            with open(path) as checkpoint_file:
+                self.done = json.load(checkpoint_file)
+
+    def is_done(self, core, start, end):
+        return [start, end] in self.done.get(core, [])
+
+    def add(self, core, start, end):
+        self.done.setdefault(core, []).append([start, end])
+        self.save()
+
+    def save(self):
+        # write to a temporary file first, so an interrupted write does not
+        # corrupt the checkpoint:
+        with open(self.path + '.tmp', 'w') as checkpoint_file:
+            json.dump(self.done, checkpoint_file)
+        os.replace(self.path + '.tmp', self.path)
+
+    def clear(self, cores):
+        for core in cores:
+            self.done.pop(core, None)
+
+        if self.done:
+            self.save()
+        elif os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+class Command(BaseCommand):
+    """
+        Rebuild Solr cores from the database, in id range chunks indexed by a
+        pool of processes. Finished chunks are checkpointed, running the
+        command again resumes an interrupted rebuild.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'cores',
+            nargs='*',
+            help='Cores to rebuild ({}), defaults to all of them'.format(
+                ', '.join(sorted(CORES))))
+        parser.add_argument(
+            '--processes',
+            action='store',
+            dest='processes',
+            type=int,
+            default=cpu_count(),
+            help='Number of worker processes')
+        parser.add_argument(
+            '--chunk-size',
+            action='store',
+            dest='chunk_size',
+            type=int,
+            default=1000,
+            help='Size of the id ranges indexed by a worker at once')
+        parser.add_argument(
+            '--checkpoint',
+            action='store',
+            dest='checkpoint',
+            default=os.path.join(
+                settings.MEDIA_ROOT, 'solr_rebuild_checkpoint.json'),
+            help='File to keep track of the indexed chunks')
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            dest='restart',
+            default=False,
+            help='Ignore the checkpoint of an earlier rebuild')
+
+    def handle(self, *args, **options):
+        if not settings.SOLR.get('indexing'):
+            raise CommandError('Solr indexing is disabled in the settings')
+
+        cores = options['cores'] or sorted(CORES)
+        for core in cores:
+            if core not in CORES:
+                raise CommandError('Unknown core: {}'.format(core))
+
+        checkpoint = Checkpoint(options['checkpoint'])
+        if options['restart']:
+            checkpoint.clear(cores)
+
+        chunks = []
+        for core in cores:
+            chunks.extend(
+                (core, start, end) for start, end in self.get_chunks(
+                    CORES[core].model, options['chunk_size'])
+                if not checkpoint.is_done(core, start, end)
+            )
+
+        self.stdout.write('Indexing {} chunks of {} with {} processes'.format(
+            len(chunks), ', '.join(cores), options['processes']))
+
+        # The workers can't share the connections of this process:
+        connections.close_all()
+
+        with Pool(options['processes'], initializer=init_worker) as pool:
+            for i, (core, start, end, count) in enumerate(
+                    pool.imap_unordered(index_chunk, chunks), 1):
+                checkpoint.add(core, start, end)
+                self.stdout.write('{}/{} {}: {} documents from id {}'.format(
+                    i, len(chunks), core, count, start))
+
+        checkpoint.clear(cores)
+
+    def get_chunks(self, model, chunk_size):
+        ids = model.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if ids['min_id'] is None:
+            return []
+
+        return [
+            (start, start + chunk_size)
+            for start in range(ids['min_id'], ids['max_id'] + 1, chunk_size)
+        ]
@@ -20,6 +20,17 @@ class ResultTaskIndexing(BaseTaskIndexing):
     indexing = ResultIndexing
     model = Result
     solr = solr
+    select_related = ('activity', 'resulttitle', 'resultdescription')
+    prefetch_related = (
+        'activity__reporting_organisations__organisation',
+        'resulttitle__narratives',
+        'resultdescription__narratives',
+        'documentlink_set',
+        'resultreference_set',
+        'resultindicator_set__resultindicatortitle__narratives',
+        'resultindicator_set__resultindicatordescription__narratives',
+        'resultindicator_set__resultindicatorreference_set',
+    )
 
     def run_from_activity(self, activity):
         for result in activity.result_set.all():
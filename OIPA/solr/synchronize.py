@@ -0,0 +1,106 @@
+from django.db.models.expressions import RawSQL
+
+# Solr stores ids as strings, so they are sorted as strings on both sides:
+ID_TEXT_ORDERING = RawSQL('CAST(id AS text) COLLATE "C"', [])
+
+
+def iter_database_ids(queryset, page_size=10000):
+    """
+    Yield the ids of a queryset as strings, in the order Solr sorts them,
+    streamed from a server side cursor
+    """
+    ids = queryset.order_by(ID_TEXT_ORDERING).values_list('id', flat=True)
+
+    for object_id in ids.iterator(chunk_size=page_size):
+        yield str(object_id)
+
+
+def iter_solr_ids(solr, page_size=10000, q='*:*'):
+    """
+    Yield the ids of all documents in a Solr core in (string) order, page by
+    page using cursorMark deep paging
+    """
+    cursor_mark = '*'
+
+    while True:
+        results = solr.search(
+            q=q,
+            fl='id',
+            sort='id asc',
+            rows=page_size,
+            cursorMark=cursor_mark
+        )
+
+        for doc in results.docs:
+            yield str(doc['id'])
+
+        # Solr returns the same cursor mark when there are no more results:
+        if not results.nextCursorMark \
+                or results.nextCursorMark == cursor_mark:
+            return
+        cursor_mark = results.nextCursorMark
+
+
+def diff_sorted_ids(database_ids, solr_ids):
+    """
+    Merge two iterators of ids sorted in the same order, yielding
+    ('missing', id) for ids which are only in the database and ('stale', id)
+    for ids which are only in Solr
+    """
+    database_ids = iter(database_ids)
+    solr_ids = iter(solr_ids)
+
+    database_id = next(database_ids, None)
+    solr_id = next(solr_ids, None)
+
+    while database_id is not None or solr_id is not None:
+        if solr_id is None or (
+                database_id is not None and database_id < solr_id):
+            yield 'missing', database_id
+            database_id = next(database_ids, None)
+
+        elif database_id is None or solr_id < database_id:
+            yield 'stale', solr_id
+            solr_id = next(solr_ids, None)
+
+        else:
+            database_id = next(database_ids, None)
+            solr_id = next(solr_ids, None)
+
+
+def reconcile(queryset, solr, on_stale, on_missing=None, batch_size=1000,
+              page_size=10000):
+    """
+    Compare the ids in the database with the ids in a Solr core without
+    loading either of them in memory at once.
+
+    Keyword arguments:
+    on_stale -- called with lists of (at most batch_size) ids of documents
+    which are in Solr but not in the database any longer
+    on_missing -- called with lists of ids which are in the database but not
+    in Solr, if given
+
+    Returns the number of stale and missing ids
+    """
+    batches = {'stale': [], 'missing': []}
+    callbacks = {'stale': on_stale, 'missing': on_missing}
+    counts = {'stale': 0, 'missing': 0}
+
+    for kind, object_id in diff_sorted_ids(
+            iter_database_ids(queryset, page_size),
+            iter_solr_ids(solr, page_size)):
+        counts[kind] += 1
+
+        if callbacks[kind] is None:
+            continue
+
+        batches[kind].append(int(object_id))
+        if len(batches[kind]) >= batch_size:
+            callbacks[kind](batches[kind])
+            batches[kind] = []
+
+    for kind, batch in batches.items():
+        if batch:
+            callbacks[kind](batch)
+
+    return counts
@@ -1,11 +1,119 @@
 # If on Python 2.X
 from __future__ import print_function
 
+import logging
+import threading
+from collections import OrderedDict
+
 import pysolr
 from django.conf import settings
 
+from solr.utils import get_codelist_fields, get_prefetches
+
+logger = logging.getLogger(__name__)
+
 solr = pysolr.Solr('', always_commit=True)
 
+_local = threading.local()
+
+
+class IndexingBuffer(object):
+    """
+    Collects the documents added through BaseTaskIndexing per Solr core and
+    posts them in batches, without committing after every request.
+
+    Used as a context manager, f.e. around parsing a whole dataset:
+
+        with IndexingBuffer():
+            ...  # ActivityTaskIndexing(activity, related=True).run() etc.
+
+    Everything still buffered is posted when the block is left, followed by
+    one commit per core (or none at all when commit_within is set, Solr then
+    commits by itself within that many milliseconds).
+    """
+
+    def __init__(self, batch_size=None, commit_within=None):
+        self.batch_size = batch_size or settings.SOLR.get('batch_size', 500)
+        commit_within = commit_within or settings.SOLR.get('commit_within')
+        # pysolr sets this as an attribute on the <add> message:
+        self.commit_within = str(commit_within) if commit_within else None
+
+        # core url -> (the core's client, list of buffered documents)
+        self.buffers = OrderedDict()
+        # core url -> {'documents': .., 'flushes': .., 'commits': ..}
+        self.stats = OrderedDict()
+
+    @staticmethod
+    def current():
+        """
+        Returns the active buffer of this thread, if any
+        """
+        buffers = getattr(_local, 'buffers', None)
+        return buffers[-1] if buffers else None
+
+    def __enter__(self):
+        if not hasattr(_local, 'buffers'):
+            _local.buffers = []
+        _local.buffers.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.buffers.remove(self)
+        self.flush()
+        self.commit()
+
+    def get_stats(self, solr):
+        return self.stats.setdefault(solr.url, {
+            'documents': 0,
+            'flushes': 0,
+            'commits': 0,
+        })
+
+    def add(self, solr, docs):
+        _, buffered = self.buffers.setdefault(solr.url, (solr, []))
+        buffered.extend(docs)
+
+        if len(buffered) >= self.batch_size:
+            self.flush(solr)
+
+    def delete(self, solr, **kwargs):
+        # Documents added before the delete must not be posted after it:
+        self.flush(solr)
+        solr.delete(commit=False, **kwargs)
+        self.buffers.setdefault(solr.url, (solr, []))
+
+    def flush(self, solr=None):
+        """
+        Post the buffered documents of a core, or of all cores
+        """
+        if solr is None:
+            cores = list(self.buffers.values())
+        else:
+            cores = [self.buffers.get(solr.url, (solr, []))]
+
+        for solr, buffered in cores:
+            while buffered:
+                docs = buffered[:self.batch_size]
+                solr.add(docs, commit=False, commitWithin=self.commit_within)
+                del buffered[:self.batch_size]
+
+                stats = self.get_stats(solr)
+                stats['documents'] += len(docs)
+                stats['flushes'] += 1
+
+    def commit(self):
+        if self.commit_within:
+            return
+
+        for solr, _ in self.buffers.values():
+            try:
+                solr.commit()
+            except pysolr.SolrError as e:
+                logger.error(e)
+                continue
+
+            self.get_stats(solr)['commits'] += 1
+
 
 class BaseTaskIndexing(object):
     instance = None
@@ -13,6 +121,10 @@ class BaseTaskIndexing(object):
     indexing = None
     model = None
     solr = solr
+    # Related rows loaded in bulk when indexing many instances (see
+    # get_queryset), codelists are joined in on every level:
+    select_related = ()
+    prefetch_related = ()
 
     def __init__(self, instance=None, related=False):
         self.instance = instance
@@ -21,19 +133,74 @@ class BaseTaskIndexing(object):
     def run_related(self):
         pass
 
+    def run_related_batch(self, ids):
+        pass
+
+    def add(self, docs):
+        buffer = IndexingBuffer.current()
+        if buffer is not None:
+            buffer.add(self.solr, docs)
+        else:
+            self.solr.add(docs)
+
+    def delete_by(self, **kwargs):
+        buffer = IndexingBuffer.current()
+        if buffer is not None:
+            buffer.delete(self.solr, **kwargs)
+        else:
+            self.solr.delete(**kwargs)
+
     def run(self):
         if settings.SOLR.get('indexing'):
             # pylint: disable=not-callable
-            self.solr.add([self.indexing(self.instance).data])
+            self.add([self.indexing(self.instance).data])
 
             if self.related:
                 self.run_related()
 
     def delete(self):
         if settings.SOLR.get('indexing'):
-            self.solr.delete(q='id:{id}'.format(id=self.instance.id))
+            self.delete_by(q='id:{id}'.format(id=self.instance.id))
+
+    def get_queryset(self):
+        return self.model.objects.select_related(
+            *self.select_related,
+            *get_codelist_fields(self.model)
+        ).prefetch_related(
+            *get_prefetches(
+                self.model,
+                self.prefetch_related,
+                self.select_related
+            )
+        )
+
+    def run_batch(self, ids):
+        """
+        Index the instances with the given ids, loading their related rows
+        with one query per relation for the whole batch
+        """
+        if not settings.SOLR.get('indexing'):
+            return
+
+        if IndexingBuffer.current() is None:
+            with IndexingBuffer():
+                return self.run_batch(ids)
+
+        for instance in self.get_queryset().filter(id__in=ids):
+            # pylint: disable=not-callable
+            self.add([self.indexing(instance).data])
+
+        if self.related:
+            self.run_related_batch(ids)
+
+    def run_all(self, chunk_size=1000):
+        """
+        Index all instances, in batches of chunk_size ids so the prefetched
+        related rows of only one batch are in memory at once
+        """
+        ids = list(
+            self.model.objects.order_by('id').values_list('id', flat=True))
 
-    def run_all(self):
-        for instance in self.model.objects.all():
-            self.instance = instance
-            self.run()
+        with IndexingBuffer():
+            for i in range(0, len(ids), chunk_size):
+                self.run_batch(ids[i:i + chunk_size])
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from mock import patch
+
+from api.codelist.serializers import NarrativeSerializer
+from iati.factory import iati_factory
+from iati.models import Activity, Narrative
+from solr.activity.indexing import ActivityIndexing
+from solr.activity.tasks import ActivityTaskIndexing
+from solr.utils import narrative_dict
+
+
+def create_activity(iati_identifier):
+    activity = iati_factory.ActivityFactory.create(
+        iati_identifier=iati_identifier,
+        normalized_iati_identifier=iati_identifier)
+
+    title = iati_factory.TitleFactory.create(activity=activity)
+    iati_factory.NarrativeFactory.create(
+        related_object=title, activity=activity, content='Title')
+
+    description = iati_factory.DescriptionFactory.create(activity=activity)
+    iati_factory.NarrativeFactory.create(
+        related_object=description, activity=activity, content='Description')
+
+    iati_factory.ActivityDateFactory.create(activity=activity)
+    iati_factory.ParticipatingOrganisationFactory.create(activity=activity)
+    iati_factory.ActivitySectorFactory.create(activity=activity)
+    iati_factory.ActivityRecipientCountryFactory.create(activity=activity)
+    iati_factory.BudgetFactory.create(activity=activity)
+
+    return activity
+
+
+@override_settings(SOLR=dict(settings.SOLR, indexing=True))
+class ActivityBatchIndexingTestCase(TestCase):
+
+    def setUp(self):
+        self.activity_ids = [
+            create_activity('IATI-{}'.format(i)).id for i in range(3)
+        ]
+
+    def count_queries(self, ids):
+        with CaptureQueriesContext(connection) as context:
+            ActivityTaskIndexing().run_batch(ids)
+        return len(context.captured_queries)
+
+    @patch.object(ActivityTaskIndexing, 'add')
+    def test_queries_per_batch_are_constant(self, add):
+        # the first run fills caches, like the one of content types:
+        self.count_queries(self.activity_ids[:1])
+        queries = self.count_queries(self.activity_ids[:1])
+
+        with self.assertNumQueries(queries):
+            ActivityTaskIndexing().run_batch(self.activity_ids)
+
+        self.assertEqual(add.call_count, 2 + len(self.activity_ids))
+
+    @patch.object(ActivityTaskIndexing, 'run_batch')
+    def test_run_all_in_batches(self, run_batch):
+        ActivityTaskIndexing().run_all(chunk_size=2)
+
+        self.assertEqual(
+            [call[0][0] for call in run_batch.call_args_list],
+            [self.activity_ids[:2], self.activity_ids[2:]])
+
+    def test_batch_document_is_unchanged(self):
+        activity_id = self.activity_ids[0]
+
+        self.assertEqual(
+            ActivityIndexing(
+                ActivityTaskIndexing().get_queryset().get(id=activity_id)
+            ).data,
+            ActivityIndexing(Activity.objects.get(id=activity_id)).data)
+
+    def test_narrative_dict(self):
+        narrative = Narrative.objects.select_related('language').first()
+
+        self.assertEqual(
+            narrative_dict(narrative), NarrativeSerializer(narrative).data)
@@ -0,0 +1,47 @@
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from solr.management.commands.rebuild_solr_index import Checkpoint
+
+
+class CheckpointTestCase(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'checkpoint.json')
+
+    def test_resume_from_checkpoint(self):
+        checkpoint = Checkpoint(self.path)
+        checkpoint.add('activity', 1, 1001)
+        checkpoint.add('activity', 1001, 2001)
+        checkpoint.add('budget', 1, 1001)
+
+        resumed = Checkpoint(self.path)
+
+        self.assertTrue(resumed.is_done('activity', 1001, 2001))
+        self.assertTrue(resumed.is_done('budget', 1, 1001))
+        self.assertFalse(resumed.is_done('activity', 2001, 3001))
+        self.assertFalse(resumed.is_done('transaction', 1, 1001))
+
+    def test_other_chunk_size(self):
+        checkpoint = Checkpoint(self.path)
+        checkpoint.add('activity', 1, 1001)
+
+        resumed = Checkpoint(self.path)
+
+        # the chunk with the same start covers more ids now:
+        self.assertFalse(resumed.is_done('activity', 1, 2001))
+
+    def test_clear_cores(self):
+        checkpoint = Checkpoint(self.path)
+        checkpoint.add('activity', 1, 1001)
+        checkpoint.add('budget', 1, 1001)
+
+        checkpoint.clear(['activity'])
+        self.assertFalse(Checkpoint(self.path).is_done('activity', 1, 1001))
+        self.assertTrue(Checkpoint(self.path).is_done('budget', 1, 1001))
+
+        checkpoint.clear(['budget'])
+        self.assertFalse(os.path.isfile(self.path))
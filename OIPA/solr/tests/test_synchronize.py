@@ -0,0 +1,56 @@
+from django.test import SimpleTestCase
+from mock import MagicMock, patch
+
+from solr.synchronize import diff_sorted_ids, iter_solr_ids, reconcile
+
+
+class SolrResults(object):
+
+    def __init__(self, ids, next_cursor_mark):
+        self.docs = [{'id': id} for id in ids]
+        self.nextCursorMark = next_cursor_mark
+
+
+class SynchronizeTestCase(SimpleTestCase):
+
+    def test_diff_sorted_ids(self):
+        # ids are compared as strings, like Solr sorts them:
+        database_ids = ['1', '10', '2', '3']
+        solr_ids = ['10', '11', '3', '4']
+
+        self.assertEqual(list(diff_sorted_ids(database_ids, solr_ids)), [
+            ('missing', '1'),
+            ('stale', '11'),
+            ('missing', '2'),
+            ('stale', '4'),
+        ])
+
+    def test_iter_solr_ids(self):
+        solr = MagicMock()
+        solr.search.side_effect = [
+            SolrResults(['1', '10'], 'AoE'),
+            SolrResults(['2'], 'AoF'),
+            SolrResults([], 'AoF'),
+        ]
+
+        self.assertEqual(list(iter_solr_ids(solr, page_size=2)),
+                         ['1', '10', '2'])
+        self.assertEqual(
+            [call[1]['cursorMark'] for call in solr.search.call_args_list],
+            ['*', 'AoE', 'AoF'])
+
+    def test_reconcile_in_batches(self):
+        solr = MagicMock()
+        solr.search.side_effect = [
+            SolrResults(['1', '2', '3', '4'], '*'),
+        ]
+        on_stale = MagicMock()
+
+        with patch('solr.synchronize.iter_database_ids',
+                   return_value=iter(['3'])):
+            counts = reconcile(None, solr, on_stale, batch_size=2)
+
+        self.assertEqual(counts, {'stale': 3, 'missing': 0})
+        self.assertEqual(
+            [call[0][0] for call in on_stale.call_args_list],
+            [[1, 2], [4]])
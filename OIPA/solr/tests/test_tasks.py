@@ -0,0 +1,127 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import pysolr
+from django.test import SimpleTestCase, override_settings
+
+from solr.tasks import BaseTaskIndexing, IndexingBuffer
+
+
+class StubSolrHandler(BaseHTTPRequestHandler):
+    """
+    Records the update requests, and answers them like Solr does
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        url = urlparse(self.path)
+        self.server.requests.append({
+            'path': url.path,
+            'params': parse_qs(url.query),
+            'body': body.decode('utf-8'),
+        })
+
+        response = json.dumps({'responseHeader': {'status': 0}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubIndexing(object):
+
+    def __init__(self, instance):
+        self.data = {'id': instance.id}
+
+
+@override_settings(SOLR={'indexing': True})
+class IndexingBufferTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubSolrHandler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever).start()
+
+        url = 'http://127.0.0.1:{}/solr/'.format(self.server.server_port)
+
+        class ActivityIndexing(BaseTaskIndexing):
+            indexing = StubIndexing
+            solr = pysolr.Solr(url + 'activity', always_commit=True)
+
+        class TransactionIndexing(BaseTaskIndexing):
+            indexing = StubIndexing
+            solr = pysolr.Solr(url + 'transaction', always_commit=True)
+
+        self.activity_indexing = ActivityIndexing
+        self.transaction_indexing = TransactionIndexing
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def requests(self, core):
+        return [
+            request for request in self.server.requests
+            if request['path'].startswith('/solr/{}/'.format(core))
+        ]
+
+    def test_without_buffer_every_document_is_committed(self):
+        for i in range(3):
+            self.activity_indexing(SimpleNamespace(id=i)).run()
+
+        requests = self.requests('activity')
+        self.assertEqual(len(requests), 3)
+        for request in requests:
+            self.assertEqual(request['params']['commit'], ['true'])
+
+    def test_documents_are_posted_in_batches(self):
+        with IndexingBuffer(batch_size=2) as buffer:
+            for i in range(5):
+                self.activity_indexing(SimpleNamespace(id=i)).run()
+            self.transaction_indexing(SimpleNamespace(id=1)).run()
+
+        activity_requests = self.requests('activity')
+        # 3 batches and one commit:
+        self.assertEqual(len(activity_requests), 4)
+        for request in activity_requests[:3]:
+            self.assertNotIn('commit', request['params'])
+        self.assertIn('<commit', activity_requests[3]['body'])
+
+        self.assertEqual(len(self.requests('transaction')), 2)
+
+        activity_stats = buffer.stats[self.activity_indexing.solr.url]
+        self.assertEqual(activity_stats, {
+            'documents': 5,
+            'flushes': 3,
+            'commits': 1,
+        })
+
+    def test_commit_within(self):
+        activity = SimpleNamespace(id=1)
+
+        with IndexingBuffer(commit_within=10000):
+            self.activity_indexing(activity).run()
+
+        requests = self.requests('activity')
+        self.assertEqual(len(requests), 1)
+        self.assertIn('commitWithin="10000"', requests[0]['body'])
+
+    def test_delete_flushes_buffered_documents_first(self):
+        activity = SimpleNamespace(id=1)
+
+        with IndexingBuffer():
+            self.activity_indexing(activity).run()
+            self.activity_indexing(activity).delete()
+
+        requests = self.requests('activity')
+        self.assertEqual(len(requests), 3)
+        self.assertIn('<add', requests[0]['body'])
+        self.assertIn('<delete', requests[1]['body'])
+        self.assertNotIn('commit', requests[1]['params'])
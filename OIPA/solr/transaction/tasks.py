@@ -22,6 +22,18 @@ class TransactionTaskIndexing(BaseTaskIndexing):
     indexing = TransactionIndexing
     model = Transaction
     solr = solr
+    select_related = ('activity', 'activity__title', 'description')
+    prefetch_related = (
+        'activity__title__narratives',
+        'activity__description_set__narratives',
+        'activity__reporting_organisations__organisation',
+        'activity__activityrecipientcountry_set__country',
+        'activity__activityrecipientregion_set__region',
+        'activity__activitysector_set',
+        'description__narratives',
+        'transactionaidtype_set',
+        'transactionsector_set',
+    )
 
     def run_from_activity(self, activity):
         for transaction in activity.transaction_set.all():
@@ -26,6 +26,6 @@ class TransactionSectorTaskIndexing(BaseTaskIndexing):
 
     def delete(self):
         if settings.SOLR.get('indexing'):
-            self.solr.delete(q='iati_identifier:{iati_identifier}'.format(
+            self.delete_by(q='iati_identifier:{iati_identifier}'.format(
                 iati_identifier=self.instance.transaction.activity
                                     .iati_identifier))
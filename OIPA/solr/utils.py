@@ -1,8 +1,15 @@
 import numbers
+from collections import OrderedDict
 
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist
+from django.db.models import Prefetch
+from django.db.models.constants import LOOKUP_SEP
 from lxml import etree
 
+# Apps with the codelists, vocabularies and geodata which are joined in when
+# loading related rows for the indexing (see get_prefetches):
+CODELIST_APPS = ('geodata', 'iati_codelists', 'iati_vocabulary')
+
 
 def add_value_list(data_list, value=None):
     if value:
@@ -78,8 +85,92 @@ def get_narrative_lang_list(data):
     return lang_list, narrative_list
 
 
+def get_first(related_manager):
+    """
+    The first related object, taken from the prefetched rows if they are
+    loaded (.first() always makes a query)
+    """
+    return next(iter(related_manager.all()), None)
+
+
+def narrative_dict(narrative):
+    """
+    The representation of api.codelist.serializers.NarrativeSerializer,
+    without going through DRF. The narrative's language should be loaded
+    along with it.
+    """
+    language = narrative.language
+
+    return OrderedDict((
+        ('text', narrative.content),
+        ('lang', OrderedDict((
+            ('code', language.code),
+            ('name', language.name),
+        )) if language else None),
+    ))
+
+
+def get_codelist_fields(model):
+    return [
+        field.name for field in model._meta.fields
+        if field.is_relation and field.related_model is not None
+        and field.related_model._meta.app_label in CODELIST_APPS
+    ]
+
+
+def get_relation(model, name):
+    """
+    The relation of a model which is accessed as model.<name>, the way
+    prefetch_related looks it up
+    """
+    for field in model._meta.get_fields():
+        if not field.is_relation:
+            continue
+
+        if field.auto_created and not field.concrete:
+            # a reverse relation, f.e. description_set
+            if field.get_accessor_name() == name:
+                return field
+        elif field.name == name:
+            return field
+
+    raise FieldDoesNotExist(
+        "{} has no relation '{}'".format(model.__name__, name))
+
+
+def get_prefetches(model, lookups, select_related=()):
+    """
+    Prefetch objects for lookups like 'description_set__narratives': one per
+    relation on the way, each of them joining in the codelists of the related
+    model so serializing them doesn't query for every row. Relations which
+    are in select_related are followed without prefetching them.
+    """
+    prefetches = OrderedDict()
+
+    for lookup in lookups:
+        related_model = model
+        path = []
+
+        for name in lookup.split(LOOKUP_SEP):
+            related_model = get_relation(related_model, name).related_model
+            path.append(name)
+            prefetch_to = LOOKUP_SEP.join(path)
+
+            if prefetch_to in select_related or prefetch_to in prefetches:
+                continue
+
+            queryset = related_model._default_manager.select_related(
+                *get_codelist_fields(related_model))
+            if not queryset.ordered:
+                queryset = queryset.order_by('pk')
+
+            prefetches[prefetch_to] = Prefetch(prefetch_to, queryset=queryset)
+
+    return list(prefetches.values())
+
+
 def add_reporting_org(serializer, activity):
-    reporting_organisation = activity.reporting_organisations.first()
+    reporting_organisation = get_first(activity.reporting_organisations)
     if reporting_organisation:
         serializer.add_field('reporting_org_ref', reporting_organisation.ref)
         serializer.add_field(
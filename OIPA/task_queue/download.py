@@ -4,9 +4,9 @@ import logging
 import os
 
 import celery
-import requests
 from django.conf import settings
 
+from iati_synchroniser.dataset_store import DatasetStore
 from iati_synchroniser.models import Dataset, filetype_choices
 
 # Get an instance of a logger
@@ -63,13 +63,18 @@ class DatasetDownloadTask(celery.Task):
 
         return filetype
 
-    def run(self, dataset_data, content, dataset_obj_id, *args, **kwargs):
+    def run(self, dataset_data, sha1, dataset_obj_id, *args, **kwargs):
         """Run the dataset download task"""
 
-        """Based on dataset URL, downloads and saves it in the server
+        """Based on dataset URL, saves the file the DatasetSyncer downloaded
+        to the DatasetStore (by its sha1) in the server
         TODO: create error log (DatasetNote) object if the URL is not
         reachable (requires broader implementation of error logs)
         """
+        if not sha1:
+            logger.info('Dataset %s was not downloaded', dataset_obj_id)
+            return None
+
         if self.is_download_datasets and settings.DOWNLOAD_DATASETS:
             # URL:
             dataset_url = dataset_data['resources'][0]['url']
@@ -139,37 +144,7 @@ class DatasetDownloadTask(celery.Task):
                 full_download_dir,
                 filename
             )
-            # headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X '
-            #                          '10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36'}  # NOQA: E501
-            #
-            # try:
-            #     with open(download_dir_with_filename, 'wb') as f:
-            #         resp = requests.get(dataset_url, verify=False,
-            #                             headers=headers, timeout=30)
-            #         f.write(resp.content)
-            #     # urllib.request.urlretrieve(
-            #     #     dataset_url,
-            #     #     download_dir_with_filename
-            #     # )
-            #
-            # except requests.exceptions.Timeout:
-            #     with open(download_dir_with_filename, 'wb') as f:
-            #         resp = requests.get(dataset_url, verify=False, timeout=30)
-            #         f.write(resp.content)
-            # except (
-            #      requests.exceptions.RequestException,
-            #      ConnectionResetError,
-            #      requests.exceptions.TooManyRedirects,
-            #      requests.exceptions.ReadTimeout,
-            #      # urllib.request.HTTPError,  # 403
-            #      # urllib.request.URLError,  # timeouts
-            #  ):
-            #     pass
-            # finally:
-            #     pass
-
-            with open(download_dir_with_filename, 'wb') as f:
-                f.write(content.encode('utf-8'))
+            DatasetStore().copy(sha1, download_dir_with_filename)
 
             dataset = Dataset.objects.get(id=dataset_obj_id)
             dataset.internal_url = os.path.join(
@@ -0,0 +1,249 @@
+"""
+Exports the ready to publish activities of a publisher to a gzipped IATI XML
+file in MEDIA_ROOT.
+
+The activities are serialized in chunks ordered by id. Every chunk is
+appended to the file as a gzip member of its own, after which the id of its
+last activity and the size of the file are saved next to it. An export which
+was interrupted continues after the last saved chunk when it's started
+again, instead of starting over, as long as the activities did not change
+since and it was interrupted recently (see get_snapshot).
+
+The files are written to a directory named by an HMAC of the publisher id,
+so they can't be found by guessing publisher ids. Their url is only handed
+out by the (token authenticated) export result endpoint.
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db.models import Count, Max
+from lxml import etree
+
+from api.export.serializers import ActivityXMLSerializer
+from api.renderers import XMLRenderer
+from iati.models import Activity
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = 'exports'
+
+
+def get_checksum(path, block_size=65536):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def get_export_dir(publisher_id):
+    """
+    The directory of the exports of a publisher, which can't be derived
+    from its id without the SECRET_KEY
+    """
+    digest = hmac.new(
+        settings.SECRET_KEY.encode('utf-8'),
+        'publisher-{}'.format(publisher_id).encode('utf-8'),
+        hashlib.sha256,
+    ).hexdigest()
+
+    return os.path.join(EXPORT_DIR, digest)
+
+
+class PublisherActivityExport(object):
+    """
+    Use:
+    export = PublisherActivityExport(publisher_id)
+    export.run()
+    """
+
+    # an interrupted export older than this starts over:
+    max_resume_age = 24 * 60 * 60
+
+    def __init__(self, publisher_id, chunk_size=100, progress=None):
+        """
+        progress -- called with the number of activities done and the total
+        after every chunk
+        """
+        self.publisher_id = publisher_id
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.renderer = XMLRenderer()
+
+        self.filename = os.path.join(
+            get_export_dir(publisher_id), 'activities.xml.gz')
+        self.path = os.path.join(settings.MEDIA_ROOT, self.filename)
+        self.part_path = self.path + '.part'
+        self.state_path = self.path + '.state'
+
+    def get_queryset(self):
+        return Activity.objects.filter(
+            ready_to_publish=True,
+            publisher_id=self.publisher_id,
+        )
+
+    def get_snapshot(self):
+        """
+        What changes when the exported activities change: their number and
+        last id, and the last change to any activity of the publisher (which
+        includes activities that are no longer ready to publish)
+        """
+        activities = self.get_queryset().aggregate(
+            count=Count('id'), max_id=Max('id'))
+        last_updated = Activity.objects.filter(
+            publisher_id=self.publisher_id,
+        ).aggregate(last_updated=Max('last_updated_model'))['last_updated']
+
+        return {
+            'count': activities['count'],
+            'max_id': activities['max_id'],
+            'last_updated': last_updated.isoformat() if last_updated else None,
+        }
+
+    def get_url(self):
+        return settings.MEDIA_URL + self.filename.replace(os.sep, '/')
+
+    def get_header(self):
+        header = etree.tostring(
+            etree.Element(
+                self.renderer.root_tag_name, version=self.renderer.version),
+            encoding=self.renderer.charset,
+            xml_declaration=True,
+        )
+        # the empty element is written as <iati-activities .../>, open it:
+        header = header[:-2] + b'>\n'
+
+        if hasattr(settings, 'EXPORT_COMMENT'):
+            header += etree.tostring(
+                etree.Comment(getattr(settings, 'EXPORT_COMMENT')),
+                encoding=self.renderer.charset,
+                pretty_print=True)
+
+        return header
+
+    def get_footer(self):
+        return '</{}>\n'.format(
+            self.renderer.root_tag_name).encode(self.renderer.charset)
+
+    def render_chunk(self, activities):
+        return b''.join(
+            etree.tostring(
+                self.renderer.render_item(
+                    ActivityXMLSerializer(activity).data),
+                encoding=self.renderer.charset,
+                pretty_print=True,
+            )
+            for activity in activities
+        )
+
+    def load_state(self, snapshot):
+        """
+        The state of an interrupted export, None when there is nothing to
+        continue: when the activities changed since (see get_snapshot) or
+        it was started too long ago
+        """
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if state.get('snapshot') != snapshot:
+            logger.info(
+                "The activities of publisher %s changed since the "
+                "interrupted export, starting over", self.publisher_id)
+            return None
+
+        if time.time() - state.get('started', 0) > self.max_resume_age:
+            return None
+
+        try:
+            size = os.path.getsize(self.part_path)
+        except OSError:
+            return None
+
+        if size < state['size']:
+            return None
+
+        # drop whatever was written after the last saved chunk:
+        with open(self.part_path, 'ab') as f:
+            f.truncate(state['size'])
+
+        return state
+
+    def save_state(self, state):
+        state['size'] = os.path.getsize(self.part_path)
+
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def append(self, content):
+        with open(self.part_path, 'ab') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                gz.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def run(self):
+        """
+        Returns the url, checksum (sha256) and size of the export file and
+        the number of activities in it
+        """
+        snapshot = self.get_snapshot()
+        total = snapshot['count']
+
+        state = self.load_state(snapshot)
+        if state is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            open(self.part_path, 'wb').close()
+
+            self.append(self.get_header())
+            state = {
+                'last_id': 0,
+                'done': 0,
+                'snapshot': snapshot,
+                'started': time.time(),
+            }
+            self.save_state(state)
+        else:
+            logger.info(
+                "Continuing the export of publisher %s after activity %s",
+                self.publisher_id, state['last_id'])
+
+        while True:
+            activities = list(
+                self.get_queryset()
+                .filter(id__gt=state['last_id'])
+                .order_by('id')
+                .prefetch_all()[:self.chunk_size]
+            )
+            if not activities:
+                break
+
+            self.append(self.render_chunk(activities))
+
+            state['last_id'] = activities[-1].id
+            state['done'] += len(activities)
+            self.save_state(state)
+
+            if self.progress:
+                self.progress(state['done'], max(total, state['done']))
+
+        self.append(self.get_footer())
+
+        os.replace(self.part_path, self.path)
+        os.remove(self.state_path)
+
+        return {
+            'url': self.get_url(),
+            'checksum': get_checksum(self.path),
+            'size': os.path.getsize(self.path),
+            'activities': state['done'],
+        }
@@ -17,11 +17,9 @@ from django.core.cache import caches
 from django_rq import job
 from redis import Redis
 from rest_framework_extensions.settings import extensions_api_settings
-from rq import Worker
+from rq import Worker, get_current_job
 from rq.job import Job
 
-from api.export.serializers import ActivityXMLSerializer
-from api.renderers import XMLRenderer
 from common.download_file import DownloadFile, hash_file
 from iati.activity_aggregation_calculation import (
     ActivityAggregationCalculation
@@ -37,11 +35,14 @@ from solr.budget.tasks import solr as solr_budget
 from solr.datasetnote.tasks import DatasetNoteTaskIndexing
 from solr.datasetnote.tasks import solr as solr_dataset_note
 from solr.result.tasks import solr as solr_result
+from solr.synchronize import reconcile
 from solr.transaction.tasks import solr as solr_transaction
 from solr.transaction_sector.tasks import solr as solr_transaction_sector
 from task_queue.download import DatasetDownloadTask
+from task_queue.export import PublisherActivityExport
 from task_queue.utils import Tasks
 from task_queue.validation import DatasetValidationTask
+from traceability.retrieve_chains import ChainRetriever
 
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
@@ -284,17 +285,21 @@ def find_replace_source_url(find_url, replace_url):
 
 @job
 def export_publisher_activities(publisher_id):
-    queryset = Activity.objects.all().filter(
-        ready_to_publish=True,
-        publisher_id=publisher_id
-    )
+    """
+    Writes the export to a file in MEDIA_ROOT (see
+    task_queue.export.PublisherActivityExport) and returns its url and
+    checksum. The progress is kept in the meta of the job
+    """
+    current_job = get_current_job()
 
-    serializer = ActivityXMLSerializer(queryset, many=True)
+    def progress(done, total):
+        if current_job is None:
+            return
 
-    xml_renderer = XMLRenderer()
-    xml = xml_renderer.render(serializer.data)
+        current_job.meta['progress'] = {'done': done, 'total': total}
+        current_job.save_meta()
 
-    return xml
+    return PublisherActivityExport(publisher_id, progress=progress).run()
 
 
 #############################
@@ -308,6 +313,9 @@ def update_exchange_rates():
     r = RateParser()
     r.update_rates(force=False)
 
+    if r.changed_rates:
+        recalculate_currency_values.delay(r.changed_rates)
+
 
 @job
 def force_update_exchange_rates():
@@ -316,6 +324,19 @@ def force_update_exchange_rates():
     r = RateParser()
     r.update_rates(force=True)
 
+    if r.changed_rates:
+        recalculate_currency_values.delay(r.changed_rates)
+
+
+@shared_task
+def recalculate_currency_values(changed_rates):
+    """
+    Update the converted values of transactions, budgets and planned
+    disbursements (and their activities) after exchange rates changed
+    """
+    from currency_convert.recalculate import recalculate_values
+    recalculate_values(changed_rates)
+
 
 ###############################
 ######## GEODATA TASKS ########  # NOQA: E266
@@ -517,6 +538,14 @@ def update_activity_count():
         dataset.update_activities_count()
 
 
+@shared_task
+def update_dirty_chains():
+    """
+    Update the traceability chains of the activities changed by the parser
+    """
+    ChainRetriever().update_dirty_chains()
+
+
 # @job
 # def synchronize_solr_indexing():
 #     queue = django_rq.get_queue('solr')
@@ -622,106 +651,48 @@ def update_activity_count():
 
 @shared_task
 def synchronize_solr_indexing():
+    """
+    Delete the Solr documents of rows which are not in the database any
+    longer, and index the activities which are missing in Solr. The ids of
+    both sides are streamed in sorted pages and merged, see
+    solr.synchronize.reconcile
+    """
     solr_budget.timeout = 300
     solr_activity.timeout = 300
     solr_result.timeout = 300
     solr_transaction.timeout = 300
     solr_activity_sector.timeout = 300
     solr_transaction_sector.timeout = 300
+
     # Budget
-    list_budget_id = list(
-        Budget.objects.all().values_list('id', flat=True)
+    reconcile(
+        Budget.objects.all(),
+        solr_budget,
+        on_stale=delete_multiple_rows_budget_in_solr
     )
-    budget_hits = solr_budget.search(q='*:*', fl='id').hits
-    budget_docs = solr_budget.search(
-        q='*:*', fl='id', rows=budget_hits
-    ).docs
-    list_budget_doc_id = [
-        int(budget_doc['id']) for budget_doc in budget_docs
-    ]
-    for ids in divide_delete_ids(list_budget_id, list_budget_doc_id):
-        delete_multiple_rows_budget_in_solr(ids)
 
     # Result
-    list_result_id = list(
-        Result.objects.all().values_list('id', flat=True)
+    reconcile(
+        Result.objects.all(),
+        solr_result,
+        on_stale=delete_multiple_rows_result_in_solr
     )
-    result_hits = solr_result.search(q='*:*', fl='id').hits
-    result_docs = solr_result.search(
-        q='*:*', fl='id', rows=result_hits
-    ).docs
-    list_result_doc_id = [
-        int(result_doc['id']) for result_doc in result_docs
-    ]
-    for ids in divide_delete_ids(list_result_id, list_result_doc_id):
-        delete_multiple_rows_result_in_solr(ids)
-
-    # # Activity-sector
-    # list_activity_sector_id = list(ActivitySector.objects.all().values_list(
-    #     'id', flat=True))
-    # activity_sector_hits = solr_activity_sector.search(q='*:*', fl='id').hits
-    # activity_sector_docs = solr_activity_sector.search(
-    #     q='*:*', fl='id', rows=activity_sector_hits
-    # ).docs
-    # list_activity_sector_doc_id = [
-    #     int(activity_sector_doc['id']) for
-    #     activity_sector_doc in activity_sector_docs
-    # ]
-    # for ids in divide_delete_ids(list_activity_sector_id,
-    # list_activity_sector_doc_id):
-    #     delete_multiple_rows_activity_sector_in_solr(ids)
-    #
-    # # Transaction-sector
-    # list_transaction_sector_id = list(TransactionSector.objects.all().
-    # values_list(
-    #     'id', flat=True
-    # ))
-    # transaction_sector_hits = solr_transaction_sector.search
-    # (q='*:*', fl='id').hits
-    # transaction_sector_docs = solr_transaction_sector.search(
-    #     q='*:*', fl='id', rows=transaction_sector_hits
-    # ).docs
-    # list_transaction_sector_doc_id = [
-    #     int(transaction_sector_doc['id']) for transaction_sector_doc in
-    #     transaction_sector_docs
-    # ]
-    # for ids in divide_delete_ids(list_transaction_sector_id,
-    # list_transaction_sector_doc_id):
-    #     delete_multiple_rows_transaction_sector_in_solr(ids)
 
     # Transaction
-    list_transaction_id = list(
-        Transaction.objects.all().values_list('id', flat=True)
+    reconcile(
+        Transaction.objects.all(),
+        solr_transaction,
+        on_stale=delete_multiple_rows_transaction_in_solr
     )
-    transaction_hits = solr_transaction.search(q='*:*', fl='id').hits
-    transaction_docs = solr_transaction.search(
-        q='*:*', fl='id', rows=transaction_hits
-    ).docs
-    list_transaction_doc_id = [
-        int(transaction_doc['id']) for transaction_doc in transaction_docs
-    ]
-    for ids in divide_delete_ids(list_transaction_id, list_transaction_doc_id):
-        delete_multiple_rows_transaction_in_solr(ids)
 
     # Activity
-    list_activity_id = list(
-        Activity.objects.all().values_list('id', flat=True)
+    reconcile(
+        Activity.objects.all(),
+        solr_activity,
+        on_stale=delete_multiple_rows_activiy_in_solr,
+        on_missing=lambda ids: add_activities_to_solr.delay(activity_ids=ids),
+        batch_size=settings.SOLR.get('batch_size', 500)
     )
-    activity_hits = solr_activity.search(q='*:*', fl='id').hits
-    activity_docs = solr_activity.search(
-        q='*:*', fl='id', rows=activity_hits
-    ).docs
-    list_activity_doc_id = [
-        int(activity_doc['id']) for activity_doc in activity_docs
-    ]
-    for ids in divide_delete_ids(list_activity_id, list_activity_doc_id):
-        delete_multiple_rows_activiy_in_solr(ids)
-
-    for activity_id in (
-            list(set(list_activity_id) - set(list_activity_doc_id))
-    ):
-        # queue.enqueue(add_activity_to_solr, args=(activity_id,))
-        add_activity_to_solr.delay(activity_id=activity_id)
 
     # Dataset Note
     # list_dataset_note_id = list(
@@ -783,6 +754,15 @@ def add_activity_to_solr(activity_id):
         pass
 
 
+@shared_task
+def add_activities_to_solr(activity_ids):
+    """
+    Index a batch of activities (and their transactions, budgets and
+    results), posting the documents in batches
+    """
+    ActivityTaskIndexing(related=True).run_batch(activity_ids)
+
+
 @job
 def delete_dataset_note_in_solr(dataset_note_id):
     solr_dataset_note.delete(q='id:{id}'.format(id=dataset_note_id))
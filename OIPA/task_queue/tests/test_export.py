@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from lxml import etree
+from mock import MagicMock, patch
+
+from iati.factory import iati_factory
+from iati_synchroniser.factory.synchroniser_factory import PublisherFactory
+from task_queue.export import PublisherActivityExport
+
+
+def serialize(activity):
+    return MagicMock(data={'iati_identifier': activity.iati_identifier})
+
+
+@patch('task_queue.export.ActivityXMLSerializer', side_effect=serialize)
+class PublisherActivityExportTestCase(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.publisher = PublisherFactory.create()
+        self.identifiers = ['IATI-1', 'IATI-2', 'IATI-3']
+
+        for iati_identifier in self.identifiers:
+            iati_factory.ActivityFactory.create(
+                iati_identifier=iati_identifier,
+                publisher=self.publisher,
+                ready_to_publish=True,
+            )
+
+        # not ready to publish:
+        iati_factory.ActivityFactory.create(
+            iati_identifier='IATI-4', publisher=self.publisher)
+
+    def get_identifiers(self, export):
+        with gzip.open(export.path) as f:
+            xml = etree.fromstring(f.read())
+
+        self.assertEqual(xml.tag, 'iati-activities')
+        return [element.text for element in xml.iter('iati-identifier')]
+
+    def test_export(self, serializer):
+        progress = []
+        export = PublisherActivityExport(
+            self.publisher.id, chunk_size=2,
+            progress=lambda done, total: progress.append((done, total)))
+
+        result = export.run()
+
+        self.assertEqual(self.get_identifiers(export), self.identifiers)
+        self.assertEqual(progress, [(2, 3), (3, 3)])
+        self.assertEqual(result['activities'], 3)
+        self.assertTrue(result['url'].endswith('/activities.xml.gz'))
+        self.assertNotIn(
+            'publisher-{}'.format(self.publisher.id), result['url'])
+
+        with open(export.path, 'rb') as f:
+            self.assertEqual(
+                result['checksum'], hashlib.sha256(f.read()).hexdigest())
+
+    def interrupt(self):
+        export = PublisherActivityExport(self.publisher.id, chunk_size=2)
+        render_chunk = export.render_chunk
+        chunks = []
+
+        def interrupt_second_chunk(activities):
+            chunks.append(activities)
+            if len(chunks) == 2:
+                raise Exception('interrupted')
+            return render_chunk(activities)
+
+        with patch.object(export, 'render_chunk',
+                          side_effect=interrupt_second_chunk):
+            with self.assertRaises(Exception):
+                export.run()
+
+        return export
+
+    def get_rendered_identifiers(self, export):
+        render_chunk = export.render_chunk
+        rendered = []
+
+        def record_chunk(activities):
+            rendered.extend(a.iati_identifier for a in activities)
+            return render_chunk(activities)
+
+        with patch.object(export, 'render_chunk', side_effect=record_chunk):
+            export.run()
+
+        return rendered
+
+    def test_continue_interrupted_export(self, serializer):
+        export = self.interrupt()
+
+        next_export = PublisherActivityExport(self.publisher.id, chunk_size=2)
+        rendered = self.get_rendered_identifiers(next_export)
+
+        self.assertEqual(rendered, ['IATI-3'])
+        self.assertEqual(self.get_identifiers(export), self.identifiers)
+
+    def test_start_over_when_activities_changed(self, serializer):
+        export = self.interrupt()
+
+        # no longer ready to publish:
+        activity = self.publisher.activity_set.get(iati_identifier='IATI-1')
+        activity.ready_to_publish = False
+        activity.save()
+
+        next_export = PublisherActivityExport(self.publisher.id, chunk_size=2)
+        rendered = self.get_rendered_identifiers(next_export)
+
+        self.assertEqual(rendered, ['IATI-2', 'IATI-3'])
+        self.assertEqual(self.get_identifiers(export), ['IATI-2', 'IATI-3'])
+
+    def test_start_over_when_interrupted_long_ago(self, serializer):
+        self.interrupt()
+
+        next_export = PublisherActivityExport(self.publisher.id, chunk_size=2)
+        next_export.max_resume_age = -1
+        rendered = self.get_rendered_identifiers(next_export)
+
+        self.assertEqual(rendered, self.identifiers)
@@ -9,6 +9,7 @@ import requests
 from django.conf import settings
 from requests.exceptions import RequestException
 
+from iati_synchroniser.dataset_store import DatasetStore
 from iati_synchroniser.models import Dataset
 
 # Get an instance of a logger
@@ -72,38 +73,22 @@ class DatasetValidationTask(celery.Task):
         #                 self._updated()
 
     def _check(self):
-        headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X '
-                                 '10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36'}  # NOQA: E501
-
-        try:
-            get_respons = requests.get(self._dataset.source_url,
-                                       headers=headers, timeout=30)
-            if get_respons.status_code == 200:
-                md5 = hashlib.md5()
-                md5.update(get_respons.content)
-                self._validation_md5 = md5.hexdigest()
-                self._file_id = self._validation_md5 + '.xml'
-                self._get(ad_hoc=False)
-                if self._json_result:
-                    return True
+        store = DatasetStore()
+        sha1 = store.get(self._dataset.source_url)
+        if sha1 is None:
+            return False
 
-        except requests.exceptions.SSLError as e:
-            logger.info('%s (%s)' % (e, type(e)) + self._dataset.source_url)
-            try:
-                resp = requests.get(self._dataset.source_url, headers=headers,
-                verify=False, timeout=30)  # NOQA: E501
-                if resp.status_code == 200:
-                    md5 = hashlib.md5()
-                    md5.update(resp.content)
-                    self._validation_md5 = md5.hexdigest()
-                    self._file_id = self._validation_md5 + '.xml'
-                    self._get(ad_hoc=False)
-                    if self._json_result:
-                        return True
+        md5 = hashlib.md5()
+        with store.open(sha1) as f:
+            for block in iter(lambda: f.read(65536), b''):
+                md5.update(block)
+        self._validation_md5 = md5.hexdigest()
+        self._file_id = self._validation_md5 + '.xml'
 
-            except Exception as e:
-                logger.error(e)
-                return False
+        try:
+            self._get(ad_hoc=False)
+            if self._json_result:
+                return True
 
         except RequestException as e:
             logger.error(e)
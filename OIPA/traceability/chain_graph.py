@@ -0,0 +1,812 @@
+"""
+The activity network of the traceability chains, in memory.
+
+The links between activities are loaded once, with a few queries over all
+incoming funds, disbursements and parent/child related activities, into
+adjacency sets. A chain is a connected component of that network: its begin
+of line (BOL) nodes are the nodes no link ends in, its end of line (EOL)
+nodes those no link starts from, and the tier of a node is the length of the
+longest path from a BOL to it. Everything is computed in memory and the
+chains are written with bulk_create, a batch of chains at a time.
+
+Once built, the chains are kept up to date incrementally: the parser marks
+the activities it changes (see DirtyChains), only the components around
+those are loaded (see ChainGraph.load_around) and only the nodes, links and
+errors that differ from the saved chain are written (see update_chain).
+"""
+from collections import defaultdict, deque
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from iati.models import (
+    Activity, ActivityParticipatingOrganisation, RelatedActivity
+)
+from iati.transaction.models import Transaction
+from traceability.models import (
+    Chain, ChainLink, ChainLinkRelation, ChainNode, ChainNodeError,
+    DirtyChainActivity
+)
+
+INCOMING_FUND = '1'
+DISBURSEMENT = '3'
+EXPENDITURE = '4'
+
+PARENT = '1'
+CHILD = '2'
+
+FUNDING = '1'
+IMPLEMENTING = '4'
+
+CHAIN_MODELS = (ChainLinkRelation, ChainNodeError, ChainLink, ChainNode, Chain)
+
+# The Postgres advisory lock held while the dirty chains are updated:
+CHAIN_UPDATE_LOCK = 25025
+
+
+class DirtyChains(object):
+    """
+    The activities added, changed or removed while parsing a dataset, by
+    iati identifier. Once the dataset has been parsed they are saved as
+    DirtyChainActivity, so ChainRetriever.update_dirty_chains only updates
+    the chains they are (or will be) part of
+    """
+
+    def __init__(self):
+        self.iati_identifiers = set()
+
+    def __len__(self):
+        return len(self.iati_identifiers)
+
+    def mark(self, iati_identifiers):
+        self.iati_identifiers.update(
+            iati_identifier for iati_identifier in iati_identifiers
+            if iati_identifier)
+
+    def save(self):
+        """
+        Save the marked activities, as long as chains are built at all
+        """
+        if self.iati_identifiers and Chain.objects.exists():
+            mark_dirty_activities(self.iati_identifiers)
+
+        self.iati_identifiers = set()
+
+
+class ChainGraph(object):
+    """
+    The links between activities as adjacency sets of activity ids, with the
+    relations (ChainLinkRelation fields) each link is based upon.
+
+    Use:
+    graph = ChainGraph.load()
+    for component in graph.get_components():
+        ...
+    """
+
+    def __init__(self):
+        # iati identifier <-> activity id:
+        self.activity_ids = {}
+        self.iati_identifiers = {}
+
+        self.out_links = defaultdict(set)
+        self.in_links = defaultdict(set)
+        # (start activity id, end activity id): [(relation, from_node,
+        # related_id), ...]
+        self.relations = defaultdict(list)
+        # the activities whose links are loaded, see expand:
+        self.expanded = set()
+
+    @classmethod
+    def load(cls, chunk_size=10000):
+        graph = cls()
+
+        graph.add_activities(
+            Activity.objects.all(), chunk_size=chunk_size)
+        graph.add_transactions(
+            Transaction.objects.all(), chunk_size=chunk_size)
+        graph.add_related_activities(
+            RelatedActivity.objects.all(), chunk_size=chunk_size)
+
+        return graph
+
+    @classmethod
+    def load_around(cls, activity_ids, chunk_size=10000):
+        graph = cls()
+        graph.expand(activity_ids, chunk_size)
+        return graph
+
+    def expand(self, activity_ids, chunk_size=10000):
+        """
+        Load the components of the given activities only, one ring of
+        neighbours at a time, instead of the whole network. Can be called
+        again to add the components of more activities
+        """
+        frontier = set(activity_ids) - self.expanded
+
+        while frontier:
+            frontier = sorted(frontier)
+            for i in range(0, len(frontier), chunk_size):
+                self.expand_activities(frontier[i:i + chunk_size])
+
+            frontier = {
+                neighbour
+                for node in frontier
+                for neighbour in self.out_links.get(node, set()) |
+                self.in_links.get(node, set())
+            } - self.expanded
+
+    def expand_activities(self, activity_ids):
+        """
+        Load the links from and to a batch of activities
+        """
+        self.add_activities(Activity.objects.filter(id__in=activity_ids))
+        self.expanded.update(activity_ids)
+
+        identifiers = [self.iati_identifiers[activity_id]
+                       for activity_id in activity_ids
+                       if activity_id in self.iati_identifiers]
+
+        transactions = Transaction.objects.filter(
+            Q(activity_id__in=activity_ids) |
+            Q(provider_organisation__provider_activity_id__in=activity_ids) |
+            Q(provider_organisation__provider_activity_id__isnull=True,
+              provider_organisation__provider_activity_ref__in=identifiers) |
+            Q(receiver_organisation__receiver_activity_id__in=activity_ids) |
+            Q(receiver_organisation__receiver_activity_id__isnull=True,
+              receiver_organisation__receiver_activity_ref__in=identifiers)
+        )
+        related_activities = RelatedActivity.objects.filter(
+            Q(current_activity_id__in=activity_ids) |
+            Q(ref_activity_id__in=activity_ids) |
+            Q(ref_activity_id__isnull=True, ref__in=identifiers)
+        )
+
+        self.add_transactions(transactions, add_refs=True)
+        self.add_related_activities(related_activities, add_refs=True)
+
+    def add_activities(self, activities, chunk_size=10000):
+        for activity_id, iati_identifier in activities.values_list(
+                'id', 'iati_identifier').iterator(chunk_size=chunk_size):
+            self.activity_ids.setdefault(iati_identifier, activity_id)
+            self.iati_identifiers[activity_id] = iati_identifier
+
+    def add_refs(self, refs):
+        """
+        Load the activities referred to by iati identifier that weren't
+        loaded yet
+        """
+        refs = {ref for ref in refs if ref and ref not in self.activity_ids}
+        if refs:
+            self.add_activities(
+                Activity.objects.filter(iati_identifier__in=refs))
+
+    def add_transactions(self, transactions, chunk_size=10000,
+                         add_refs=False):
+        """
+        Add the links of the incoming funds and disbursements among the
+        given transactions.
+
+        Keyword arguments:
+        add_refs -- load the activities their refs refer to first, for a
+        graph that isn't loaded completely
+        """
+        transactions = transactions.filter(
+            transaction_type__in=[INCOMING_FUND, DISBURSEMENT],
+        ).values_list(
+            'id',
+            'activity_id',
+            'transaction_type_id',
+            'provider_organisation__provider_activity_id',
+            'provider_organisation__provider_activity_ref',
+            'receiver_organisation__receiver_activity_id',
+            'receiver_organisation__receiver_activity_ref',
+        )
+
+        if add_refs:
+            transactions = list(transactions)
+            self.add_refs(
+                ref for row in transactions for ref in (row[4], row[6]))
+        else:
+            transactions = transactions.iterator(chunk_size=chunk_size)
+
+        for (transaction_id, activity_id, transaction_type, provider_id,
+             provider_ref, receiver_id, receiver_ref) in transactions:
+            if transaction_type == INCOMING_FUND:
+                provider_id = self.resolve(provider_id, provider_ref)
+                if provider_id:
+                    self.add_link(provider_id, activity_id, 'incoming_fund',
+                                  'end_node', transaction_id)
+            else:
+                receiver_id = self.resolve(receiver_id, receiver_ref)
+                if receiver_id:
+                    self.add_link(activity_id, receiver_id, 'disbursement',
+                                  'start_node', transaction_id)
+
+    def add_related_activities(self, related_activities, chunk_size=10000,
+                               add_refs=False):
+        related_activities = related_activities.filter(
+            type__in=[PARENT, CHILD],
+        ).values_list(
+            'id', 'current_activity_id', 'type_id', 'ref_activity_id', 'ref')
+
+        if add_refs:
+            related_activities = list(related_activities)
+            self.add_refs(row[4] for row in related_activities)
+        else:
+            related_activities = related_activities.iterator(
+                chunk_size=chunk_size)
+
+        for related_id, activity_id, related_type, ref_id, ref in \
+                related_activities:
+            ref_id = self.resolve(ref_id, ref)
+            if not ref_id:
+                continue
+
+            if related_type == PARENT:
+                self.add_link(ref_id, activity_id, 'parent', 'end_node',
+                              related_id)
+            else:
+                self.add_link(activity_id, ref_id, 'child', 'start_node',
+                              related_id)
+
+    def resolve(self, activity_id, ref):
+        """
+        The id of a referred activity, by its id when it was set while
+        parsing or else by its iati identifier
+        """
+        if activity_id:
+            return activity_id
+        if ref:
+            return self.activity_ids.get(ref)
+        return None
+
+    def add_link(self, start_id, end_id, relation, from_node, related_id):
+        if start_id == end_id:
+            return
+
+        relation = (relation, from_node, str(related_id))
+        relations = self.relations[(start_id, end_id)]
+        # a partly loaded graph finds links from both of their ends:
+        if relation in relations:
+            return
+
+        self.out_links[start_id].add(end_id)
+        self.in_links[end_id].add(start_id)
+        relations.append(relation)
+
+    def get_component(self, activity_id):
+        """
+        The ids of the activities linked to an activity, directly or through
+        others (in either direction), including itself
+        """
+        component = {activity_id}
+        queue = deque([activity_id])
+
+        while queue:
+            node = queue.popleft()
+            for neighbour in self.out_links.get(node, ()):
+                if neighbour not in component:
+                    component.add(neighbour)
+                    queue.append(neighbour)
+            for neighbour in self.in_links.get(node, ()):
+                if neighbour not in component:
+                    component.add(neighbour)
+                    queue.append(neighbour)
+
+        return component
+
+    def get_components(self, activity_ids=None):
+        """
+        The connected components of the given activities, of all linked
+        activities when not given. Each component is yielded once
+        """
+        if activity_ids is None:
+            activity_ids = list(self.out_links) + list(self.in_links)
+
+        seen = set()
+        for activity_id in activity_ids:
+            if activity_id in seen:
+                continue
+
+            component = self.get_component(activity_id)
+            seen |= component
+            yield component
+
+    def get_links(self, component):
+        return [
+            (start_id, end_id)
+            for start_id in component
+            for end_id in self.out_links.get(start_id, ())
+        ]
+
+    def get_bols(self, component):
+        return {node for node in component if not self.in_links.get(node)}
+
+    def get_eols(self, component):
+        return {node for node in component if not self.out_links.get(node)}
+
+    def get_tiers(self, component):
+        """
+        The tier of every node of a component: 0 for the BOLs, for the others
+        the length of the longest path from a BOL to them, so co-funded
+        activities are placed on the deepest level they exist on.
+
+        Nodes on a cycle get the tier they are first reached on, nodes that
+        can't be reached from a BOL (a cycle without a start) get None
+        """
+        tiers = {node: 0 for node in self.get_bols(component)}
+        waiting = {node: len(self.in_links.get(node, ()))
+                   for node in component}
+
+        # longest paths in topological order:
+        queue = deque(tiers)
+        while queue:
+            node = queue.popleft()
+            for end in self.out_links.get(node, ()):
+                tiers[end] = max(tiers.get(end, 0), tiers[node] + 1)
+                waiting[end] -= 1
+                if waiting[end] == 0:
+                    queue.append(end)
+
+        # the nodes on (or after) cycles were never released:
+        queue = deque(node for node in tiers if waiting[node] > 0)
+        while queue:
+            node = queue.popleft()
+            for end in self.out_links.get(node, ()):
+                if waiting[end] > 0 and end not in tiers:
+                    tiers[end] = tiers[node] + 1
+                    queue.append(end)
+
+        return {node: tiers.get(node) for node in component}
+
+
+def get_node_errors(graph, activity_ids):
+    """
+    The broken or missing links of a batch of activities, as
+    (activity id, error_type, mentioned_activity_or_org, warning_level,
+    related_id) tuples (see ChainNodeError)
+    """
+    errors = []
+    provider_refs = defaultdict(set)
+    receiver_refs = defaultdict(set)
+
+    transactions = Transaction.objects.filter(
+        activity_id__in=activity_ids,
+        transaction_type__in=[INCOMING_FUND, DISBURSEMENT, EXPENDITURE],
+    ).values_list(
+        'id',
+        'activity_id',
+        'transaction_type_id',
+        'provider_organisation__id',
+        'provider_organisation__ref',
+        'provider_organisation__provider_activity_id',
+        'provider_organisation__provider_activity_ref',
+        'receiver_organisation__id',
+        'receiver_organisation__ref',
+        'receiver_organisation__receiver_activity_id',
+        'receiver_organisation__receiver_activity_ref',
+    )
+
+    for (transaction_id, activity_id, transaction_type, provider,
+         provider_ref, provider_id, provider_activity_ref, receiver,
+         receiver_ref, receiver_id, receiver_activity_ref) in transactions:
+        if transaction_type == INCOMING_FUND:
+            if provider is None:
+                errors.append(
+                    (activity_id, '1', '', 'error', transaction_id))
+                continue
+
+            provider_refs[activity_id].add(provider_ref)
+            if not provider_activity_ref:
+                errors.append(
+                    (activity_id, '2', '', 'error', transaction_id))
+            elif not graph.resolve(provider_id, provider_activity_ref):
+                errors.append((activity_id, '3', provider_activity_ref,
+                               'error', transaction_id))
+
+        elif transaction_type == DISBURSEMENT:
+            if receiver is None:
+                errors.append(
+                    (activity_id, '4', '', 'warning', transaction_id))
+                continue
+
+            receiver_refs[activity_id].add(receiver_ref)
+            if not receiver_activity_ref:
+                errors.append(
+                    (activity_id, '5', '', 'info', transaction_id))
+            elif not graph.resolve(receiver_id, receiver_activity_ref):
+                errors.append((activity_id, '6', receiver_activity_ref,
+                               'error', transaction_id))
+
+        elif receiver is not None:
+            receiver_refs[activity_id].add(receiver_ref)
+
+    related_activities = RelatedActivity.objects.filter(
+        current_activity_id__in=activity_ids,
+        type__in=[PARENT, CHILD],
+    ).values_list(
+        'id', 'current_activity_id', 'type_id', 'ref_activity_id', 'ref')
+
+    for related_id, activity_id, related_type, ref_id, ref in \
+            related_activities:
+        if not graph.resolve(ref_id, ref):
+            error_type = '7' if related_type == PARENT else '8'
+            errors.append((activity_id, error_type, ref, 'error', related_id))
+
+    participating_organisations = \
+        ActivityParticipatingOrganisation.objects.filter(
+            activity_id__in=activity_ids,
+            role__in=[FUNDING, IMPLEMENTING],
+        ).values_list('id', 'activity_id', 'role_id', 'ref')
+
+    for related_id, activity_id, role, ref in participating_organisations:
+        if role == FUNDING and ref not in provider_refs[activity_id]:
+            errors.append((activity_id, '9', ref, 'info', related_id))
+        elif role == IMPLEMENTING and ref not in receiver_refs[activity_id]:
+            errors.append((activity_id, '10', ref, 'info', related_id))
+
+    return errors
+
+
+def save_chains(graph, components, batch_size=5000):
+    """
+    Write the chains of the components (sets of activity ids), a batch of
+    chains with about batch_size nodes at a time. Returns the number of
+    chains written
+    """
+    count = 0
+    batch = []
+    nodes = 0
+
+    for component in components:
+        batch.append(component)
+        nodes += len(component)
+
+        if nodes >= batch_size:
+            count += save_chain_batch(graph, batch)
+            batch = []
+            nodes = 0
+
+    if batch:
+        count += save_chain_batch(graph, batch)
+
+    return count
+
+
+@transaction.atomic
+def save_chain_batch(graph, components):
+    last_updated = now()
+
+    chains = Chain.objects.bulk_create([
+        Chain(name="Unnamed chain", last_updated=last_updated)
+        for _ in components
+    ])
+
+    chain_nodes = []
+    for chain, component in zip(chains, components):
+        bols = graph.get_bols(component)
+        eols = graph.get_eols(component)
+        tiers = graph.get_tiers(component)
+
+        for activity_id in sorted(component):
+            chain_nodes.append(ChainNode(
+                chain=chain,
+                activity_id=activity_id,
+                activity_oipa_id=activity_id,
+                activity_iati_id=graph.iati_identifiers.get(
+                    activity_id, ''),
+                tier=tiers[activity_id],
+                bol=activity_id in bols,
+                eol=activity_id in eols,
+                checked=True,
+            ))
+
+    chain_nodes = ChainNode.objects.bulk_create(chain_nodes)
+    nodes_by_activity = {
+        (node.chain_id, node.activity_id): node for node in chain_nodes}
+
+    chain_links = []
+    link_relations = []
+    for chain, component in zip(chains, components):
+        for start_id, end_id in graph.get_links(component):
+            chain_links.append(ChainLink(
+                chain=chain,
+                start_node=nodes_by_activity[(chain.id, start_id)],
+                end_node=nodes_by_activity[(chain.id, end_id)],
+            ))
+            link_relations.append(graph.relations[(start_id, end_id)])
+
+    chain_links = ChainLink.objects.bulk_create(chain_links)
+
+    ChainLinkRelation.objects.bulk_create([
+        ChainLinkRelation(
+            chain_link=chain_link,
+            relation=relation,
+            from_node=from_node,
+            related_id=related_id,
+        )
+        for chain_link, relations in zip(chain_links, link_relations)
+        for relation, from_node, related_id in relations
+    ])
+
+    nodes_by_activity = {
+        node.activity_id: node for node in chain_nodes}
+
+    ChainNodeError.objects.bulk_create([
+        ChainNodeError(
+            chain_node=nodes_by_activity[activity_id],
+            error_type=error_type,
+            mentioned_activity_or_org=mentioned_activity_or_org,
+            warning_level=warning_level,
+            related_id=related_id,
+        )
+        for activity_id, error_type, mentioned_activity_or_org,
+        warning_level, related_id
+        in get_node_errors(graph, list(nodes_by_activity))
+    ])
+
+    return len(chains)
+
+
+def delete_all_chains():
+    """
+    Remove all chains at once, without collecting their related rows first
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('TRUNCATE {}'.format(', '.join(
+            connection.ops.quote_name(model._meta.db_table)
+            for model in CHAIN_MODELS)))
+
+
+@transaction.atomic
+def update_chain(graph, chain_id, component, nodes, changed_identifiers=()):
+    """
+    Bring a saved chain up to date with its component (a set of activity
+    ids), by only writing the nodes, links and errors that changed. Nodes
+    are matched on iati identifier, so the nodes of reparsed activities are
+    kept.
+
+    Keyword arguments:
+    nodes -- the saved ChainNodes of the chain
+    changed_identifiers -- the iati identifiers of the changed activities,
+    whose errors are checked again
+    """
+    activity_ids = {
+        graph.iati_identifiers[activity_id]: activity_id
+        for activity_id in component
+    }
+    bols = graph.get_bols(component)
+    eols = graph.get_eols(component)
+    tiers = graph.get_tiers(component)
+
+    # the activities whose errors are checked again:
+    checked = {activity_id for identifier, activity_id in activity_ids.items()
+               if identifier in changed_identifiers}
+
+    kept = {}
+    removed = []
+    for node in nodes:
+        if node.activity_iati_id in activity_ids and \
+                node.activity_iati_id not in kept:
+            kept[node.activity_iati_id] = node
+        else:
+            removed.append(node.id)
+
+    reparsed = []
+    positions = defaultdict(list)
+    for identifier, node in kept.items():
+        activity_id = activity_ids[identifier]
+
+        if node.activity_id != activity_id:
+            reparsed.append((node.id, activity_id))
+            checked.add(activity_id)
+
+        position = (tiers[activity_id], activity_id in bols,
+                    activity_id in eols)
+        if position != (node.tier, node.bol, node.eol):
+            positions[position].append(node.id)
+
+    # with their links and errors:
+    ChainNode.objects.filter(id__in=removed).delete()
+    update_node_activities(reparsed)
+    for (tier, bol, eol), node_ids in positions.items():
+        ChainNode.objects.filter(id__in=node_ids).update(
+            tier=tier, bol=bol, eol=eol)
+
+    added = ChainNode.objects.bulk_create([
+        ChainNode(
+            chain_id=chain_id,
+            activity_id=activity_id,
+            activity_oipa_id=activity_id,
+            activity_iati_id=identifier,
+            tier=tiers[activity_id],
+            bol=activity_id in bols,
+            eol=activity_id in eols,
+            checked=True,
+        )
+        for identifier, activity_id in sorted(activity_ids.items())
+        if identifier not in kept
+    ])
+    checked.update(node.activity_id for node in added)
+
+    node_ids = {identifier: node.id for identifier, node in kept.items()}
+    node_ids.update((node.activity_iati_id, node.id) for node in added)
+    identifiers = {node_id: identifier
+                   for identifier, node_id in node_ids.items()}
+
+    links = {
+        (graph.iati_identifiers[start_id], graph.iati_identifiers[end_id]):
+        sorted(graph.relations[(start_id, end_id)])
+        for start_id, end_id in graph.get_links(component)
+    }
+
+    saved_relations = defaultdict(list)
+    for link_id, relation, from_node, related_id in \
+            ChainLinkRelation.objects.filter(
+                chain_link__chain_id=chain_id,
+            ).values_list(
+                'chain_link_id', 'relation', 'from_node', 'related_id'):
+        saved_relations[link_id].append((relation, from_node, related_id))
+
+    saved = set()
+    removed_links = []
+    changed_links = {}
+    for link_id, start_node_id, end_node_id in ChainLink.objects.filter(
+            chain_id=chain_id).values_list(
+                'id', 'start_node_id', 'end_node_id'):
+        key = (identifiers.get(start_node_id), identifiers.get(end_node_id))
+
+        if key not in links or key in saved:
+            removed_links.append(link_id)
+            checked.update(activity_ids[identifier] for identifier in key
+                           if identifier in activity_ids)
+            continue
+
+        saved.add(key)
+        if sorted(saved_relations[link_id]) != links[key]:
+            changed_links[link_id] = key
+
+    ChainLink.objects.filter(id__in=removed_links).delete()
+    ChainLinkRelation.objects.filter(
+        chain_link_id__in=list(changed_links)).delete()
+
+    new_links = [key for key in sorted(links) if key not in saved]
+    created = ChainLink.objects.bulk_create([
+        ChainLink(
+            chain_id=chain_id,
+            start_node_id=node_ids[start],
+            end_node_id=node_ids[end],
+        )
+        for start, end in new_links
+    ])
+    changed_links.update(zip((link.id for link in created), new_links))
+    for key in new_links:
+        checked.update(activity_ids[identifier] for identifier in key)
+
+    ChainLinkRelation.objects.bulk_create([
+        ChainLinkRelation(
+            chain_link_id=link_id,
+            relation=relation,
+            from_node=from_node,
+            related_id=related_id,
+        )
+        for link_id, key in changed_links.items()
+        for relation, from_node, related_id in links[key]
+    ])
+
+    checked = sorted(checked)
+    ChainNodeError.objects.filter(chain_node_id__in=[
+        node_ids[graph.iati_identifiers[activity_id]]
+        for activity_id in checked
+    ]).delete()
+    ChainNodeError.objects.bulk_create([
+        ChainNodeError(
+            chain_node_id=node_ids[graph.iati_identifiers[activity_id]],
+            error_type=error_type,
+            mentioned_activity_or_org=mentioned_activity_or_org,
+            warning_level=warning_level,
+            related_id=related_id,
+        )
+        for activity_id, error_type, mentioned_activity_or_org,
+        warning_level, related_id
+        in get_node_errors(graph, checked)
+    ])
+
+    Chain.objects.filter(id=chain_id).update(last_updated=now())
+
+
+def update_node_activities(node_activities):
+    """
+    Point the ChainNodes of reparsed activities to their new activity, with
+    one UPDATE for all of them
+    """
+    if not node_activities:
+        return
+
+    sql = """
+        UPDATE {table}
+        SET activity_id = v.activity_id, activity_oipa_id = v.activity_id
+        FROM (VALUES {values}) AS v (id, activity_id)
+        WHERE {table}.id = v.id
+    """.format(
+        table=connection.ops.quote_name(ChainNode._meta.db_table),
+        values=', '.join(['(%s, %s)'] * len(node_activities)),
+    )
+    params = [value for node_activity in node_activities
+              for value in node_activity]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def mark_dirty_activities(iati_identifiers):
+    """
+    Save the iati identifiers of changed activities, an activity is only
+    marked once until its chain is updated. Marking it again while its
+    chain is being updated moves its marked_at, so the mark is kept for the
+    next update (see unmark_dirty_activities)
+    """
+    iati_identifiers = sorted(set(iati_identifiers))
+    if not iati_identifiers:
+        return
+
+    sql = """
+        INSERT INTO {table} (iati_identifier, marked_at)
+        VALUES {values}
+        ON CONFLICT (iati_identifier)
+        DO UPDATE SET marked_at = EXCLUDED.marked_at
+    """.format(
+        table=connection.ops.quote_name(DirtyChainActivity._meta.db_table),
+        values=', '.join(['(%s, %s)'] * len(iati_identifiers)),
+    )
+    marked_at = now()
+    params = [value for iati_identifier in iati_identifiers
+              for value in (iati_identifier, marked_at)]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def get_dirty_activities():
+    """
+    The activities marked since the last update, as (id, iati_identifier,
+    marked_at) tuples
+    """
+    return list(DirtyChainActivity.objects.values_list(
+        'id', 'iati_identifier', 'marked_at'))
+
+
+def unmark_dirty_activities(dirty_activities):
+    """
+    Remove the marks of updated activities (see get_dirty_activities),
+    except for those marked again since
+    """
+    if not dirty_activities:
+        return
+
+    sql = """
+        DELETE FROM {table}
+        USING (VALUES {values}) AS v (id, marked_at)
+        WHERE {table}.id = v.id AND {table}.marked_at = v.marked_at
+    """.format(
+        table=connection.ops.quote_name(DirtyChainActivity._meta.db_table),
+        values=', '.join(['(%s, %s::timestamp)'] * len(dirty_activities)),
+    )
+    params = [value for dirty_activity_id, _, marked_at in dirty_activities
+              for value in (dirty_activity_id, marked_at)]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def lock_chain_updates():
+    """
+    Take the lock of the chain updates until the end of the transaction.
+    False when another update holds it
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_try_advisory_xact_lock(%s)', [CHAIN_UPDATE_LOCK])
+        return cursor.fetchone()[0]
@@ -0,0 +1,29 @@
+# Generated by Django 2.0.13 on 2020-11-20 12:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iati', '0077_activity_content_hash'),
+        ('traceability', '0002_auto_20180430_1400'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyChainActivity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('iati_identifier', models.CharField(max_length=255, unique=True)),
+                ('marked_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='chainnode',
+            name='activity',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='iati.Activity'),
+        ),
+    ]
@@ -25,7 +25,10 @@ class Chain(models.Model):
 
 class ChainNode(models.Model):
     chain = models.ForeignKey(Chain, null=False, on_delete=models.CASCADE)
-    activity = models.ForeignKey(Activity, null=True, on_delete=models.CASCADE)
+    # kept when the activity is replaced by a reparse (or removed), until the
+    # chain is updated:
+    activity = models.ForeignKey(
+        Activity, null=True, on_delete=models.SET_NULL)
     activity_oipa_id = models.IntegerField(blank=False)
     activity_iati_id = models.CharField(max_length=255, blank=False)
     tier = models.IntegerField(null=True, default=None)
@@ -108,3 +111,13 @@ class ChainLinkRelation(models.Model):
     relation = models.CharField(choices=relation_choices, max_length=30)
     from_node = models.CharField(choices=from_choices, max_length=10)
     related_id = models.CharField(max_length=100)
+
+
+class DirtyChainActivity(models.Model):
+    # an activity that was changed since its chain was built, by iati
+    # identifier as the activity is replaced when it's parsed again
+    iati_identifier = models.CharField(max_length=255, unique=True)
+    marked_at = models.DateTimeField(default=now)
+
+    def __unicode__(self):
+        return self.iati_identifier
@@ -0,0 +1,89 @@
+from django.test import SimpleTestCase, TestCase
+
+from iati.factory import iati_factory
+from traceability.chain_graph import ChainGraph
+from traceability.models import Chain, ChainLink, ChainNode
+from traceability.retrieve_chains import ChainRetriever
+
+
+class ChainGraphTestCase(SimpleTestCase):
+
+    def setUp(self):
+        #  1 -> 2 -> 3
+        #   \-------^
+        #  4 -> 5 <-> 6
+        self.graph = ChainGraph()
+        self.graph.add_link(1, 2, 'disbursement', 'start_node', 11)
+        self.graph.add_link(2, 3, 'disbursement', 'start_node', 12)
+        self.graph.add_link(1, 3, 'incoming_fund', 'end_node', 13)
+        self.graph.add_link(4, 5, 'child', 'start_node', 14)
+        self.graph.add_link(5, 6, 'disbursement', 'start_node', 15)
+        self.graph.add_link(6, 5, 'disbursement', 'start_node', 16)
+
+    def test_components(self):
+        self.assertEqual(
+            sorted(map(sorted, self.graph.get_components())),
+            [[1, 2, 3], [4, 5, 6]])
+
+    def test_components_of_activities(self):
+        self.assertEqual(
+            list(self.graph.get_components([3, 2, 7])),
+            [{1, 2, 3}, {7}])
+
+    def test_relations_of_a_link(self):
+        self.graph.add_link(1, 2, 'incoming_fund', 'end_node', 17)
+
+        self.assertEqual(self.graph.relations[(1, 2)], [
+            ('disbursement', 'start_node', '11'),
+            ('incoming_fund', 'end_node', '17'),
+        ])
+
+    def test_bols_and_eols(self):
+        self.assertEqual(self.graph.get_bols({1, 2, 3}), {1})
+        self.assertEqual(self.graph.get_eols({1, 2, 3}), {3})
+
+    def test_tiers_use_longest_path(self):
+        self.assertEqual(
+            self.graph.get_tiers({1, 2, 3}), {1: 0, 2: 1, 3: 2})
+
+    def test_tiers_of_cycle(self):
+        self.assertEqual(
+            self.graph.get_tiers({4, 5, 6}), {4: 0, 5: 1, 6: 2})
+
+    def test_self_links_are_ignored(self):
+        self.graph.add_link(1, 1, 'parent', 'end_node', 18)
+
+        self.assertEqual(self.graph.get_bols({1, 2, 3}), {1})
+
+
+class ChainRetrieverTestCase(TestCase):
+
+    def setUp(self):
+        # IATI-0001 is the parent of IATI-0002:
+        self.related_activity = iati_factory.RelatedActivityFactory.create()
+
+    def test_retrieve_chain_for_all_activities(self):
+        ChainRetriever().retrieve_chain_for_all_activities()
+
+        self.assertEqual(Chain.objects.count(), 1)
+
+        parent = ChainNode.objects.get(activity_iati_id='IATI-0001')
+        child = ChainNode.objects.get(activity_iati_id='IATI-0002')
+        self.assertEqual((parent.bol, parent.eol, parent.tier),
+                         (True, False, 0))
+        self.assertEqual((child.bol, child.eol, child.tier),
+                         (False, True, 1))
+
+        link = ChainLink.objects.get()
+        self.assertEqual((link.start_node, link.end_node), (parent, child))
+        self.assertEqual(
+            list(link.relations.values_list('relation', 'related_id')),
+            [('parent', str(self.related_activity.id))])
+
+    def test_retrieve_chain_replaces_old_chain(self):
+        retriever = ChainRetriever()
+        retriever.retrieve_chain_for_all_activities()
+        retriever.retrieve_chain_by_activity_id('IATI-0002')
+
+        self.assertEqual(Chain.objects.count(), 1)
+        self.assertEqual(ChainNode.objects.count(), 2)
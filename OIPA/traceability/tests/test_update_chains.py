@@ -0,0 +1,148 @@
+import datetime
+
+from django.test import TestCase
+from mock import patch
+
+from iati.factory import iati_factory
+from traceability.chain_graph import (
+    DirtyChains, get_dirty_activities, mark_dirty_activities,
+    unmark_dirty_activities
+)
+from traceability.models import Chain, ChainLink, ChainNode
+from traceability.retrieve_chains import ChainRetriever
+
+
+class DirtyChainsTestCase(TestCase):
+
+    def test_not_saved_without_chains(self):
+        dirty_chains = DirtyChains()
+        dirty_chains.mark(['IATI-0001', '', None])
+
+        self.assertEqual(len(dirty_chains), 1)
+
+        dirty_chains.save()
+
+        self.assertEqual(get_dirty_activities(), [])
+
+    def test_marked_once(self):
+        mark_dirty_activities(['IATI-0001', 'IATI-0002'])
+        mark_dirty_activities(['IATI-0002'])
+
+        dirty_activities = get_dirty_activities()
+        self.assertEqual(
+            sorted(identifier for _, identifier, _ in dirty_activities),
+            ['IATI-0001', 'IATI-0002'])
+
+        unmark_dirty_activities(dirty_activities)
+
+        self.assertEqual(get_dirty_activities(), [])
+
+    def test_marked_again_while_updating(self):
+        mark_dirty_activities(['IATI-0001', 'IATI-0002'])
+        dirty_activities = get_dirty_activities()
+
+        with patch('traceability.chain_graph.now',
+                   return_value=datetime.datetime(2030, 1, 1)):
+            mark_dirty_activities(['IATI-0001'])
+        unmark_dirty_activities(dirty_activities)
+
+        self.assertEqual(
+            [identifier for _, identifier, _ in get_dirty_activities()],
+            ['IATI-0001'])
+
+
+class UpdateDirtyChainsTestCase(TestCase):
+
+    def setUp(self):
+        # IATI-0001 is the parent of IATI-0002, IATI-0003 of IATI-0004:
+        iati_factory.RelatedActivityFactory.create()
+        iati_factory.RelatedActivityFactory.create(
+            ref_activity=iati_factory.ActivityFactory.create(
+                iati_identifier='IATI-0003'),
+            current_activity=iati_factory.ActivityFactory.create(
+                iati_identifier='IATI-0004'),
+            ref='IATI-0003')
+
+        self.retriever = ChainRetriever()
+        self.retriever.retrieve_chain_for_all_activities()
+
+        self.chain = ChainNode.objects.get(activity_iati_id='IATI-0001').chain
+        self.other_chain = ChainNode.objects.get(
+            activity_iati_id='IATI-0003').chain
+
+    def test_nothing_marked(self):
+        self.assertEqual(self.retriever.update_dirty_chains(), 0)
+
+    @patch('traceability.retrieve_chains.update_chain',
+           side_effect=ValueError)
+    def test_marks_are_kept_when_update_fails(self, _):
+        mark_dirty_activities(['IATI-0002'])
+
+        with self.assertRaises(ValueError):
+            self.retriever.update_dirty_chains()
+
+        self.assertEqual(len(get_dirty_activities()), 1)
+
+    @patch('traceability.retrieve_chains.lock_chain_updates',
+           return_value=False)
+    def test_one_update_at_a_time(self, _):
+        mark_dirty_activities(['IATI-0002'])
+
+        self.assertEqual(self.retriever.update_dirty_chains(), 0)
+        self.assertEqual(len(get_dirty_activities()), 1)
+
+    def test_added_activity(self):
+        parent = ChainNode.objects.get(activity_iati_id='IATI-0001')
+        # a new child of IATI-0002:
+        iati_factory.RelatedActivityFactory.create(
+            ref_activity=iati_factory.ActivityFactory.create(
+                iati_identifier='IATI-0002'),
+            current_activity=iati_factory.ActivityFactory.create(
+                iati_identifier='IATI-0005'),
+            ref='IATI-0002')
+        mark_dirty_activities(['IATI-0005'])
+
+        self.assertEqual(self.retriever.update_dirty_chains(), 1)
+
+        self.assertEqual(
+            sorted(self.chain.chainnode_set.values_list(
+                'activity_iati_id', 'tier', 'bol', 'eol')),
+            [('IATI-0001', 0, True, False),
+             ('IATI-0002', 1, False, False),
+             ('IATI-0005', 2, False, True)])
+        self.assertEqual(ChainLink.objects.filter(chain=self.chain).count(), 2)
+        # the saved nodes are kept:
+        self.assertEqual(
+            ChainNode.objects.get(activity_iati_id='IATI-0001'), parent)
+
+    def test_merged_chains(self):
+        # IATI-0002 is the parent of IATI-0003:
+        iati_factory.RelatedActivityFactory.create(
+            ref_activity=iati_factory.ActivityFactory.create(
+                iati_identifier='IATI-0002'),
+            current_activity=iati_factory.ActivityFactory.create(
+                iati_identifier='IATI-0003'),
+            ref='IATI-0002')
+        mark_dirty_activities(['IATI-0003'])
+
+        self.retriever.update_dirty_chains()
+
+        self.assertEqual(Chain.objects.count(), 1)
+        self.assertEqual(ChainNode.objects.count(), 4)
+        self.assertEqual(
+            ChainNode.objects.get(activity_iati_id='IATI-0004').tier, 3)
+
+    def test_removed_activity(self):
+        last_updated = self.other_chain.last_updated
+        iati_factory.ActivityFactory.create(
+            iati_identifier='IATI-0002').delete()
+        mark_dirty_activities(['IATI-0002'])
+
+        self.retriever.update_dirty_chains()
+
+        # without links left:
+        self.assertFalse(Chain.objects.filter(id=self.chain.id).exists())
+        # untouched:
+        self.other_chain.refresh_from_db()
+        self.assertEqual(self.other_chain.last_updated, last_updated)
+        self.assertEqual(ChainNode.objects.count(), 2)